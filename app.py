@@ -1,22 +1,115 @@
-from flask import Flask, request
+from celery.signals import task_postrun
+from flask import Flask, Response, abort, request, stream_with_context
 from flask_pymongo import PyMongo
 from tasks import make_celery
-from scrapy.crawler import CrawlerProcess
+from crawl_runner import ReactorCrawlRunner
+from response_cache import ResponseCache
+from pub_crawler.pub_crawler.asyncio_engine import AsyncioEngine
+from pub_crawler.pub_crawler.normalization import canonical_style, name_key
 from pub_crawler.pub_crawler.spiders.beer_spider import BeerSpider
-import json
-from typing import List, Any
+from serialization import dumps
+import functools
+import itertools
+import math
+import re
+import uuid
+from datetime import datetime
+from typing import Iterable, List, Tuple
+from urllib.parse import urlencode
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
 from os import getenv
 from pydantic import BaseModel, parse_obj_as
+from scrapy.settings import Settings
 
 app = Flask(__name__)
 app.config.update(
     CELERY_BROKER_URL=getenv('CELERY_BROKER_URL'),
     CELERY_RESULT_BACKEND='rpc://',
-    MONGO_URI=getenv('MONGO_URI')
+    MONGO_URI=getenv('MONGO_URI'),
+    # Read API responses are cached by every worker, and in MongoDB for all of them when shared
+    RESPONSE_CACHE_MAX_ENTRIES=int(getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024)),
+    RESPONSE_CACHE_TTL=float(getenv('RESPONSE_CACHE_TTL', 300)),
+    RESPONSE_CACHE_SHARED=getenv('RESPONSE_CACHE_SHARED', 'False').lower() in ('1', 'true', 'yes'),
+    RESPONSE_CACHE_MAX_BODY_SIZE=int(getenv('RESPONSE_CACHE_MAX_BODY_SIZE', 1024 * 1024))
 )
 mongo = PyMongo(app)
 celery = make_celery(app)
+response_cache = ResponseCache(
+    mongo.db,
+    max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+    ttl=app.config['RESPONSE_CACHE_TTL'],
+    shared=app.config['RESPONSE_CACHE_SHARED'],
+    max_body_size=app.config['RESPONSE_CACHE_MAX_BODY_SIZE']
+)
+
+CRAWL_SETTINGS = {
+    "BOT_NAME": "pub_crawler",
+    "SPIDER_MODULES": ["pub_crawler.pub_crawler.spiders"],
+    "NEWSPIDER_MODULE": "pub_crawler.pub_crawler.spiders",
+    "ITEM_PIPELINES": {
+        "pub_crawler.pub_crawler.pipelines.AsyncMongoDBPipeline": 300,
+    },
+    "DOWNLOAD_HANDLERS": {
+        "http": "crawl_runner.SharedPoolHTTPDownloadHandler",
+        "https": "crawl_runner.SharedPoolHTTPDownloadHandler",
+    },
+    "DOWNLOADER_MIDDLEWARES": {
+        "pub_crawler.pub_crawler.middlewares.FrontierMiddleware": 950,
+        "pub_crawler.pub_crawler.middlewares.PageStoreMiddleware": 900,
+    },
+    "EXTENSIONS": {
+        "pub_crawler.pub_crawler.extensions.CrawlJobProgress": 500,
+        "pub_crawler.pub_crawler.extensions.PrometheusExporter": 510,
+    },
+    "CRAWL_JOB_PROGRESS_INTERVAL": 5.0,
+    "PROMETHEUS_PORT": int(getenv("PROMETHEUS_PORT", 9410)),
+    "PROFILE_SLOWEST_PAGES": int(getenv("PROFILE_SLOWEST_PAGES", 0)),
+    "PROFILE_SAMPLE_RATE": float(getenv("PROFILE_SAMPLE_RATE", 0.1)),
+    "PROFILE_DIR": getenv("PROFILE_DIR", "profiles"),
+    "EXTRACTION_PROCESSES": int(getenv("EXTRACTION_PROCESSES", 0)),
+    "EXTRACTION_MAX_PENDING": int(getenv("EXTRACTION_MAX_PENDING", 0)),
+    "EXTRACTION_TEMPLATES_ENABLED": True,
+    "EXTRACTION_TEMPLATES_BACKEND": "mongo",
+    "EXTRACTION_TEMPLATES_MAX_DOMAINS": 1000,
+    "EXTRACTION_MAX_BODY_SIZE": 1024 * 1024,
+    "DOWNLOAD_MAXSIZE": 16 * 1024 * 1024,
+    "CONCURRENT_REQUESTS": 32,
+    "CONCURRENT_REQUESTS_PER_DOMAIN": 2,
+    "DOWNLOAD_DELAY": 1,
+    "FRONTIER_ENABLED": True,
+    "FRONTIER_TTL": 24 * 60 * 60,
+    "FRONTIER_BACKEND": "mongo",
+    "PAGE_STORE_ENABLED": getenv("PAGE_STORE_ENABLED", "False"),
+    "PAGE_STORE_DIR": getenv("PAGE_STORE_DIR", "pages"),
+    "DEEP_CRAWL_MAX_DEPTH": 1,
+    "DEEP_CRAWL_DOMAIN_BUDGET": 0,
+    "DEPTH_PRIORITY": 1,
+    "AUTOTHROTTLE_ENABLED": True,
+    "AUTOTHROTTLE_START_DELAY": 5,
+    "AUTOTHROTTLE_MAX_DELAY": 60,
+    "AUTOTHROTTLE_TARGET_CONCURRENCY": 1.0,
+    "MONGODB_SERVER": "mongo",
+    "MONGODB_PORT": 27017,
+    "MONGO_URI": getenv('MONGO_URI'),
+    "MONGODB_DATABASE": "myDatabase",
+    "MONGODB_COLLECTION": "beer",
+    "MONGODB_BATCH_SIZE": 100,
+    "MONGODB_FLUSH_INTERVAL": 5.0,
+    "MONGODB_WRITE_THREADS": 4,
+}
+# One reactor per worker process, run the worker with a thread pool (`-P threads`) for concurrent crawls
+crawl_runner = ReactorCrawlRunner(CRAWL_SETTINGS)
+# `scrapy` crawls with BeerSpider, `asyncio` only fetches and extracts the given pages, see AsyncioEngine
+CRAWL_ENGINES = ("scrapy", "asyncio")
+# Optional numeric crawl options of the JSON body, their type and smallest valid value (a `domain_budget` of 0
+# means no budget)
+CRAWL_OPTIONS = {
+    "max_depth": (int, 0),
+    "domain_budget": (int, 0),
+    "concurrency_per_domain": (int, 1),
+    "download_delay": (float, 0),
+}
 
 
 class Beer(BaseModel):
@@ -27,68 +120,394 @@ class Beer(BaseModel):
     url: str
 
 
-def stringify(obj: Any, serialize_types: List[type]):
+def cached_response(view):
+    """
+    Serves a GET view from the response cache, keyed by its path and query string. Responses carry an ETag
+    of their body, clients revalidating with If-None-Match get a 304 Not Modified. Responses other than 200s
+    and bodies larger than RESPONSE_CACHE_MAX_BODY_SIZE are not cached.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.path + "?" + urlencode(sorted(request.args.items(multi=True)))
+        generation = response_cache.generation()
+        entry = response_cache.get(key, generation)
+        if entry is None:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            chunks = []
+            size = 0
+            body = iter(response.response)
+            for chunk in body:
+                chunks.append(chunk.encode() if isinstance(chunk, str) else chunk)
+                size += len(chunks[-1])
+                if size > response_cache.max_body_size:
+                    # Streamed on from where the cache gave up
+                    return Response(itertools.chain(chunks, body), mimetype=response.mimetype)
+            entry = response_cache.put(key, generation, b"".join(chunks), response.mimetype)
+
+        response = Response(entry.body, mimetype=entry.mimetype)
+        response.set_etag(entry.etag)
+        # Clients may keep the response but revalidate it before every use
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
+    return wrapper
+
+
+def create_crawl_job(seeds: int) -> str:
+    """
+    Records a queued crawl job, its crawl keeps the document up to date from then on
+
+    :param seeds: Number of seed urls crawled
+    :return: Job id, also used as the Celery task id
+    """
+    job_id = uuid.uuid4().hex
+    mongo.db.crawl_jobs.insert_one({
+        "_id": job_id,
+        "status": "queued",
+        "seeds": seeds,
+        "created_at": datetime.utcnow()
+    })
+    return job_id
+
+
+def crawl_engine() -> str:
+    engine = request.json.get("engine", "scrapy")
+    if engine not in CRAWL_ENGINES:
+        abort(400, description=f"`engine` must be one of {', '.join(CRAWL_ENGINES)}")
+    return engine
+
+
+def crawl_option(name: str, type_: type, minimum: float):
     """
-    Takes a list of object or dictionary of objects and converts all non-serializable items
-    into strings.
+    Crawl options are checked here since a crawl task failing on them would leave its job queued
 
-    :param obj:
-    :param serialize_types: obj:
-    :return:
+    :param name: Optional numeric field of the JSON body, numeric strings are accepted
+    :param type_: int or float
+    :param minimum: Smallest valid value
+    :return: The field as `type_`, None when it is missing
     """
-    if isinstance(obj, list):
-        for i, item in enumerate(obj):
-            obj[i] = stringify(item, serialize_types)
-    elif isinstance(obj, dict):
-        for key, val in obj.items():
-            obj[key] = stringify(val, serialize_types)
+    value = request.json.get(name)
+    if value is None:
+        return None
+    try:
+        number = None if isinstance(value, bool) else type_(value)
+    except (TypeError, ValueError, OverflowError):
+        number = None
+    if isinstance(value, float) and type_ is int and not value.is_integer():
+        number = None
+    if number is None or not math.isfinite(number) or number < minimum:
+        abort(400, description=f"`{name}` must be {'an integer' if type_ is int else 'a number'} of at least {minimum}")
+    return number
 
-    if type(obj) in serialize_types:
-        obj = str(obj)
-    return obj
+
+def crawl_options(names: Iterable[str]) -> dict:
+    return {name: crawl_option(name, *CRAWL_OPTIONS[name]) for name in names}
 
 
 @app.route("/crawl", methods=["POST"])
 def crawl():
     assert request.method == "POST"
-    crawl.delay(request.json["url"])
+    engine = crawl_engine()
+    options = crawl_options(["max_depth", "domain_budget"])
+    job_id = create_crawl_job(1)
+    crawl.apply_async(
+        (request.json["url"],),
+        {
+            **options,
+            "job_id": job_id,
+            "engine": engine
+        },
+        task_id=job_id
+    )
     return {
         "url": request.json["url"],
+        "job_id": job_id,
+        "msg": "Starting Crawl..."
+    }
+
+
+@app.route("/crawl/batch", methods=["POST"])
+def crawl_batch_job():
+    """
+    Starts one crawl over a list of seed urls
+
+    JSON body:
+        urls: Seed urls, crawled together by a single spider
+        max_depth, domain_budget: Optional deep crawl limits, see BeerSpider
+        concurrency_per_domain: Optional maximum of concurrent requests to each domain
+        download_delay: Optional minimum seconds between requests to the same domain
+        engine: Optional `scrapy` (default) to crawl the sites, or `asyncio` to only fetch and extract the
+            given beer pages, without following their links
+    :return: Job id to poll `/crawl/<job_id>` with
+    """
+    urls = request.json.get("urls")
+    if not urls or not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        abort(400, description="`urls` must be a non empty list of urls")
+    engine = crawl_engine()
+    options = crawl_options(CRAWL_OPTIONS)
+    job_id = create_crawl_job(len(urls))
+    crawl_batch.apply_async(
+        (job_id, urls),
+        {
+            **options,
+            "engine": engine
+        },
+        task_id=job_id
+    )
+    return {
+        "job_id": job_id,
+        "seeds": len(urls),
         "msg": "Starting Crawl..."
     }
 
 
+@app.route("/crawl/<job_id>", methods=["GET"])
+def get_crawl_job(job_id: str):
+    """
+    Gets a crawl job's status and statistics, updated while it runs
+
+    Jobs are `queued`, `running`, `finished` (see `finish_reason`) or `failed` (see `error`). Their
+    `progress` holds pages fetched and pages per second, bytes downloaded, items scraped and stored,
+    seconds spent extracting items and error counts.
+    """
+    job = mongo.db.crawl_jobs.find_one({"_id": job_id})
+    if job is None:
+        abort(404, description=f"No crawl job {job_id}")
+    return Response(dumps(job), mimetype="application/json")
+
+
 @app.route("/")
+@cached_response
 def home_page():
     online_users = mongo.db.posts.find({"author": "Mike"})
-    return json.dumps(stringify(list(online_users), [ObjectId]))
+    return dumps(list(online_users))
+
+
+def abv_bound(operator: str, bound: float) -> dict:
+    """
+    Builds a query comparing the free text ABV field, i.e. "9.4%", against a number
+
+    :param operator: Comparison operator, i.e. "$gte"
+    :param bound: ABV in percent
+    :return: `$expr` query, documents without a numeric ABV never match
+    """
+    abv = {"$convert": {
+        "input": {"$trim": {"input": "$ABV", "chars": "% "}},
+        "to": "double",
+        "onError": None,
+        "onNull": None
+    }}
+    return {"$expr": {"$and": [{"$ne": [abv, None]}, {operator: [abv, bound]}]}}
+
+
+def build_items_query(args) -> dict:
+    """
+    Builds a `scrapy_items` query from request arguments
+
+    :param args: Request arguments with optional `after`, `style`, `abv_min` and `abv_max`
+    :return: Query for `find`
+    """
+    conditions = []
+    after = args.get("after")
+    if after:
+        try:
+            conditions.append({"_id": {"$gt": ObjectId(after)}})
+        except InvalidId:
+            abort(400, description=f"Invalid `after` id: {after}")
+    style = args.get("style")
+    if style:
+        conditions.append({"style": {"$regex": re.escape(style), "$options": "i"}})
+    for arg, operator in [("abv_min", "$gte"), ("abv_max", "$lte")]:
+        if arg in args:
+            bound = args.get(arg, type=float)
+            if bound is None:
+                abort(400, description=f"`{arg}` must be a number")
+            conditions.append(abv_bound(operator, bound))
+
+    if len(conditions) > 1:
+        return {"$and": conditions}
+    return conditions[0] if conditions else {}
+
+
+def stream_json_array(documents: Iterable[dict]):
+    yield "["
+    for i, document in enumerate(documents):
+        yield ("," if i else "") + dumps(document)
+    yield "]"
+
+
+def stream_ndjson(documents: Iterable[dict]):
+    for document in documents:
+        yield dumps(document) + "\n"
+
+
+def int_arg(name: str, default: int):
+    """
+    :param name: Query parameter
+    :param default: Value when the parameter is missing
+    :return: The parameter as an int, None when it is not an integer (`type=int` would fall back to the default)
+    """
+    if name not in request.args:
+        return default
+    return request.args.get(name, type=int)
 
 
 @app.route("/data", methods=["GET"])
+@cached_response
 def get_data():
+    """
+    Streams scraped items in `_id` order straight from the cursor.
+
+    Query parameters:
+        limit: Maximum number of items to return
+        after: Only return items after this `_id`, pass the last `_id` of a page to get the next one
+        fields: Comma separated fields to return, `_id` is always included
+        style: Only return items whose style contains this text, case insensitive
+        abv_min, abv_max: Only return items within this ABV range in percent
+        format: `json` (default) for a JSON array or `ndjson` for one item per line
+    """
     # TODO: Get DB/Validation to a point where we can use Pydantic. Right now it invalidates loosely defined data
-    data = mongo.db.scrapy_items.find()
-    # beers = [Beer(**beer_data) for beer_data in data]
-    return json.dumps(stringify(list(data), [ObjectId]), indent=4)
-    # return json.dumps([beer.dict() for beer in beers])
+    limit = int_arg("limit", 0)
+    if limit is None or limit < 0:
+        abort(400, description="`limit` must be a non negative integer, 0 for no limit")
+    fields = request.args.get("fields")
+    projection = {field.strip(): 1 for field in fields.split(",") if field.strip()} if fields else None
+    response_format = request.args.get("format", "json")
+    if response_format not in ("json", "ndjson"):
+        abort(400, description="`format` must be json or ndjson")
+
+    data = mongo.db.scrapy_items.find(build_items_query(request.args), projection).sort("_id", 1).limit(limit)
+    if response_format == "ndjson":
+        return Response(stream_with_context(stream_ndjson(data)), mimetype="application/x-ndjson")
+    return Response(stream_with_context(stream_json_array(data)), mimetype="application/json")
+
+
+BEERS_DEFAULT_LIMIT = 100
+BEERS_MAX_LIMIT = 1000
+
+
+def build_beers_query(args) -> Tuple[dict, List[tuple]]:
+    """
+    Builds a query over the normalized fields of `scrapy_items` from request arguments, along with the order
+    its results are read in, so both are served by one of MongoDBPipeline's query indexes
+
+    :param args: Request arguments with optional `style`, `abv_min`, `abv_max` and `name`
+    :return: Query for `find` and its sort
+    """
+    query = {}
+    style = args.get("style")
+    if style:
+        query["style_canonical"] = canonical_style(style)
+        if query["style_canonical"] is None:
+            abort(400, description=f"`style` does not name a known style: {style}")
+    abv = {}
+    for arg, operator in [("abv_min", "$gte"), ("abv_max", "$lte")]:
+        if arg in args:
+            bound = args.get(arg, type=float)
+            if bound is None:
+                abort(400, description=f"`{arg}` must be a number")
+            abv[operator] = bound
+    if abv:
+        query["abv_pct"] = abv
+    prefix = name_key(args.get("name"))
+    if prefix:
+        # Anchored case sensitive regexes on the case-folded name are index range scans
+        query["name_key"] = {"$regex": "^" + re.escape(prefix)}
+
+    # Sorted by the field the matching index continues with after the style
+    if prefix:
+        return query, [("name_key", 1), ("_id", 1)]
+    if query:
+        return query, [("abv_pct", 1), ("_id", 1)]
+    return query, [("_id", 1)]
+
+
+@app.route("/beers", methods=["GET"])
+@cached_response
+def get_beers():
+    """
+    Looks up beers by style, ABV range and name prefix over the normalized fields and their indexes
+
+    Query parameters:
+        style: Only return beers of this style, matched by the style tag it ends with, i.e. `Hazy IPA`
+            returns every IPA
+        abv_min, abv_max: Only return beers within this ABV range in percent
+        name: Only return beers whose name starts with this text, case insensitive
+        limit: Maximum number of beers to return, 100 by default and at most 1000
+        offset: Number of beers to skip, to get the following pages
+    Beers are sorted by name when filtered by name, else by ABV when filtered at all.
+    """
+    query, sort = build_beers_query(request.args)
+    limit = int_arg("limit", BEERS_DEFAULT_LIMIT)
+    if limit is None or not 0 < limit <= BEERS_MAX_LIMIT:
+        abort(400, description=f"`limit` must be between 1 and {BEERS_MAX_LIMIT}")
+    offset = int_arg("offset", 0)
+    if offset is None or offset < 0:
+        abort(400, description="`offset` must not be negative")
+
+    beers = mongo.db.scrapy_items.find(query, {"content_hash": 0}).sort(sort).skip(offset).limit(limit)
+    return Response(stream_with_context(stream_json_array(beers)), mimetype="application/json")
+
+
+def run_crawl_job(job_id: str, settings: dict, engine: str = "scrapy", **spider_args) -> dict:
+    """
+    Runs a crawl and waits for it, marking its job failed if it could not run
+
+    :param job_id: Crawl job id, None to crawl without a job
+    :param settings: Settings overriding CRAWL_SETTINGS for this crawl
+    :param engine: One of CRAWL_ENGINES, the `asyncio` engine only reads the `url` or `urls` spider argument
+    :param spider_args: BeerSpider arguments
+    :return: The crawl's stats
+    """
+    if job_id is not None:
+        settings = {**settings, "CRAWL_JOB_ID": job_id}
+    try:
+        if engine == "asyncio":
+            # Runs its own event loop on this task's thread
+            urls = spider_args.get("urls") or [spider_args["url"]]
+            return AsyncioEngine.from_settings(Settings({**CRAWL_SETTINGS, **settings})).run(urls)
+        # Blocks this task until the crawl is done, other tasks keep crawling on the same reactor meanwhile
+        return crawl_runner.crawl(BeerSpider, settings=settings, **spider_args).result()
+    except Exception as e:
+        if job_id is None:
+            raise
+        mongo.db.crawl_jobs.update_one(
+            {"_id": job_id},
+            {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()}}
+        )
+        raise
 
 
 @celery.task()
-def crawl(url: str):
-    process = CrawlerProcess(settings={
-        "BOT_NAME": "pub_crawler",
-        "SPIDER_MODULES": ["pub_crawler.pub_crawler.spiders"],
-        "NEWSPIDER_MODULE": "pub_crawler.pub_crawler.spiders",
-        "ITEM_PIPELINES": {
-            "pub_crawler.pub_crawler.pipelines.MongoDBPipeline": 300,
-        },
-        "MONGODB_SERVER": "mongo",
-        "MONGODB_PORT": 27017,
-        "MONGO_URI": getenv('MONGO_URI'),
-        "MONGODB_DATABASE": "myDatabase",
-        "MONGODB_COLLECTION": "beer",
-    })
-    process.crawl(BeerSpider, url=url)
-    process.start()
-    return
+def crawl(url: str, max_depth: int = None, domain_budget: int = None, job_id: str = None, engine: str = "scrapy"):
+    spider_args = {key: val for key, val in [("max_depth", max_depth), ("domain_budget", domain_budget)] if val is not None}
+    run_crawl_job(job_id, {}, engine, url=url, **spider_args)
+    return job_id
+
+
+@celery.task()
+def crawl_batch(
+        job_id: str,
+        urls: list,
+        max_depth: int = None,
+        domain_budget: int = None,
+        concurrency_per_domain: int = None,
+        download_delay: float = None,
+        engine: str = "scrapy"
+):
+    spider_args = {key: val for key, val in [("max_depth", max_depth), ("domain_budget", domain_budget)] if val is not None}
+    settings = {}
+    if concurrency_per_domain is not None:
+        settings["CONCURRENT_REQUESTS_PER_DOMAIN"] = int(concurrency_per_domain)
+    if download_delay is not None:
+        settings["DOWNLOAD_DELAY"] = float(download_delay)
+    run_crawl_job(job_id, settings, engine, urls=urls, **spider_args)
+    return job_id
+
 
+@task_postrun.connect
+def invalidate_response_cache(sender=None, **kwargs):
+    """Drops every cached read API response once a crawl task is done, its items are all written by then"""
+    if sender is not None and sender.name in (crawl.name, crawl_batch.name):
+        response_cache.invalidate()
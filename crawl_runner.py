@@ -0,0 +1,92 @@
+import threading
+from concurrent.futures import Future
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.crawler import Crawler, CrawlerRunner
+from scrapy.utils.log import configure_logging
+from twisted.internet import defer
+
+
+class ReactorCrawlRunner:
+    """
+    Runs crawls on a single Twisted reactor kept alive for the life of the process.
+
+    The reactor can't be restarted once stopped, so it is started on a daemon thread the first time a crawl
+    is requested and never stopped. Crawls may be requested from any thread and run concurrently on it,
+    sharing the process wide MongoDB clients. Every crawl builds its own downloader, whose slots apply the
+    crawl's concurrency settings, but with SharedPoolHTTPDownloadHandler as `DOWNLOAD_HANDLERS` their
+    HTTP(S) connections come from a single pool.
+    """
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.runner = None
+        self.reactor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the reactor thread, if it isn't running already
+        """
+        with self._lock:
+            if self.runner is not None:
+                return
+            from twisted.internet import reactor
+            configure_logging(self.settings)
+            self.runner = CrawlerRunner(self.settings)
+            self.reactor = reactor
+            threading.Thread(
+                target=reactor.run,
+                kwargs={"installSignalHandlers": False},
+                name="crawl-reactor",
+                daemon=True
+            ).start()
+
+    def crawl(self, spidercls, settings: dict = None, **spider_args) -> Future:
+        """
+        Schedules a crawl on the reactor thread
+
+        :param spidercls: Spider class to crawl with
+        :param settings: Settings overriding the runner's for this crawl only
+        :param spider_args: Arguments passed to the spider
+        :return: Future resolved with the crawl's stats once the spider closes
+        """
+        self.start()
+        future = Future()
+        self.reactor.callFromThread(self._crawl, future, spidercls, settings, spider_args)
+        return future
+
+    def _crawl(self, future: Future, spidercls, settings: dict, spider_args: dict):
+        try:
+            if settings:
+                crawler = Crawler(spidercls, {**self.settings, **settings})
+            else:
+                crawler = self.runner.create_crawler(spidercls)
+            d = self.runner.crawl(crawler, **spider_args)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        d.addCallbacks(
+            lambda _: future.set_result(crawler.stats.get_stats()),
+            lambda failure: future.set_exception(failure.value)
+        )
+
+
+class SharedPoolHTTPDownloadHandler(HTTP11DownloadHandler):
+    """
+    Scrapy's HTTP(S) download handler, with one connection pool for all the crawls of the process instead of
+    one per crawl, so connections kept alive by a crawl are reused by the next ones to the same hosts. The
+    pool keeps up to the first crawl's `CONCURRENT_REQUESTS_PER_DOMAIN` idle connections per host.
+    """
+    shared_pool = None
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        # Handlers are built on the reactor thread
+        if SharedPoolHTTPDownloadHandler.shared_pool is None:
+            SharedPoolHTTPDownloadHandler.shared_pool = self._pool
+        self._pool = SharedPoolHTTPDownloadHandler.shared_pool
+
+    def close(self):
+        # The pool outlives the crawl, its idle connections time out on their own
+        return defer.succeed(None)
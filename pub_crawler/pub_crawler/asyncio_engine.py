@@ -0,0 +1,408 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from urllib import parse
+
+import aiohttp
+from protego import Protego
+from scrapy.settings import Settings
+
+from .extensions import CrawlJobProgress
+from .mongo import get_mongo_client
+from .pipelines import MongoDBPipeline
+from .spiders.beer_spider import Extraction, extract_page, seed_domain
+from .templates import open_extraction_templates
+
+
+logger = logging.getLogger(__name__)
+
+
+class EngineStats:
+    """
+    Stats of an AsyncioEngine crawl, with the interface and key names of Scrapy's stats collector so
+    CrawlJobProgress and MongoDBPipeline record them as for a Scrapy crawl
+    """
+
+    def __init__(self):
+        self._stats = {}
+
+    def get_value(self, key, default=None):
+        return self._stats.get(key, default)
+
+    def get_stats(self) -> dict:
+        return self._stats
+
+    def set_value(self, key, value):
+        self._stats[key] = value
+
+    def inc_value(self, key, count=1, start=0):
+        self._stats[key] = self._stats.get(key, start) + count
+
+    def max_value(self, key, value):
+        self._stats[key] = max(self._stats.get(key, value), value)
+
+
+class HostSlot:
+    """
+    Limits the requests to a host to `concurrency` at once, started at least `delay` seconds apart
+    """
+
+    def __init__(self, concurrency: int, delay: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.delay = delay
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.delay > 0:
+            async with self.lock:
+                wait = self.next_start - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self.next_start = time.monotonic() + self.delay
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+
+class AsyncioEngine:
+    """
+    Fetches a list of beer pages and extracts their items with BeerSpider's extractors on a single asyncio
+    event loop, a lean alternative to a Scrapy crawl for targeted re-crawls of known product urls: no
+    reactor, scheduler or middlewares are started and no links are followed.
+
+    Requests share one aiohttp session and its connection pool, at most `CONCURRENT_REQUESTS` at once and
+    `CONCURRENT_REQUESTS_PER_DOMAIN` per host, started `DOWNLOAD_DELAY` seconds apart per host. They time out
+    after `DOWNLOAD_TIMEOUT` seconds and follow the `RETRY_*`, `REDIRECT_*`, `COOKIES_ENABLED`, `USER_AGENT`
+    and `DOWNLOAD_MAXSIZE` settings. With `ROBOTSTXT_OBEY`, each host's robots.txt is fetched once and the urls
+    it disallows are dropped. AutoThrottle, the frontier and the page store are not applied. Pages are extracted
+    like BeerSpider's followed pages, on `EXTRACTION_PROCESSES` worker processes when set, and their items are
+    the spider's.
+    """
+
+    def __init__(
+            self,
+            settings: Settings,
+            pipeline: MongoDBPipeline = None,
+            job_progress: CrawlJobProgress = None,
+            stats: EngineStats = None
+    ):
+        self.settings = settings
+        self.pipeline = pipeline
+        self.job_progress = job_progress
+        self.stats = stats or EngineStats()
+        if pipeline is not None:
+            pipeline.stats = self.stats
+        if job_progress is not None:
+            job_progress.stats = self.stats
+        self.concurrency = max(settings.getint('CONCURRENT_REQUESTS', 16), 1)
+        self.concurrency_per_host = max(settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN', 8), 1)
+        self.delay = settings.getfloat('DOWNLOAD_DELAY', 0)
+        self.obey_robotstxt = settings.getbool('ROBOTSTXT_OBEY', False)
+        self.robotstxt_user_agent = settings.get('ROBOTSTXT_USER_AGENT') or settings.get('USER_AGENT') or '*'
+        self.min_score = settings.getint('BEER_PAGE_MIN_SCORE', 2)
+        self.max_body_size = settings.getint('EXTRACTION_MAX_BODY_SIZE', 0)
+        self.templates = open_extraction_templates(settings)
+        self.processes = settings.getint('EXTRACTION_PROCESSES', 0)
+
+    @classmethod
+    def from_settings(cls, settings: Settings, write_items: bool = True):
+        """
+        Builds an engine writing its items to MongoDB and, when `CRAWL_JOB_ID` is set, its progress to the
+        job's `crawl_jobs` document
+
+        :param settings: Crawl settings
+        :param write_items: Writes the items with MongoDBPipeline
+        """
+        pipeline = None
+        if write_items:
+            pipeline = MongoDBPipeline(
+                mongo_uri=settings.get('MONGO_URI'),
+                mongo_db=settings.get('MONGODB_DATABASE', 'items'),
+                batch_size=settings.getint('MONGODB_BATCH_SIZE', 100),
+                flush_interval=0
+            )
+            pipeline.open_spider(None)
+        job_progress = None
+        if settings.get('CRAWL_JOB_ID'):
+            client = get_mongo_client(settings.get('MONGO_URI'))
+            job_progress = CrawlJobProgress(
+                settings.get('CRAWL_JOB_ID'),
+                client[settings.get('MONGODB_DATABASE', 'items')][CrawlJobProgress.collection_name],
+                None,
+                interval=0
+            )
+        return cls(settings, pipeline, job_progress)
+
+    def run(self, urls: Iterable[str]) -> dict:
+        """
+        Crawls the urls on a new event loop and waits for the crawl
+
+        :param urls: Beer pages
+        :return: The crawl's stats
+        """
+        return asyncio.run(self.crawl(urls))
+
+    async def crawl(self, urls: Iterable[str]) -> dict:
+        """
+        Extracts the items of the urls and writes them with the pipeline, in batches on a thread
+
+        :param urls: Beer pages
+        :return: The crawl's stats
+        """
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        self.stats.set_value('start_time', datetime.utcnow())
+        progress_updates = None
+        if self.job_progress is not None:
+            await loop.run_in_executor(None, self.job_progress.spider_opened, None)
+            progress_updates = asyncio.ensure_future(self.update_progress())
+        if self.templates is not None:
+            await loop.run_in_executor(None, self.templates.load)
+
+        reason = 'finished'
+        documents = []
+        try:
+            async for item in self.items(urls):
+                self.stats.inc_value('item_scraped_count')
+                if self.pipeline is None:
+                    continue
+                documents.append(self.pipeline.to_document(item))
+                if len(documents) >= self.pipeline.batch_size:
+                    await self.write(documents)
+                    documents = []
+            if documents:
+                await self.write(documents)
+        except BaseException:
+            reason = 'failed'
+            raise
+        finally:
+            if progress_updates is not None:
+                progress_updates.cancel()
+            self.stats.set_value('finish_time', datetime.utcnow())
+            self.stats.set_value('finish_reason', reason)
+            self.stats.set_value('elapsed_time_seconds', time.monotonic() - start)
+            if self.templates is not None:
+                await loop.run_in_executor(None, self.templates.save, self.templates.unsaved())
+            if self.job_progress is not None:
+                await loop.run_in_executor(None, self.job_progress.spider_closed, None, reason)
+        return self.stats.get_stats()
+
+    async def items(self, urls: Iterable[str]) -> AsyncIterator[dict]:
+        """
+        Fetches and extracts the urls concurrently
+
+        :param urls: Beer pages
+        :return: Items in the order their pages are extracted
+        """
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return
+        hosts = defaultdict(lambda: HostSlot(self.concurrency_per_host, self.delay))
+        # Parsed robots.txt by scheme and host, fetched by the first of their urls
+        robots = {}
+        requests = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency_per_host)
+        cookie_jar = aiohttp.CookieJar() if self.settings.getbool('COOKIES_ENABLED', True) else aiohttp.DummyCookieJar()
+        headers = {'User-Agent': self.settings.get('USER_AGENT')} if self.settings.get('USER_AGENT') else None
+        executor = None
+        if self.processes > 0:
+            # Spawned rather than forked, for the same reasons as ExtractionPool's
+            executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+
+        async def fetch_and_extract(session, url):
+            if self.obey_robotstxt and not await self.allowed(session, robots, url):
+                return None
+            # Waiting for the host before taking one of the shared request slots, so a busy host does not hold
+            # them while requests to others could run
+            async with hosts[parse.urlparse(url).hostname], requests:
+                page = await self.fetch(session, url)
+            if page is None:
+                return None
+            return await self.extract(*page, executor=executor)
+
+        try:
+            async with aiohttp.ClientSession(
+                    connector=connector,
+                    cookie_jar=cookie_jar,
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=self.settings.getfloat('DOWNLOAD_TIMEOUT', 180))
+            ) as session:
+                tasks = [asyncio.ensure_future(fetch_and_extract(session, url)) for url in urls]
+                try:
+                    for task in asyncio.as_completed(tasks):
+                        item = await task
+                        if item is not None:
+                            yield item
+                finally:
+                    for task in tasks:
+                        task.cancel()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    async def allowed(self, session: aiohttp.ClientSession, robots: Dict[str, asyncio.Future], url: str) -> bool:
+        """
+        Checks a url against its host's robots.txt, like Scrapy's RobotsTxtMiddleware
+
+        :param session: Session of the crawl
+        :param robots: Parsed robots.txt being fetched or fetched, by scheme and host
+        :param url: Page url
+        :return: False when robots.txt disallows the url
+        """
+        url_parts = parse.urlparse(url)
+        key = f"{url_parts.scheme}://{url_parts.netloc}"
+        if key not in robots:
+            robots[key] = asyncio.ensure_future(self.fetch_robotstxt(session, key))
+        parser = await robots[key]
+        if parser is None or parser.can_fetch(url, self.robotstxt_user_agent):
+            return True
+        self.stats.inc_value('robotstxt/forbidden')
+        return False
+
+    async def fetch_robotstxt(self, session: aiohttp.ClientSession, origin: str) -> Optional[Protego]:
+        """
+        :param session: Session of the crawl
+        :param origin: Scheme and host, i.e. "https://www.stonebrewing.com"
+        :return: Parsed robots.txt, None when it could not be downloaded and every url is allowed
+        """
+        self.stats.inc_value('robotstxt/request_count')
+        try:
+            async with session.get(f"{origin}/robots.txt") as response:
+                self.stats.inc_value('robotstxt/response_count')
+                self.stats.inc_value(f'robotstxt/response_status_count/{response.status}')
+                if response.status != 200:
+                    return None
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.stats.inc_value(f'robotstxt/exception_count/{type(e).__name__}')
+            return None
+        return Protego.parse(body.decode('utf-8', errors='ignore'))
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str) -> Optional[tuple]:
+        """
+        Downloads a page, retrying failed downloads like Scrapy's RetryMiddleware
+
+        :param session: Session of the crawl
+        :param url: Page url
+        :return: Final url (after redirects), body and declared encoding, None for pages which could not be
+            downloaded or are not 200 text responses
+        """
+        retries = self.settings.getint('RETRY_TIMES', 2) if self.settings.getbool('RETRY_ENABLED', True) else 0
+        retry_codes = {int(code) for code in self.settings.getlist('RETRY_HTTP_CODES', [])}
+        max_size = self.settings.getint('DOWNLOAD_MAXSIZE', 0)
+        for attempt in range(retries + 1):
+            self.stats.inc_value('downloader/request_count')
+            try:
+                async with session.get(
+                        url,
+                        allow_redirects=self.settings.getbool('REDIRECT_ENABLED', True),
+                        max_redirects=self.settings.getint('REDIRECT_MAX_TIMES', 20)
+                ) as response:
+                    self.stats.inc_value('response_received_count')
+                    self.stats.inc_value(f'downloader/response_status_count/{response.status}')
+                    if response.status in retry_codes and attempt < retries:
+                        self.stats.inc_value('retry/count')
+                        continue
+                    if response.status != 200:
+                        return None
+                    # Pages without a Content-Type are extracted, like Scrapy does with bodies that look like text
+                    if 'Content-Type' in response.headers and not (
+                            response.content_type.startswith('text/') or 'html' in response.content_type
+                            or 'xml' in response.content_type):
+                        self.stats.inc_value('pages/not_text')
+                        return None
+                    body = await self.read_body(response, max_size)
+                    if body is None:
+                        self.stats.inc_value('downloader/response_too_large')
+                        return None
+                    self.stats.inc_value('downloader/response_bytes', len(body))
+                    return str(response.url), body, response.charset
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.stats.inc_value('downloader/exception_count')
+                self.stats.inc_value(f'downloader/exception_type_count/{type(e).__name__}')
+                if attempt < retries:
+                    self.stats.inc_value('retry/count')
+                    continue
+                logger.info("Failed to download %s: %r", url, e)
+                return None
+        return None
+
+    @staticmethod
+    async def read_body(response: aiohttp.ClientResponse, max_size: int) -> Optional[bytes]:
+        """
+        :param response: Response with an unread body
+        :param max_size: Maximum body size in bytes, 0 for no limit
+        :return: Body, None as soon as it exceeds `max_size` (the connection is then dropped)
+        """
+        if not max_size:
+            return await response.read()
+        if (response.content_length or 0) > max_size:
+            return None
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_any():
+            size += len(chunk)
+            if size > max_size:
+                return None
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    async def extract(self, url: str, body: bytes, encoding: Optional[str], executor=None) -> Optional[dict]:
+        """
+        Extracts a downloaded page like BeerSpider.parse_abv does
+
+        :param url: Final url of the page
+        :param body: Response body
+        :param encoding: Encoding declared by the response, None to detect it from the body
+        :param executor: Process pool extracting pages, None to extract on the event loop
+        :return: Item, None when the page is not a beer's page or extraction failed
+        """
+        if self.max_body_size and len(body) > self.max_body_size:
+            self.stats.inc_value('preparse/pages_truncated')
+            self.stats.inc_value('preparse/bytes_truncated', len(body) - self.max_body_size)
+            body = body[:self.max_body_size]
+        domain = seed_domain(url)
+        paths = self.templates.get(domain) if self.templates is not None else None
+        args = (body, url, encoding, self.min_score, paths)
+        try:
+            if executor is not None:
+                extraction: Extraction = await asyncio.get_running_loop().run_in_executor(executor, extract_page, *args)
+            else:
+                extraction = extract_page(*args)
+        except Exception as e:
+            self.stats.inc_value(f'spider_exceptions/{type(e).__name__}')
+            logger.exception("Failed to extract %s", url)
+            return None
+
+        self.stats.inc_value('extraction/time', extraction.seconds)
+        self.stats.inc_value('extraction/pages')
+        self.stats.inc_value('preparse/bytes_stripped', extraction.bytes_stripped)
+        if extraction.template_hits:
+            self.stats.inc_value('templates/hits', len(extraction.template_hits))
+            self.templates.hit(domain, extraction.template_hits)
+        if extraction.learned_paths:
+            self.stats.inc_value('templates/learned', len(extraction.learned_paths))
+            self.templates.learn(domain, extraction.learned_paths)
+        if extraction.item is None:
+            self.stats.inc_value('pages/not_beer')
+        return extraction.item
+
+    async def write(self, documents: List[dict]):
+        result = await asyncio.get_running_loop().run_in_executor(None, self.pipeline.write, documents)
+        self.pipeline.record_write(result)
+
+    async def update_progress(self):
+        interval = self.settings.getfloat('CRAWL_JOB_PROGRESS_INTERVAL', 5.0)
+        if interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            await loop.run_in_executor(None, self.job_progress.update)
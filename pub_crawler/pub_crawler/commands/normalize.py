@@ -0,0 +1,55 @@
+import time
+
+from pymongo import UpdateOne
+from scrapy.commands import ScrapyCommand
+
+from ..normalization import normalized_fields
+from ..pipelines import MongoDBPipeline, content_hash
+
+
+class Command(ScrapyCommand):
+    """
+    Adds the normalized fields MongoDBPipeline writes with every item (`abv_pct`, `style_canonical`,
+    `name_key`) to the stored items written before them, and creates their indexes. With `--all` every
+    item is normalized again, i.e. after the style tags changed.
+    """
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Add the normalized query fields to the stored items"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        # Scrapy >= 2.6 passes an argparse parser, older versions an optparse one
+        add_option = getattr(parser, "add_argument", None) or parser.add_option
+        add_option("--all", dest="all", action="store_true", default=False,
+                   help="normalize every item, not only those without normalized fields")
+
+    def run(self, args, opts):
+        pipeline = MongoDBPipeline(
+            mongo_uri=self.settings.get('MONGO_URI'),
+            mongo_db=self.settings.get('MONGODB_DATABASE', 'items'),
+            batch_size=self.settings.getint('MONGODB_BATCH_SIZE', 100),
+            flush_interval=0
+        )
+        pipeline.open_spider(None)
+        collection = pipeline.db[pipeline.collection_name]
+
+        start = time.monotonic()
+        updated = 0
+        requests = []
+        for document in collection.find({} if opts.all else {'name_key': {'$exists': False}}):
+            document.update(normalized_fields(document))
+            # Kept equal to the hash the pipeline computes, so the next crawl does not rewrite the item
+            fields = {key: document[key] for key in ('abv_pct', 'style_canonical', 'name_key')}
+            fields['content_hash'] = content_hash(document)
+            requests.append(UpdateOne({'_id': document['_id']}, {'$set': fields}))
+            if len(requests) >= pipeline.batch_size:
+                updated += collection.bulk_write(requests, ordered=False).modified_count
+                requests = []
+        if requests:
+            updated += collection.bulk_write(requests, ordered=False).modified_count
+        print(f"Normalized {updated} items in {time.monotonic() - start:.1f}s")
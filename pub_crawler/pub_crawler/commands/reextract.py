@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import time
+from typing import Optional
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from ..page_store import PageStore, StoredPage, read_body
+from ..pipelines import MongoDBPipeline, WriteResult
+from ..spiders.beer_spider import extract_page
+
+
+def reextract_page(directory: str, page: StoredPage, min_score: int, max_body_size: int = 0) -> Optional[dict]:
+    """
+    Extracts the beer of a stored page with the current extractors, in a worker process
+
+    :param directory: PageStore directory
+    :param page: Manifest entry of the page
+    :param min_score: Minimum `score_beer_page` score of a beer's page
+    :param max_body_size: Bytes of the body extracted from, as `EXTRACTION_MAX_BODY_SIZE` (0 for all)
+    :return: Item, or None when the page does not look like a beer's page
+    """
+    body = read_body(directory, page.body_hash)
+    if max_body_size:
+        body = body[:max_body_size]
+    return extract_page(body, page.url, page.encoding, min_score).item
+
+
+def _reextract_page(args) -> Optional[dict]:
+    return reextract_page(*args)
+
+
+class Command(ScrapyCommand):
+    """
+    Re-extracts every page of the PageStore (`PAGE_STORE_DIR`) with the current extractors and upserts the
+    items to MongoDB like MongoDBPipeline does, so improved extractors can be applied without crawling
+    the sites again.
+    """
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Re-extract items from the stored pages and upsert them"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        # Scrapy >= 2.6 passes an argparse parser, older versions an optparse one
+        add_option = getattr(parser, "add_argument", None) or parser.add_option
+        add_option("-p", "--processes", dest="processes", type=int, default=os.cpu_count(),
+                   help="number of extractor processes (default: one per CPU)")
+        add_option("--dry-run", dest="dry_run", action="store_true", default=False,
+                   help="extract the items without writing them")
+
+    def run(self, args, opts):
+        directory = self.settings.get('PAGE_STORE_DIR', 'pages')
+        if not os.path.exists(os.path.join(directory, "manifest.sqlite")):
+            raise UsageError(f"No stored pages in {directory}, crawl with PAGE_STORE_ENABLED first")
+        store = PageStore(directory)
+        pages = list(store.pages())
+        store.close()
+        min_score = self.settings.getint('BEER_PAGE_MIN_SCORE', 2)
+        max_body_size = self.settings.getint('EXTRACTION_MAX_BODY_SIZE', 0)
+
+        pipeline = None
+        if not opts.dry_run:
+            pipeline = MongoDBPipeline(
+                mongo_uri=self.settings.get('MONGO_URI'),
+                mongo_db=self.settings.get('MONGODB_DATABASE', 'items'),
+                batch_size=self.settings.getint('MONGODB_BATCH_SIZE', 100),
+                flush_interval=0
+            )
+            pipeline.open_spider(None)
+
+        start = time.monotonic()
+        items = 0
+        totals = WriteResult(0, 0, 0, 0.0)
+        buffer = []
+        with multiprocessing.get_context("spawn").Pool(max(opts.processes, 1)) as pool:
+            tasks = ((directory, page, min_score, max_body_size) for page in pages)
+            for item in pool.imap_unordered(_reextract_page, tasks, chunksize=8):
+                if item is None:
+                    continue
+                items += 1
+                if pipeline is None:
+                    continue
+                buffer.append(pipeline.to_document(item))
+                if len(buffer) >= pipeline.batch_size:
+                    totals = self._add(totals, pipeline.write(buffer))
+                    buffer = []
+        if pipeline is not None and buffer:
+            totals = self._add(totals, pipeline.write(buffer))
+
+        print(
+            f"Re-extracted {items} items from {len(pages)} pages in {time.monotonic() - start:.1f}s: "
+            f"{totals.written} written, {totals.unchanged} unchanged, {totals.errors} errors"
+        )
+        if totals.errors:
+            self.exitcode = 1
+
+    @staticmethod
+    def _add(totals: WriteResult, result: WriteResult) -> WriteResult:
+        return WriteResult(*(total + value for total, value in zip(totals, result)))
@@ -0,0 +1,132 @@
+from functools import cached_property
+from typing import Dict, List, Tuple
+
+import scrapy
+from lxml import etree
+from parsel.selector import create_root_node
+
+
+_TEXT_NODES = etree.XPath("//text()", smart_strings=False)
+_DESCENDANT_TEXT_NODES = etree.XPath(".//text()", smart_strings=False)
+_LOCATED_DESCENDANT_TEXT_NODES = etree.XPath(".//text()")
+_JSON_LD_SCRIPTS = etree.XPath("//script[@type='application/ld+json']")
+
+# Elements holding code rather than content, removed with their subtrees before a page is indexed
+STRIPPED_TAGS = ("script", "style", "noscript")
+
+# Common symbols that come after a field name
+LABEL_SUFFIXES = ":"
+
+# Longer text nodes (scripts, paragraphs) are never field labels and are left out of the label index
+MAX_LABEL_LENGTH = 100
+
+
+def normalize_label(text: str) -> str:
+    """
+    Normalizes a field label for comparison, i.e. ' Alcohol  by Volume: ' -> 'alcohol by volume'
+
+    :param text: Label text as written on a page or in a list of field spellings
+    :return: Case-folded text with collapsed whitespace and no trailing label symbols
+    """
+    return " ".join(text.split()).rstrip(LABEL_SUFFIXES).rstrip().casefold()
+
+
+def strip_elements(root: etree.ElementBase, tags=STRIPPED_TAGS) -> int:
+    """
+    Removes elements and their subtrees from a document in place, keeping the text following them
+
+    :param root: Root of an lxml document
+    :param tags: Tags of the elements to remove
+    :return: UTF-8 bytes of text removed
+    """
+    stripped = sum(len(text.encode("utf-8")) for element in root.iter(*tags) for text in descendant_texts(element))
+    etree.strip_elements(root, *tags, with_tail=False)
+    return stripped
+
+
+def descendant_texts(element: etree.ElementBase, located: bool = False) -> List[str]:
+    """
+    Returns all text nodes below an element, equivalent to `.//text()`
+
+    :param element: An lxml element
+    :param located: Returns lxml smart strings, which know the element they belong to (see `text_path`)
+    :return: List of text nodes in document order
+    """
+    return _LOCATED_DESCENDANT_TEXT_NODES(element) if located else _DESCENDANT_TEXT_NODES(element)
+
+
+class DocumentIndex:
+    """
+    Parsed view of a response which is built once and shared by every extractor, so the document
+    tree is walked a single time instead of once per XPath/CSS query.
+
+    `script`, `style` and `noscript` elements (inline code and JSON blobs can reach megabytes) are
+    stripped from the document before it is indexed, so no extractor scans them. The index parses its
+    own tree rather than stripping `response.selector`'s, which links are still extracted from.
+    """
+
+    heading_tags = ["h1", "h2"]
+
+    def __init__(self, response: scrapy.http.TextResponse):
+        """
+        :param response: A TextResponse object
+        """
+        self.url = response.url
+        # Parsed like parsel does but with lxml's plain HTML parser, lxml.html looks up the Python class of
+        # every element proxy the index walks
+        self.root = create_root_node(response.text, etree.HTMLParser, base_url=response.url)
+
+        # Bodies of the JSON-LD scripts, read before the scripts are stripped
+        self.json_ld: List[str] = [script.text for script in _JSON_LD_SCRIPTS(self.root) if script.text]
+        self.bytes_stripped = strip_elements(self.root)
+
+    # The text nodes and the element walk are only computed once an extractor needs them, pages extracted
+    # through a learned template never do
+
+    @cached_property
+    def texts(self) -> List[str]:
+        """All text nodes in document order, as returned by `//text()`"""
+        return _TEXT_NODES(self.root)
+
+    @cached_property
+    def elements_by_label(self) -> Dict[str, etree.ElementBase]:
+        """First element (in document order) having a direct text node which normalizes to the key"""
+        return self._walk[0]
+
+    @cached_property
+    def headings(self) -> Dict[str, List[List[str]]]:
+        """Text nodes (smart strings) of every heading element, keyed by heading tag"""
+        return self._walk[1]
+
+    @cached_property
+    def item_types(self) -> List[str]:
+        """Schema.org microdata `itemtype`s"""
+        return self._walk[2]
+
+    @cached_property
+    def _walk(self) -> Tuple[Dict[str, etree.ElementBase], Dict[str, List[List[str]]], List[str]]:
+        elements_by_label = {}
+        headings = {tag: [] for tag in self.heading_tags}
+        item_types = []
+
+        def add_label(text, element):
+            if len(text) > MAX_LABEL_LENGTH:
+                return
+            label = normalize_label(text)
+            if label:
+                elements_by_label.setdefault(label, element)
+
+        for element in self.root.iter():
+            if not isinstance(element.tag, str):
+                # Comments and processing instructions
+                continue
+            if element.text is not None:
+                add_label(element.text, element)
+            for child in element:
+                if child.tail is not None:
+                    add_label(child.tail, element)
+            if element.tag in headings:
+                headings[element.tag].append(descendant_texts(element, located=True))
+            if element.get('itemtype'):
+                item_types.append(element.get('itemtype'))
+        return elements_by_label, headings, item_types
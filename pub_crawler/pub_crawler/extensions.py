@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from prometheus_client import start_http_server
+from pymongo.errors import PyMongoError
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from .mongo import get_mongo_client
+
+
+logger = logging.getLogger(__name__)
+
+# Port of the process' Prometheus endpoint, shared by every crawl the process runs
+_prometheus_port = None
+_prometheus_lock = threading.Lock()
+
+
+class CrawlJobProgress:
+    """
+    Keeps the `crawl_jobs` document of the crawl's `CRAWL_JOB_ID` up to date, so the job's progress can be
+    polled while it runs.
+
+    The job is marked running when the spider opens, its progress is written every
+    `CRAWL_JOB_PROGRESS_INTERVAL` seconds from the crawler's stats and it is marked finished, with its
+    close reason and duration, when the spider closes. Disabled unless `CRAWL_JOB_ID` is set.
+    """
+    collection_name = 'crawl_jobs'
+
+    def __init__(self, job_id, collection, stats, interval=5.0):
+        self.job_id = job_id
+        self.collection = collection
+        self.stats = stats
+        self.interval = interval
+        self.loop = None
+        self.started = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        job_id = crawler.settings.get('CRAWL_JOB_ID')
+        if not job_id:
+            raise NotConfigured
+        client = get_mongo_client(crawler.settings.get('MONGO_URI'))
+        ext = cls(
+            job_id=job_id,
+            collection=client[crawler.settings.get('MONGODB_DATABASE', 'items')][cls.collection_name],
+            stats=crawler.stats,
+            interval=crawler.settings.getfloat('CRAWL_JOB_PROGRESS_INTERVAL', 5.0)
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.started = time.monotonic()
+        self.update(status='running', started_at=datetime.utcnow())
+        if self.interval > 0:
+            self.loop = task.LoopingCall(self.update)
+            self.loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.loop is not None and self.loop.running:
+            self.loop.stop()
+        self.update(
+            status='finished',
+            finish_reason=reason,
+            finished_at=datetime.utcnow(),
+            elapsed_seconds=self.elapsed()
+        )
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started if self.started is not None else 0.0
+
+    def progress(self) -> dict:
+        """
+        Gets the job's progress from the crawler's stats
+
+        :return: Pages fetched and their rate, bytes downloaded, items scraped and stored to MongoDB,
+            time spent extracting items and errors so far
+        """
+        get_value = self.stats.get_value
+        pages_fetched = get_value('response_received_count', 0)
+        elapsed = self.elapsed()
+        return {
+            'pages_fetched': pages_fetched,
+            'pages_per_second': round(pages_fetched / elapsed, 3) if elapsed > 0 else 0.0,
+            'bytes_downloaded': get_value('downloader/response_bytes', 0),
+            'items_scraped': get_value('item_scraped_count', 0),
+            'items_stored': get_value('mongodb/documents_written', 0) + get_value('mongodb/documents_unchanged', 0),
+            'extraction_time': round(get_value('extraction/time', 0.0), 3),
+            'errors': get_value('log_count/ERROR', 0),
+            'download_errors': get_value('downloader/exception_count', 0),
+            'spider_exceptions': sum(
+                count for key, count in self.stats.get_stats().items() if key.startswith('spider_exceptions/')
+            ),
+            'write_errors': get_value('mongodb/write_errors', 0),
+            'items_lost': get_value('mongodb/documents_lost', 0),
+        }
+
+    def update(self, **fields):
+        # A lost progress update is not worth failing the crawl for, the next one catches up
+        try:
+            self.collection.update_one(
+                {'_id': self.job_id},
+                {'$set': {'progress': self.progress(), 'updated_at': datetime.utcnow(), **fields}},
+                upsert=True
+            )
+        except PyMongoError:
+            logger.exception("Failed to update progress of crawl job %s", self.job_id)
+
+
+class PrometheusExporter:
+    """
+    Serves the process' metrics, i.e. the extractor and MongoDB write latency histograms, in the
+    Prometheus text format on `PROMETHEUS_PORT`.
+
+    The endpoint is started by the first crawl of the process and outlives it, so a long-lived worker
+    keeps a single endpoint for all its crawls. Disabled unless `PROMETHEUS_PORT` is set.
+    """
+
+    def __init__(self, port):
+        self.port = port
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        port = crawler.settings.getint('PROMETHEUS_PORT', 0)
+        if not port:
+            raise NotConfigured
+        ext = cls(port)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        return ext
+
+    def spider_opened(self, spider):
+        global _prometheus_port
+        with _prometheus_lock:
+            if _prometheus_port is not None:
+                return
+            try:
+                start_http_server(self.port)
+            except OSError as e:
+                logger.warning("Unable to serve Prometheus metrics on port %d: %s", self.port, e)
+                return
+            _prometheus_port = self.port
+            logger.info("Serving Prometheus metrics on port %d", self.port)
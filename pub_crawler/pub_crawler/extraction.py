@@ -0,0 +1,51 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+
+class ExtractionPool:
+    """
+    Runs CPU bound page extraction on a pool of processes, so the reactor keeps downloading while pages are
+    parsed on every core.
+
+    At most `max_pending` pages are queued or being extracted at once (twice the processes by default).
+    Further pages wait on a DeferredSemaphore, which holds their callbacks, so Scrapy's scraper slot limit
+    pauses downloads instead of responses piling up.
+    """
+
+    def __init__(self, processes: int, max_pending: int = 0):
+        # Workers are spawned rather than forked, forking a process running the reactor and MongoDB
+        # client threads can leave locks held in the children
+        self.executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+        self.semaphore = defer.DeferredSemaphore(max_pending or 2 * processes)
+
+    def submit(self, func, *args) -> defer.Deferred:
+        """
+        Runs a function in a worker process, once there is room in the queue
+
+        :param func: Module level function, it and its arguments are pickled to the worker
+        :param args: Arguments of the function
+        :return: Deferred firing with the function's result on the reactor thread
+        """
+        return self.semaphore.run(self._submit, func, *args)
+
+    def _submit(self, func, *args) -> defer.Deferred:
+        from twisted.internet import reactor
+        d = defer.Deferred()
+        future = self.executor.submit(func, *args)
+        # Futures complete on the executor's thread, Deferreds must fire on the reactor's
+        future.add_done_callback(lambda f: reactor.callFromThread(self._fire, d, f))
+        return d
+
+    @staticmethod
+    def _fire(d: defer.Deferred, future: Future):
+        error = future.exception()
+        if error is not None:
+            d.errback(Failure(error))
+        else:
+            d.callback(future.result())
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import sqlite3
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from pymongo import ReplaceOne
+from scrapy.settings import Settings
+from twisted.internet import defer, threads
+from w3lib.url import canonicalize_url
+
+from .mongo import get_mongo_client
+
+
+logger = logging.getLogger(__name__)
+
+# When a url was last downloaded and the validators its response carried
+FrontierEntry = namedtuple("FrontierEntry", ["fetched_at", "etag", "last_modified"])
+
+
+def url_fingerprint(url: str) -> str:
+    """
+    Fingerprints a url so equivalent urls (query order, fragments, ...) share a frontier entry
+
+    :param url: Standard formatted url string
+    :return: Hex digest of the canonical url
+    """
+    return hashlib.sha1(canonicalize_url(url).encode()).hexdigest()
+
+
+class SQLiteFrontierStore:
+    """
+    Frontier kept in a local SQLite file. Writes are committed in batches of `commit_every` and on close.
+    """
+
+    def __init__(self, path: str, commit_every: int = 100):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS frontier ("
+            "fingerprint TEXT PRIMARY KEY, url TEXT, fetched_at REAL, etag TEXT, last_modified TEXT)"
+        )
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+    def open(self, domains: Iterable[str]):
+        # Entries are read from the file as they are needed
+        pass
+
+    def get(self, fingerprint: str) -> Optional[FrontierEntry]:
+        row = self.connection.execute(
+            "SELECT fetched_at, etag, last_modified FROM frontier WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        return FrontierEntry(*row) if row else None
+
+    def put(self, fingerprint: str, url: str, entry: FrontierEntry):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO frontier (fingerprint, url, fetched_at, etag, last_modified) VALUES (?, ?, ?, ?, ?)",
+            (fingerprint, url, entry.fetched_at, entry.etag, entry.last_modified)
+        )
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.connection.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class MongoFrontierStore:
+    """
+    Frontier kept in a MongoDB collection, shared by every crawler using the same database.
+
+    Lookups and writes never wait on MongoDB on the reactor thread: `open` reads the entries of the crawled
+    domains into memory on a thread before the crawl starts, and entries put are written on a thread in
+    bulk writes of `batch_size` and when the store closes.
+    """
+
+    def __init__(self, collection, batch_size: int = 100):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.domains = []
+        self.entries: Dict[str, FrontierEntry] = {}
+        self.pending: Dict[str, dict] = {}
+        self.pending_writes = set()
+        self.reactor = None
+        self.threadpool = None
+
+    def open(self, domains: Iterable[str]):
+        """
+        Loads the entries of the domains' urls
+
+        :param domains: Crawled domains, their subdomains' urls included
+        :return: Deferred which fires once they are loaded
+        """
+        if self.reactor is None:
+            from twisted.internet import reactor
+            self.reactor = reactor
+            self.threadpool = reactor.getThreadPool()
+        self.domains = [domain.lower() for domain in domains]
+        d = threads.deferToThreadPool(self.reactor, self.threadpool, self.load, self.domains)
+        d.addCallbacks(self._loaded, self._load_failed)
+        return d
+
+    def load(self, domains: List[str]) -> Dict[str, FrontierEntry]:
+        """
+        Reads the entries of the domains' urls, blocking on MongoDB
+
+        :param domains: Crawled domains
+        :return: Entries by fingerprint
+        """
+        self.collection.create_index("domain", name="domain")
+        return {
+            document["_id"]: FrontierEntry(document["fetched_at"], document.get("etag"), document.get("last_modified"))
+            for document in self.collection.find(
+                {"domain": {"$in": domains}}, {"fetched_at": 1, "etag": 1, "last_modified": 1}
+            )
+        }
+
+    def get(self, fingerprint: str) -> Optional[FrontierEntry]:
+        return self.entries.get(fingerprint)
+
+    def put(self, fingerprint: str, url: str, entry: FrontierEntry):
+        self.entries[fingerprint] = entry
+        self.pending[fingerprint] = {"url": url, "domain": self.domain_of(url), **entry._asdict()}
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the entries put since the last flush to a thread which writes them
+
+        :return: Deferred which fires once they are written, or could not be
+        """
+        if not self.pending:
+            return defer.succeed(None)
+        documents, self.pending = self.pending, {}
+        d = threads.deferToThreadPool(self.reactor, self.threadpool, self.write, documents)
+        d.addErrback(self._write_failed, documents)
+        self.pending_writes.add(d)
+        d.addBoth(self._write_done, d)
+        return d
+
+    def write(self, documents: Dict[str, dict]):
+        self.collection.bulk_write(
+            [ReplaceOne({"_id": fingerprint}, document, upsert=True) for fingerprint, document in documents.items()],
+            ordered=False
+        )
+
+    def close(self):
+        """
+        :return: Deferred which fires once every entry put is written
+        """
+        self.flush()
+        return defer.DeferredList(list(self.pending_writes))
+
+    def domain_of(self, url: str) -> str:
+        host = (urlparse(url).hostname or "").lower()
+        matches = [domain for domain in self.domains if host == domain or host.endswith("." + domain)]
+        return max(matches, key=len) if matches else host
+
+    def _loaded(self, entries: Dict[str, FrontierEntry]):
+        # Entries put while loading are newer
+        for fingerprint, entry in entries.items():
+            self.entries.setdefault(fingerprint, entry)
+
+    def _load_failed(self, failure):
+        logger.warning("Could not load the crawl frontier, every page is downloaded: %s", failure.getErrorMessage())
+
+    def _write_failed(self, failure, documents):
+        logger.warning("Could not write %d crawl frontier entries: %s", len(documents), failure.getErrorMessage())
+
+    def _write_done(self, result, d):
+        self.pending_writes.discard(d)
+        return result
+
+
+def open_frontier_store(settings: Settings):
+    """
+    Opens the frontier store selected by the `FRONTIER_BACKEND` setting
+
+    :param settings: Crawler settings
+    :return: SQLiteFrontierStore (`sqlite`, the default) or MongoFrontierStore (`mongo`)
+    """
+    backend = settings.get("FRONTIER_BACKEND", "sqlite")
+    if backend == "sqlite":
+        return SQLiteFrontierStore(settings.get("FRONTIER_DB_PATH", "frontier.sqlite"))
+    if backend == "mongo":
+        client = get_mongo_client(settings.get("MONGO_URI"))
+        return MongoFrontierStore(
+            client[settings.get("MONGODB_DATABASE", "items")]["crawl_frontier"],
+            settings.getint("FRONTIER_BATCH_SIZE", 100)
+        )
+    raise ValueError(f"Unknown FRONTIER_BACKEND: {backend}")
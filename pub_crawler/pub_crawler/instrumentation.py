@@ -0,0 +1,128 @@
+import contextvars
+import cProfile
+import functools
+import heapq
+import itertools
+import logging
+import os
+import pstats
+import random
+import re
+import time
+from contextlib import contextmanager
+from typing import List
+
+from prometheus_client import Histogram
+
+
+logger = logging.getLogger(__name__)
+
+# Extractors take from well under a millisecond to seconds on pathological pages
+EXTRACTOR_SECONDS = Histogram(
+    'pub_crawler_extractor_seconds',
+    'Time spent in each extractor call',
+    ['extractor'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+)
+MONGODB_WRITE_SECONDS = Histogram(
+    'pub_crawler_mongodb_write_seconds',
+    'Time spent writing a batch of items to MongoDB'
+)
+
+_stats = contextvars.ContextVar('stats', default=None)
+
+
+@contextmanager
+def recording_stats(stats):
+    """
+    Records the timings of the `timed` calls made within the block to a crawler's stats as well
+
+    :param stats: Scrapy stats collector
+    """
+    token = _stats.set(stats)
+    try:
+        yield
+    finally:
+        _stats.reset(token)
+
+
+def timed(name: str):
+    """
+    Decorator recording the latency of every call to the `pub_crawler_extractor_seconds` histogram and,
+    within `recording_stats`, to the `timing/<name>/count`, `timing/<name>/time` and
+    `timing/<name>/time_max` stats
+
+    :param name: Name the calls are recorded under
+    """
+    histogram = EXTRACTOR_SECONDS.labels(name)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                histogram.observe(elapsed)
+                stats = _stats.get()
+                if stats is not None:
+                    stats.inc_value(f'timing/{name}/count')
+                    stats.inc_value(f'timing/{name}/time', elapsed)
+                    stats.max_value(f'timing/{name}/time_max', elapsed)
+        return wrapper
+    return decorator
+
+
+class SlowPageProfiler:
+    """
+    Profiles a sample of pages with cProfile and keeps the profiles of the `keep` slowest of them,
+    to be dumped as pstats files once the crawl is done.
+    """
+
+    def __init__(self, keep: int = 10, sample_rate: float = 1.0):
+        self.keep = keep
+        self.sample_rate = sample_rate
+        # Min heap of (seconds, tie breaker, url, pstats.Stats), the fastest kept page on top
+        self.slowest = []
+        self._counter = itertools.count()
+
+    @contextmanager
+    def profile(self, url: str):
+        """
+        Profiles the block, when the page is sampled
+
+        :param url: Url of the page processed in the block
+        """
+        if random.random() >= self.sample_rate:
+            yield
+            return
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            # Only build stats for pages slow enough to be kept
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, (elapsed, next(self._counter), url, pstats.Stats(profiler)))
+            elif self.slowest and elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, next(self._counter), url, pstats.Stats(profiler)))
+
+    def dump(self, directory: str) -> List[str]:
+        """
+        Writes the kept profiles as `<rank>-<url>.pstats`, the slowest page first
+
+        :param directory: Directory to write to, created if missing
+        :return: Paths written
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for rank, (elapsed, _, url, stats) in enumerate(sorted(self.slowest, reverse=True), 1):
+            path = os.path.join(directory, f"{rank:02d}-{re.sub(r'[^A-Za-z0-9]+', '-', url)[:100]}.pstats")
+            stats.dump_stats(path)
+            logger.info("Profiled %s in %.3fs: %s", url, elapsed, path)
+            paths.append(path)
+        return paths
@@ -3,11 +3,19 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+
 from scrapy import signals
+from scrapy.http import TextResponse
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from .frontier import FrontierEntry, open_frontier_store, url_fingerprint
+from .page_store import PageStore
+
 
 class BeerSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +109,122 @@ class BeerDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class FrontierMiddleware:
+    """
+    Skips pages which were downloaded by a previous crawl within `FRONTIER_TTL` seconds.
+
+    Pages older than that are requested conditionally with the ETag/Last-Modified validators of their
+    previous response, a 304 Not Modified answer is dropped before it reaches the spider. Requests with
+    `dont_filter` (i.e. start urls), robots.txt and pages followed for their links (above the spider's
+    `max_depth`, their links would be lost with them) are always downloaded.
+    """
+
+    def __init__(self, store, ttl, stats):
+        self.store = store
+        self.ttl = ttl
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('FRONTIER_ENABLED'):
+            raise NotConfigured
+        s = cls(
+            store=open_frontier_store(crawler.settings),
+            ttl=crawler.settings.getfloat('FRONTIER_TTL', 24 * 60 * 60),
+            stats=crawler.stats
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider):
+        if self.always_download(request, spider):
+            return None
+
+        entry = self.store.get(url_fingerprint(request.url))
+        if entry is None:
+            return None
+        if time.time() - entry.fetched_at < self.ttl:
+            self.stats.inc_value('frontier/skipped_fresh')
+            raise IgnoreRequest(f"Downloaded within FRONTIER_TTL: {request.url}")
+        if entry.etag:
+            request.headers.setdefault('If-None-Match', entry.etag)
+        if entry.last_modified:
+            request.headers.setdefault('If-Modified-Since', entry.last_modified)
+        return None
+
+    def process_response(self, request, response, spider):
+        if self.always_download(request, spider):
+            return response
+
+        fingerprint = url_fingerprint(request.url)
+        if response.status == 304:
+            entry = self.store.get(fingerprint)
+            if entry is not None:
+                self.store.put(fingerprint, request.url, entry._replace(fetched_at=time.time()))
+            self.stats.inc_value('frontier/not_modified')
+            raise IgnoreRequest(f"Not modified since last crawl: {request.url}")
+        if response.status == 200:
+            self.store.put(fingerprint, request.url, FrontierEntry(
+                fetched_at=time.time(),
+                etag=self._header(response, 'ETag'),
+                last_modified=self._header(response, 'Last-Modified')
+            ))
+        return response
+
+    def spider_opened(self, spider):
+        # The crawl starts once the store has loaded the entries of the spider's domains
+        return self.store.open(getattr(spider, 'allowed_domains', None) or [])
+
+    def spider_closed(self, spider):
+        return self.store.close()
+
+    @staticmethod
+    def always_download(request, spider) -> bool:
+        if request.dont_filter or request.method != 'GET':
+            return True
+        # A skipped robots.txt would make RobotsTxtMiddleware allow every url
+        if request.meta.get('dont_obey_robotstxt') or urlparse_cached(request).path == '/robots.txt':
+            return True
+        max_depth = getattr(spider, 'max_depth', None)
+        return max_depth is not None and request.meta.get('depth', 0) < max_depth
+
+    @staticmethod
+    def _header(response, name):
+        value = response.headers.get(name)
+        return value.decode('latin-1') if value else None
+
+
+class PageStoreMiddleware:
+    """
+    Keeps the raw body of every downloaded page in a PageStore under `PAGE_STORE_DIR`, so pages can be
+    re-extracted offline (`scrapy reextract`) instead of being crawled again. Only successful text
+    responses are stored. Disabled unless `PAGE_STORE_ENABLED` is set.
+    """
+
+    def __init__(self, store, stats):
+        self.store = store
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PAGE_STORE_ENABLED'):
+            raise NotConfigured
+        s = cls(
+            store=PageStore(crawler.settings.get('PAGE_STORE_DIR', 'pages')),
+            stats=crawler.stats
+        )
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_response(self, request, response, spider):
+        if response.status == 200 and isinstance(response, TextResponse):
+            written = self.store.put(response.url, response.body, response.encoding)
+            self.stats.inc_value('pagestore/pages')
+            self.stats.inc_value('pagestore/bytes_written', written)
+        return response
+
+    def spider_closed(self, spider):
+        self.store.close()
@@ -0,0 +1,25 @@
+import threading
+
+import pymongo
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_mongo_client(mongo_uri: str) -> pymongo.MongoClient:
+    """
+    Returns the process wide MongoClient for a uri, creating it on first use.
+
+    MongoClient is thread safe and pools its connections, so every crawl run by a long-lived worker
+    shares one client per uri instead of connecting on each spider open. Shared clients are never closed
+    by their users.
+
+    :param mongo_uri: MongoDB connection string
+    :return: Shared MongoClient
+    """
+    with _clients_lock:
+        client = _clients.get(mongo_uri)
+        if client is None:
+            client = _clients[mongo_uri] = pymongo.MongoClient(mongo_uri)
+        return client
@@ -0,0 +1,69 @@
+import re
+from typing import Dict, Optional
+
+from .spiders.beer_spider import STYLE_TAGS
+
+
+# Style tags naming a style, longest first so the most specific tag at a position wins
+CANONICAL_STYLES = sorted({tag.lower() for tag in STYLE_TAGS} - {'style'}, key=len, reverse=True)
+_CANONICAL_STYLE_PATTERN = re.compile(
+    r"\b(?:{})\b".format("|".join(re.escape(style) for style in CANONICAL_STYLES)), re.IGNORECASE
+)
+_ABV_PERCENT_PATTERN = re.compile(r"(\d{1,3}(?:[.,]\d+)?)\s*%")
+_ABV_NUMBER_PATTERN = re.compile(r"\s*(\d{1,3}(?:[.,]\d+)?)\s*")
+
+
+def abv_percent(abv: Optional[str]) -> Optional[float]:
+    """
+    Parses a scraped ABV, i.e. "9.4%", "ABV 9,4 %" or "9.4" -> 9.4
+
+    :param abv: ABV as extracted from a page
+    :return: ABV in percent, None when the text holds no plausible ABV
+    """
+    if not abv:
+        return None
+    match = _ABV_PERCENT_PATTERN.search(abv) or _ABV_NUMBER_PATTERN.fullmatch(abv)
+    if match is None:
+        return None
+    percent = float(match.group(1).replace(",", "."))
+    return percent if 0 < percent <= 100 else None
+
+
+def canonical_style(style: Optional[str]) -> Optional[str]:
+    """
+    Maps a scraped style to the style tag it ends with, i.e. "Barrel-Aged Imperial Stout" -> "imperial stout"
+    or "Hazy IPA" -> "ipa". Styles name their kind of beer last, after modifiers which are tags too.
+
+    :param style: Style as extracted from a page
+    :return: Lowercase style tag, None when the style mentions none
+    """
+    if not style:
+        return None
+    matches = _CANONICAL_STYLE_PATTERN.findall(" ".join(style.split()))
+    return matches[-1].lower() if matches else None
+
+
+def name_key(name: Optional[str]) -> Optional[str]:
+    """
+    Normalizes a beer's name for prefix lookups, i.e. " Stone  IPA " -> "stone ipa"
+
+    :param name: Name as extracted from a page, or a prefix of one
+    :return: Case-folded name with collapsed whitespace
+    """
+    if not name:
+        return None
+    return " ".join(name.split()).casefold()
+
+
+def normalized_fields(document: dict) -> Dict[str, Optional[object]]:
+    """
+    Derives the fields beers are queried by from a scraped item or stored document
+
+    :param document: Item or document with the scraped `name`, `style` and `ABV`
+    :return: `abv_pct`, `style_canonical` and `name_key`, None when a field cannot be derived
+    """
+    return {
+        'abv_pct': abv_percent(document.get('ABV')),
+        'style_canonical': canonical_style(document.get('style')),
+        'name_key': name_key(document.get('name')),
+    }
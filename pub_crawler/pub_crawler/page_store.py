@@ -0,0 +1,92 @@
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+from collections import namedtuple
+from typing import Iterator
+
+from w3lib.url import canonicalize_url
+
+
+# Latest body stored for a url
+StoredPage = namedtuple("StoredPage", ["url", "body_hash", "encoding", "fetched_at"])
+
+
+def object_path(directory: str, body_hash: str) -> str:
+    return os.path.join(directory, "objects", body_hash[:2], body_hash[2:])
+
+
+def read_body(directory: str, body_hash: str) -> bytes:
+    """
+    Reads a stored body, without opening the manifest so worker processes can read pages concurrently
+
+    :param directory: PageStore directory
+    :param body_hash: Hash of the body, as found in the manifest
+    :return: Decompressed body
+    """
+    with open(object_path(directory, body_hash), "rb") as f:
+        return zlib.decompress(f.read())
+
+
+class PageStore:
+    """
+    Raw pages kept on disk for offline re-extraction.
+
+    Bodies are zlib compressed under `objects/`, named by their sha1 so identical bodies are stored once.
+    `manifest.sqlite` maps each canonical url to its latest body. Manifest writes are committed in batches
+    of `commit_every` and on close.
+    """
+
+    def __init__(self, directory: str, commit_every: int = 100):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, "manifest.sqlite"))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, body_hash TEXT, encoding TEXT, fetched_at REAL)"
+        )
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+    def put(self, url: str, body: bytes, encoding: str) -> int:
+        """
+        Stores a page's body as the latest for its url
+
+        :param url: Page url
+        :param body: Raw response body
+        :param encoding: Response encoding
+        :return: Compressed bytes written, 0 when the body was already stored
+        """
+        body_hash = hashlib.sha1(body).hexdigest()
+        path = object_path(self.directory, body_hash)
+        written = 0
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = zlib.compress(body, 6)
+            # Written under a temporary name first so readers never see a partial object
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            with open(temporary_path, "wb") as f:
+                f.write(compressed)
+            os.replace(temporary_path, path)
+            written = len(compressed)
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pages (url, body_hash, encoding, fetched_at) VALUES (?, ?, ?, ?)",
+            (canonicalize_url(url), body_hash, encoding, time.time())
+        )
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.connection.commit()
+            self.uncommitted = 0
+        return written
+
+    def pages(self) -> Iterator[StoredPage]:
+        for row in self.connection.execute("SELECT url, body_hash, encoding, fetched_at FROM pages ORDER BY url"):
+            yield StoredPage(*row)
+
+    def read(self, page: StoredPage) -> bytes:
+        return read_body(self.directory, page.body_hash)
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
@@ -1,5 +1,18 @@
-import pymongo
-from itemadapter import ItemAdapter
+import hashlib
+import json
+import logging
+import time
+from collections import namedtuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+from twisted.internet import defer, task, threads
+from twisted.python.threadpool import ThreadPool
+from w3lib.url import canonicalize_url
+
+from .instrumentation import MONGODB_WRITE_SECONDS
+from .mongo import get_mongo_client
+from .normalization import normalized_fields
 
 # Define your item pipelines here
 #
@@ -11,28 +24,253 @@ from itemadapter import ItemAdapter
 from itemadapter import ItemAdapter
 
 
+logger = logging.getLogger(__name__)
+
+WriteResult = namedtuple("WriteResult", ["written", "unchanged", "errors", "latency"])
+
+
+def content_hash(document: dict) -> str:
+    """
+    Hashes the scraped content of a document, ignoring the fields MongoDB and the pipeline add to it
+
+    :param document: Document built from a scraped item
+    :return: Hex digest which only changes when the scraped content changes
+    """
+    content = {key: val for key, val in document.items() if key not in ('_id', 'content_hash')}
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
 class MongoDBPipeline:
+    """
+    Buffers scraped items and upserts them to MongoDB in unordered batches.
+
+    Documents are keyed by their canonical url, which has a unique index, so re-crawling a page updates
+    its document instead of adding another. Pages whose content hash did not change are not written.
+
+    A batch is flushed once `MONGODB_BATCH_SIZE` items are buffered, every `MONGODB_FLUSH_INTERVAL`
+    seconds and when the spider closes. A batch size of 1 writes every item as it arrives.
+
+    Next to the scraped text, documents hold the normalized fields beers are queried by: `abv_pct` (the
+    ABV as a number), `style_canonical` (the style tag the style ends with) and `name_key` (the case-folded
+    name), each covered by compound indexes.
+    """
     collection_name = 'scrapy_items'
 
-    def __init__(self, mongo_uri, mongo_db):
+    # Indexes of the queries over the normalized fields, ending with `_id` so results sorted by their last
+    # field and `_id` are read in index order
+    query_indexes = {
+        'style_abv': [('style_canonical', 1), ('abv_pct', 1), ('_id', 1)],
+        'abv': [('abv_pct', 1), ('_id', 1)],
+        'style_name': [('style_canonical', 1), ('name_key', 1), ('_id', 1)],
+        'name': [('name_key', 1), ('_id', 1)],
+    }
+
+    def __init__(self, mongo_uri, mongo_db, batch_size=100, flush_interval=5.0, stats=None):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.buffer = []
+        self.flush_loop = None
 
     @classmethod
     def from_crawler(cls, crawler):
         return cls(
             mongo_uri=crawler.settings.get('MONGO_URI'),
-            mongo_db=crawler.settings.get('MONGODB_DATABASE', 'items')
+            mongo_db=crawler.settings.get('MONGODB_DATABASE', 'items'),
+            batch_size=crawler.settings.getint('MONGODB_BATCH_SIZE', 100),
+            flush_interval=crawler.settings.getfloat('MONGODB_FLUSH_INTERVAL', 5.0),
+            stats=crawler.stats
         )
 
     def open_spider(self, spider):
-        self.client = pymongo.MongoClient(self.mongo_uri)
+        self.client = get_mongo_client(self.mongo_uri)
         self.db = self.client[self.mongo_db]
+        self.create_indexes()
+        if self.flush_interval > 0:
+            self.flush_loop = task.LoopingCall(self.flush_on_interval)
+            self.flush_loop.start(self.flush_interval, now=False)
 
     def close_spider(self, spider):
-        self.client.close()
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        self.flush()
+
+    def create_indexes(self):
+        try:
+            self.db[self.collection_name].create_index('url', unique=True, name='url_unique')
+        except OperationFailure as e:
+            # Collections written before upserts were introduced may hold duplicate urls
+            logger.warning("Unable to create unique url index on %s: %s", self.collection_name, e)
+        for name, keys in self.query_indexes.items():
+            self.db[self.collection_name].create_index(keys, name=name)
 
     def process_item(self, item, spider):
-        self.db[self.collection_name].insert_one(ItemAdapter(item).asdict())
+        self.buffer.append(self.to_document(item))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
         return item
 
+    def to_document(self, item) -> dict:
+        document = ItemAdapter(item).asdict()
+        document['url'] = canonicalize_url(document['url'])
+        document.update(normalized_fields(document))
+        document['content_hash'] = content_hash(document)
+        return document
+
+    def flush(self):
+        """
+        Writes all buffered items with `write`'s unordered `bulk_write` of upserts by url, on the reactor thread
+        """
+        if not self.buffer:
+            return
+        documents, self.buffer = self.buffer, []
+        try:
+            result = self.write(documents)
+        except PyMongoError:
+            # Keep the batch buffered so the next flush retries it
+            self.buffer[:0] = documents
+            raise
+        self.record_write(result)
+
+    def write(self, documents) -> WriteResult:
+        """
+        Upserts a batch of documents by url, skipping those whose content hash is already stored.
+        Safe to call from a thread other than the reactor's.
+
+        :param documents: List of documents to upsert
+        :return: WriteResult of the batch
+        :raises PyMongoError: When the batch could not be written at all
+        """
+        start = time.monotonic()
+        collection = self.db[self.collection_name]
+
+        # The last document scraped for a url wins
+        latest = {document['url']: document for document in documents}
+        stored_hashes = {
+            stored['url']: stored.get('content_hash')
+            for stored in collection.find({'url': {'$in': list(latest)}}, {'url': 1, 'content_hash': 1})
+        }
+        changed = [document for url, document in latest.items() if stored_hashes.get(url) != document['content_hash']]
+
+        written = 0
+        errors = 0
+        if changed:
+            requests = [UpdateOne({'url': document['url']}, {'$set': document}, upsert=True) for document in changed]
+            try:
+                result = collection.bulk_write(requests, ordered=False)
+                written = result.upserted_count + result.modified_count
+            except BulkWriteError as e:
+                # Unordered writes carry on past failed documents, only those are lost
+                written = e.details.get('nUpserted', 0) + e.details.get('nModified', 0)
+                errors = len(e.details.get('writeErrors', []))
+                logger.error("Failed to write %d of %d items to MongoDB", errors, len(changed))
+        return WriteResult(
+            written=written,
+            unchanged=len(documents) - len(changed),
+            errors=errors,
+            latency=time.monotonic() - start
+        )
+
+    def record_write(self, result: WriteResult):
+        MONGODB_WRITE_SECONDS.observe(result.latency)
+        self._inc_stat('mongodb/documents_written', result.written)
+        self._inc_stat('mongodb/documents_unchanged', result.unchanged)
+        self._inc_stat('mongodb/write_errors', result.errors)
+        self._inc_stat('mongodb/flushes')
+        self._inc_stat('mongodb/flush_time', result.latency)
+        if self.stats is not None:
+            self.stats.max_value('mongodb/flush_time_max', result.latency)
+
+    def flush_on_interval(self):
+        # Exceptions would stop the LoopingCall, failed batches stay buffered for the next flush
+        try:
+            self.flush()
+        except PyMongoError:
+            logger.exception("Periodic flush to MongoDB failed")
+
+    def _inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+
+class AsyncMongoDBPipeline(MongoDBPipeline):
+    """
+    MongoDBPipeline which writes its batches on a bounded thread pool, so the reactor keeps
+    downloading and parsing while MongoDB responds.
+
+    Items which fill a batch get a Deferred back that fires once the batch is written. Scrapy holds
+    those items until then, so its CONCURRENT_ITEMS limit pushes back on a slow database instead of
+    the buffer growing without bound. At most `MONGODB_WRITE_THREADS` batches are written at once.
+    """
+
+    def __init__(self, *args, write_threads=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_threads = write_threads
+        self.threadpool = None
+        self.reactor = None
+        self.pending_writes = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = super().from_crawler(crawler)
+        pipeline.write_threads = crawler.settings.getint('MONGODB_WRITE_THREADS', 4)
+        return pipeline
+
+    def open_spider(self, spider):
+        from twisted.internet import reactor
+        self.reactor = reactor
+        self.threadpool = ThreadPool(minthreads=1, maxthreads=self.write_threads, name="mongodb-writes")
+        self.threadpool.start()
+        super().open_spider(spider)
+
+    @defer.inlineCallbacks
+    def close_spider(self, spider):
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        self.flush()
+        yield defer.DeferredList(list(self.pending_writes))
+        if self.buffer:
+            # Batches which failed were buffered again for a next flush, the last one is this retry
+            self.flush()
+            yield defer.DeferredList(list(self.pending_writes))
+        if self.buffer:
+            self._inc_stat('mongodb/documents_lost', len(self.buffer))
+            logger.error("Lost %d items which could not be written to MongoDB", len(self.buffer))
+            self.buffer = []
+        self.threadpool.stop()
+
+    def process_item(self, item, spider):
+        self.buffer.append(self.to_document(item))
+        if len(self.buffer) >= self.batch_size:
+            return self.flush().addCallback(lambda _: item)
+        return item
+
+    def flush(self):
+        """
+        Hands all buffered items to the write thread pool
+
+        :return: Deferred which fires once the batch has been written or has failed
+        """
+        if not self.buffer:
+            return defer.succeed(None)
+        documents, self.buffer = self.buffer, []
+
+        d = threads.deferToThreadPool(self.reactor, self.threadpool, self.write, documents)
+        d.addCallbacks(self.record_write, self._write_failed, errbackArgs=(documents,))
+        self.pending_writes.add(d)
+        d.addBoth(self._write_done, d)
+        return d
+
+    def flush_on_interval(self):
+        return self.flush()
+
+    def _write_failed(self, failure, documents):
+        # Keep the batch buffered so the next flush retries it
+        self.buffer[:0] = documents
+        logger.error("Failed to write %d items to MongoDB: %s", len(documents), failure.getErrorMessage())
+
+    def _write_done(self, result, d):
+        self.pending_writes.discard(d)
+        return result
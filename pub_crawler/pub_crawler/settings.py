@@ -13,6 +13,7 @@ BOT_NAME = 'pub_crawler'
 
 SPIDER_MODULES = ['pub_crawler.spiders']
 NEWSPIDER_MODULE = 'pub_crawler.spiders'
+COMMANDS_MODULE = 'pub_crawler.commands'
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -22,14 +23,15 @@ NEWSPIDER_MODULE = 'pub_crawler.spiders'
 ROBOTSTXT_OBEY = True
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+# A crawl started from many urls shares these between all their domains
+CONCURRENT_REQUESTS = 32
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
-# See also autothrottle settings and docs
-#DOWNLOAD_DELAY = 3
+# See also autothrottle settings and docs, AutoThrottle never goes below this delay
+DOWNLOAD_DELAY = 1
 # The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN = 16
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
 #CONCURRENT_REQUESTS_PER_IP = 16
 
 # Disable cookies (enabled by default)
@@ -52,20 +54,100 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
+DOWNLOADER_MIDDLEWARES = {
 #    'beer.middlewares.BeerDownloaderMiddleware': 543,
-#}
+    'pub_crawler.middlewares.FrontierMiddleware': 950,
+    'pub_crawler.middlewares.PageStoreMiddleware': 900,
+}
+
+# Skip pages downloaded by a previous crawl within FRONTIER_TTL seconds and
+# re-validate older ones with If-None-Match/If-Modified-Since
+FRONTIER_ENABLED = True
+FRONTIER_TTL = 24 * 60 * 60
+# Either "sqlite" (FRONTIER_DB_PATH) or "mongo" (MONGO_URI/MONGODB_DATABASE),
+# which loads the crawled domains' entries when the crawl opens and writes new
+# ones in batches of FRONTIER_BATCH_SIZE, both on a thread
+FRONTIER_BACKEND = "sqlite"
+FRONTIER_DB_PATH = "frontier.sqlite"
+FRONTIER_BATCH_SIZE = 100
+
+# Keep the compressed raw body of every downloaded page under PAGE_STORE_DIR,
+# `scrapy reextract` re-extracts them with the current extractors and upserts
+# the items without crawling the sites again
+PAGE_STORE_ENABLED = False
+PAGE_STORE_DIR = "pages"
+
+# Links are scored by how likely they lead to a beer page and requested in that
+# order, links scoring below LINK_MIN_SCORE are never followed
+LINK_MIN_SCORE = 0
+
+# Followed pages scoring below BEER_PAGE_MIN_SCORE (see score_beer_page) are
+# dropped before extraction
+BEER_PAGE_MIN_SCORE = 2
+
+# Deep crawl: follow links up to DEEP_CRAWL_MAX_DEPTH hops from the start page
+# (1 only follows the start page's links) requesting at most
+# DEEP_CRAWL_DOMAIN_BUDGET pages per domain (0 for no limit)
+DEEP_CRAWL_MAX_DEPTH = 1
+DEEP_CRAWL_DOMAIN_BUDGET = 0
+# Requests are ordered by link score, minus one per hop from the start page.
+# For a strict breadth-first crawl use FIFO queues instead:
+#SCHEDULER_DISK_QUEUE = 'scrapy.squeues.PickleFifoDiskQueue'
+#SCHEDULER_MEMORY_QUEUE = 'scrapy.squeues.FifoMemoryQueue'
+DEPTH_PRIORITY = 1
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+    'pub_crawler.extensions.CrawlJobProgress': 500,
+    'pub_crawler.extensions.PrometheusExporter': 510,
+}
+
+# Progress of crawls started with a CRAWL_JOB_ID is written to its crawl_jobs
+# document every CRAWL_JOB_PROGRESS_INTERVAL seconds
+CRAWL_JOB_PROGRESS_INTERVAL = 5.0
+
+# Serve extractor and MongoDB write latency histograms for Prometheus on
+# PROMETHEUS_PORT (0 disables), per call timings are also kept in the stats
+PROMETHEUS_PORT = 0
+
+# Profile a PROFILE_SAMPLE_RATE fraction of the pages with cProfile and dump the
+# PROFILE_SLOWEST_PAGES slowest (0 disables) as pstats files under PROFILE_DIR
+PROFILE_SLOWEST_PAGES = 0
+PROFILE_SAMPLE_RATE = 1.0
+PROFILE_DIR = 'profiles'
+
+# Extract pages on EXTRACTION_PROCESSES worker processes instead of the reactor
+# thread (0 disables), with at most EXTRACTION_MAX_PENDING pages queued or being
+# extracted (0 for twice the processes). Pages extracted by workers are neither
+# profiled nor timed per extractor
+EXTRACTION_PROCESSES = 0
+EXTRACTION_MAX_PENDING = 0
+
+# Learn per domain the paths of the text nodes each field was extracted from and
+# try them first on the domain's other pages, pages holding every field at its
+# path skip the heuristics. The EXTRACTION_TEMPLATES_MAX_DOMAINS most recently
+# used domains are kept in memory, with the "mongo" backend templates are also
+# loaded from the extraction_templates collection when the crawl opens and saved
+# to it when it closes, so later crawls reuse them. A learned path replaces the
+# domain's one after EXTRACTION_TEMPLATES_REPLACE_AFTER of its pages in a row
+EXTRACTION_TEMPLATES_ENABLED = True
+EXTRACTION_TEMPLATES_BACKEND = "mongo"
+EXTRACTION_TEMPLATES_MAX_DOMAINS = 1000
+EXTRACTION_TEMPLATES_REPLACE_AFTER = 3
+
+# Pages are truncated to EXTRACTION_MAX_BODY_SIZE bytes (0 for no limit) before
+# they are parsed and their script, style and noscript elements are stripped
+# before any extractor runs, see the preparse/* stats for the bytes dropped.
+# Downloads larger than DOWNLOAD_MAXSIZE are cancelled
+EXTRACTION_MAX_BODY_SIZE = 1024 * 1024
+DOWNLOAD_MAXSIZE = 16 * 1024 * 1024
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
-    "pub_crawler.pipelines.MongoDBPipeline": 300,
+    "pub_crawler.pipelines.AsyncMongoDBPipeline": 300,
 }
 
 # This is NOT used when launching a crawler from celery
@@ -76,6 +158,13 @@ MONGO_URI = f"mongodb://root:example@{MONGODB_SERVER}:{MONGODB_PORT}"
 MONGODB_DATABASE = "myDatabase"
 MONGODB_COLLECTION = "beer"
 
+# Items are buffered and written in unordered batches of MONGODB_BATCH_SIZE,
+# buffers are also flushed every MONGODB_FLUSH_INTERVAL seconds (0 disables)
+MONGODB_BATCH_SIZE = 100
+MONGODB_FLUSH_INTERVAL = 5.0
+# Number of batches AsyncMongoDBPipeline writes concurrently off the reactor thread
+MONGODB_WRITE_THREADS = 4
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 AUTOTHROTTLE_ENABLED = True
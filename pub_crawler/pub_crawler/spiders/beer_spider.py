@@ -1,12 +1,147 @@
+import os
+import re
+import time
 import scrapy
 import pprint
+from contextlib import nullcontext
+from functools import partial
+from collections import Counter, defaultdict, namedtuple
 from urllib import parse
-from typing import List
+from typing import Dict, Iterable, List, Optional, Tuple
+from parsel.utils import extract_regex
+from scrapy import signals
+from scrapy.linkextractors import IGNORED_EXTENSIONS
+from w3lib.html import replace_entities
+from twisted.internet import threads
+from w3lib.url import canonicalize_url
+
+from ..document import MAX_LABEL_LENGTH, DocumentIndex, descendant_texts, normalize_label
+from ..extraction import ExtractionPool
+from .. import structured_data
+from ..instrumentation import SlowPageProfiler, recording_stats, timed
+from ..templates import LocatedText, PageTemplate, open_extraction_templates, text_path
 
 
 pp = pprint.PrettyPrinter(indent=4)
 
 
+# TODO: Move tags and META type data to database
+STYLE_TAGS = [
+    'dark',
+    'saison',
+    'red',
+    'wine',
+    'red wine'
+    'red ale',
+    'flanders red',
+    'barrel',
+    'aged',
+    'barrel aged',
+    'russian',
+    'imperial',
+    'stout',
+    'russian imperial stout',
+    'imperial stout',
+    'lager',
+    'IPA',
+    'india pale ale',
+    'hazy',
+    'pils',
+    'pilsner',
+    'gose',
+    'porter',
+    'baltic',
+    'baltic porter',
+    'bock',
+    'style',
+    'czech',
+    'czech pilsner',
+    'czech style pilsner',
+    'oatmeal',
+    'oatmeal stout'
+]
+
+
+class StyleTagMatcher:
+    """
+    Finds style tags in page text with a single pass over the text nodes.
+
+    Each tag is matched as written, upper case and title case. All spellings are compiled once into
+    a combined pattern which selects the lines mentioning any tag, so the per-tag patterns only ever
+    run on those lines.
+    """
+
+    def __init__(self, tags: List[str]):
+        self.tags = tags
+        self._tag_patterns = []
+        all_spellings = set()
+        for tag in tags:
+            spellings = list(dict.fromkeys([tag, tag.upper(), tag.title()]))
+            all_spellings.update(spellings)
+            self._tag_patterns.append(
+                [(spelling, re.compile(r".*\b" + re.escape(spelling))) for spelling in spellings]
+            )
+        alternation = "|".join(re.escape(spelling) for spelling in sorted(all_spellings, key=len, reverse=True))
+        self._any_tag = re.compile(r"\b(?:{})".format(alternation))
+
+    def find(self, texts: Iterable[str]) -> List[Tuple[str, str]]:
+        """
+        Finds the text leading up to the last style tag on every line that mentions one
+
+        :param texts: Text nodes of a page in document order
+        :return: List of (matched text, tag) pairs, grouped by tag in `tags` order, then in document order
+        """
+        tag_matches = [[] for _ in self.tags]
+        for text in texts:
+            if not self._any_tag.search(text):
+                continue
+            for line in text.split("\n"):
+                if not self._any_tag.search(line):
+                    continue
+                for i, spellings in enumerate(self._tag_patterns):
+                    # Spellings are tried in order, the first one present on the line wins
+                    for spelling, pattern in spellings:
+                        match = pattern.match(line) if spelling in line else None
+                        if match:
+                            tag_matches[i].append(replace_entities(match.group(), keep=["lt", "amp"]))
+                            break
+        return [(match, tag) for tag, matches in zip(self.tags, tag_matches) for match in matches]
+
+    def count_mentions(self, texts: Iterable[str]) -> int:
+        """
+        Counts the lines mentioning any style tag, a cheap measure of how much a page talks about beer styles
+
+        :param texts: Text nodes of a page
+        :return: Number of lines containing a style tag
+        """
+        mentions = 0
+        for text in texts:
+            if self._any_tag.search(text):
+                mentions += sum(1 for line in text.split("\n") if self._any_tag.search(line))
+        return mentions
+
+
+STYLE_TAG_MATCHER = StyleTagMatcher(STYLE_TAGS)
+
+# Words in a link's url or anchor text suggesting it leads to a beer
+BEER_KEYWORDS = (
+    {word.lower() for tag in STYLE_TAGS for word in tag.split()}
+    | {'ale', 'ales', 'beer', 'beers', 'brew', 'brews', 'sour', 'wheat', 'tripel', 'dubbel', 'quad'}
+) - {'style'}
+
+# Url path segments under which breweries list their beers, i.e. /beers/year-round/<beer>
+BEER_SECTION_KEYWORDS = {'beer', 'beers', 'brews', 'product', 'products'}
+
+# Words in a link's host or in the sections of its path, or whole last path segments, marking pages which never
+# describe a beer. The words of the last segment are the page's slug and may name a beer, i.e. press-gang-porter
+LINK_DENY_KEYWORDS = {
+    'about', 'about-us', 'account', 'admin', 'blog', 'cart', 'careers', 'cdn', 'checkout', 'contact',
+    'contact-us', 'event', 'events', 'feed', 'gift', 'gift-card', 'gift-cards', 'job', 'jobs', 'login',
+    'my-account', 'news', 'newsletter', 'newsletters', 'policy', 'press', 'privacy', 'privacy-policy', 'register',
+    'static', 'terms', 'terms-and-conditions', 'terms-of-service', 'terms-of-use', 'tours', 'visit'
+}
+
+
 def parse_name_keywords_from_url(url: str) -> List[str]:
     """
     Parses out all name keywords from the end path of the url
@@ -15,94 +150,127 @@ def parse_name_keywords_from_url(url: str) -> List[str]:
     :return: List of all name keywords in the path
     """
     path = parse.urlparse(url).path
-    if path[-1] == '/':
+    if path.endswith('/'):
         path = path[:len(path) - 1]
     return path.split('/')[-1].split('-')
 
 
-def extract_name(response: scrapy.http.TextResponse):
+# Signals of a beer's page used by `score_beer_page`
+ABV_LABELS = ['abv', 'alcohol by volume', 'alc. by volume', 'alc by vol']
+ABV_MENTION_PATTERN = re.compile(r'\b(?:ABV|alc(?:ohol)?\.? by vol(?:ume)?)\b', re.IGNORECASE)
+PRODUCT_ITEM_TYPE_PATTERN = re.compile(r'schema\.org/(?:Product|IndividualProduct|Drink|Beer)\b')
+PRODUCT_JSON_LD_PATTERN = re.compile(r'"@type"\s*:\s*(?:\[[^\]]*)?"(?:Product|IndividualProduct|Drink|Beer)"')
+
+
+def score_beer_page(index: DocumentIndex) -> int:
+    """
+    Scores how likely a page describes a single beer, cheap enough to run before any extractor
+
+    :param index: DocumentIndex of the page
+    :return: Score, 2 points per strong signal (ABV label, product markup) and 1 per weak one
+    """
+    score = 0
+    if any(label in index.elements_by_label for label in ABV_LABELS):
+        score += 2
+    elif any(ABV_MENTION_PATTERN.search(text) for text in index.texts):
+        score += 1
+
+    style_mentions = STYLE_TAG_MATCHER.count_mentions(index.texts)
+    if style_mentions >= 1:
+        score += 1
+    if style_mentions >= 3:
+        score += 1
+
+    if any(PRODUCT_ITEM_TYPE_PATTERN.search(item_type) for item_type in index.item_types) \
+            or any(PRODUCT_JSON_LD_PATTERN.search(json_ld) for json_ld in index.json_ld):
+        score += 2
+    return score
+
+
+def url_words(text: str) -> List[str]:
+    return [word for word in re.split(r'[^a-z0-9]+', text.lower()) if word]
+
+
+def score_link(url: str, anchor_text: str, domain: str) -> Optional[int]:
+    """
+    Scores how likely a link leads to a beer's page, before it is requested
+
+    :param url: Absolute url of the link
+    :param anchor_text: Text of the link's anchor
+    :param domain: Domain being crawled, links to it and its subdomains are allowed
+    :return: Score used as request priority (higher is more likely), or None when the link should not be followed
+    """
+    parsed = parse.urlparse(url)
+    if parsed.scheme not in ('http', 'https'):
+        return None
+    host = parsed.hostname or ''
+    if host != domain and not host.endswith('.' + domain):
+        return None
+    path = parsed.path.lower()
+    extension = path.rsplit('.', 1)[-1] if '.' in path.rsplit('/', 1)[-1] else ''
+    if extension in IGNORED_EXTENSIONS:
+        return None
+    if LINK_DENY_KEYWORDS.intersection(url_words(host)):
+        return None
+    segments = [segment for segment in path.split('/') if segment]
+    in_beer_section = bool(BEER_SECTION_KEYWORDS.intersection(segments[:-1]))
+    # Pages listed under a beer section are beers whatever their slug
+    if not in_beer_section and LINK_DENY_KEYWORDS.intersection(
+            [word for segment in segments[:-1] for word in url_words(segment)] + segments[-1:]):
+        return None
+
+    score = 0
+    if segments:
+        name_keywords = {keyword.lower() for keyword in parse_name_keywords_from_url(url)}
+        score += len(name_keywords & BEER_KEYWORDS)
+        if in_beer_section:
+            score += 2
+            # Beer pages usually sit below a category, i.e. /beer/year-round/<beer> rather than /beer/<category>
+            if len(segments) >= 3:
+                score += 1
+    score += len(BEER_KEYWORDS.intersection(url_words(anchor_text)))
+    return score
+
+
+@timed('extract_name')
+def extract_name(response: scrapy.http.TextResponse, index: DocumentIndex = None):
+    if index is None:
+        index = DocumentIndex(response)
     name_parts = parse_name_keywords_from_url(response.url)
     class_names = ["h1", "h2"]
 
     for class_name in class_names:
-        class_results = response.css(class_name)
-        for class_result in class_results:
-            class_text = class_result.xpath(".//text()").getall()
+        for class_text in index.headings[class_name]:
             for text in class_text:
                 matches_found = [name_part.upper() in text.upper() for name_part in name_parts]
                 if any(matches_found):
-                    return text
+                    return LocatedText(text, text_path(text))
     return None
 
 
-def extract_style(response: scrapy.http.TextResponse):
+@timed('extract_style')
+def extract_style(response: scrapy.http.TextResponse, index: DocumentIndex = None):
+    if index is None:
+        index = DocumentIndex(response)
     style_spelling = ['style', 'beer style']
 
     # First attempt to retrieve style by key, val pair
-    extracted_value = extract_value(response, style_spelling, [])
+    extracted_value = extract_value(response, style_spelling, [], index)
     if extracted_value:
         return extracted_value
 
-    # Use style tags and regex if as last resort
-    # TODO: Move tags and META type data to database
-    style_tags = [
-        'dark',
-        'saison',
-        'red',
-        'wine',
-        'red wine'
-        'red ale',
-        'flanders red',
-        'barrel',
-        'aged',
-        'barrel aged',
-        'russian',
-        'imperial',
-        'stout',
-        'russian imperial stout',
-        'imperial stout',
-        'lager',
-        'IPA',
-        'india pale ale',
-        'hazy',
-        'pils',
-        'pilsner',
-        'gose',
-        'porter',
-        'baltic',
-        'baltic porter',
-        'bock',
-        'style',
-        'czech',
-        'czech pilsner',
-        'czech style pilsner',
-        'oatmeal',
-        'oatmeal stout'
-    ]
-
+    # Use style tags as last resort
     matches = []
     found_tags_map = []
 
-    # TODO: Why does this take so long to process and eventually die?
-    for tag in style_tags:
-        original_regex_tag = "(.*\\b{}).*"
-        regex_tag = original_regex_tag.format(tag)
-        for f in ["upper", "title"]:
-            altered_regex = original_regex_tag.format(getattr(tag, f)())
-            regex_tag += f"|{altered_regex}"
-
-        # Add text that includes the given spellings of a style tag
-        # matches.append(extract_value([], [regex_tag]))
-        current_matches = response.xpath("//text()").re(regex_tag)
-        if len(current_matches) > 0:
-            for current_match in current_matches:
-                if current_match and "jQuery" not in current_match:
-                    matches.append(current_match)
-                    # Add the found tags to the map to be used in the score function
-                    found_tags_map.append((current_match, tag))
+    for current_match, tag in STYLE_TAG_MATCHER.find(index.texts):
+        if "jQuery" not in current_match:
+            matches.append(current_match)
+            # Add the found tags to the map to be used in the score function
+            found_tags_map.append((current_match, tag))
 
     # Collect counts of each
-    counts_dict = {match: matches.count(match) for match in matches}
+    counts_dict = dict(Counter(matches))
 
     if counts_dict:
         # Calculate score based on tags found and amount of extra text
@@ -119,69 +287,393 @@ def extract_style(response: scrapy.http.TextResponse):
     return None
 
 
-def extract_abv(response: scrapy.http.TextResponse):
+@timed('extract_abv')
+def extract_abv(response: scrapy.http.TextResponse, index: DocumentIndex = None):
     abv_spelling = ['ABV', 'abv', 'alcohol by volume', 'ALCOHOL BY VOLUME', 'ALC. BY VOLUME']
     regex = [r'(?:ABV[: ~\xa0-]+)([0-9].*[0-9]*%)']
-    return extract_value(response, abv_spelling, regex)
+    return extract_value(response, abv_spelling, regex, index)
 
 
-def extract_value(response: scrapy.http.TextResponse, field_spelling: List[str], regex: List[str] = None) -> [str, None]:
+@timed('extract_value')
+def extract_value(
+        response: scrapy.http.TextResponse,
+        field_spelling: List[str],
+        regex: List[str] = None,
+        index: DocumentIndex = None
+) -> [str, None]:
     """
     Given a list of spelling options, attempt to extract the value to the expected field name
 
     :param response: A TextResponse object
     :param field_spelling: List of spelling options for a field name i.e. ['ABV', 'Alcohol by Volume', ...]
     :param regex
+    :param index: DocumentIndex of the response, built from `response` when not given
     :return:
     """
-    # Common symbols that come after the field name
-    post_symbols = [':']
-
-    # Change spelling to upper for comparison
-    transformed_spelling = [spelling.upper() for spelling in field_spelling]
-
-    # Add Title Spelling
-    title_spelling = [spelling.title() for spelling in transformed_spelling]
-    transformed_spelling.extend(title_spelling)
+    if index is None:
+        index = DocumentIndex(response)
 
-    # Combine with symbols for optional spellings
-    additional_spellings = [spelling + symbol for spelling in transformed_spelling for symbol in post_symbols]
-    transformed_spelling.extend(additional_spellings)
+    # Labels are compared case-insensitively and without trailing symbols, i.e. 'ABV', 'Abv:'
+    labels = list(dict.fromkeys(normalize_label(spelling) for spelling in field_spelling))
 
     # Search by field-value pair (field_name -> parent -> value (as child))
-    for spelling in transformed_spelling:
-        abv_selectors = response.xpath(f"//*[text()='{spelling}']")
-        if len(abv_selectors) > 0:
-            abv_parents = abv_selectors[0].xpath(".//..")
-            if len(abv_parents) > 0:
-                style_text = abv_parents[0].xpath('.//text()').getall()
-                for text in style_text:
-                    stripped_text = text.strip()
-                    if stripped_text and stripped_text.upper() not in transformed_spelling:
-                        return stripped_text
+    for label in labels:
+        field_element = index.elements_by_label.get(label)
+        if field_element is not None:
+            field_parent = field_element.getparent()
+            if field_parent is None:
+                field_parent = field_element
+            for text in descendant_texts(field_parent, located=True):
+                stripped_text = text.strip()
+                if stripped_text and normalize_label(stripped_text) not in labels:
+                    return LocatedText(stripped_text, text_path(text))
 
     # Search by regex
     if regex:
         for pattern in regex:
-            matches = response.xpath("//text()").re(pattern)
-            if len(matches) > 0:
-                return matches[0]
+            for text in index.texts:
+                matches = extract_regex(pattern, text)
+                if len(matches) > 0:
+                    return matches[0]
     return None
 
 
+# Names of the product properties (or of their `additionalProperty`s) holding a beer's style and ABV
+STRUCTURED_STYLE_LABELS = ['style', 'beer style', 'beerstyle']
+STRUCTURED_ABV_LABELS = ABV_LABELS + ['alcohol', 'alcoholcontent', 'alcohol content', 'alcoholbyvolume']
+# ABVs are written as percents ("6.5%", "6.5% ABV"), bare percents ("6.5", "0.5" for alcohol-free beers) or
+# fractions ("0.065"). Bare numbers up to STRUCTURED_ABV_MAX_FRACTION are fractions, no beer is stronger
+STRUCTURED_ABV_PERCENT_PATTERN = re.compile(r'(?<![\d.])(\d{1,3}(?:\.\d+)?)\s*%')
+STRUCTURED_ABV_NUMBER_PATTERN = re.compile(r'\s*(\d{1,3}(?:\.\d+)?)\s*')
+STRUCTURED_ABV_MAX_FRACTION = 0.2
+
+
+def structured_style(product: dict, properties: Dict[str, str]) -> Optional[str]:
+    for label in STRUCTURED_STYLE_LABELS:
+        style = properties.get(label) or structured_data.first_text(product.get(label))
+        if style:
+            return style
+    # Categories are often paths, i.e. "Beer > IPA", and only count when they name a style
+    category = structured_data.first_text(product.get('category'))
+    for segment in reversed(re.split(r'[>/|]', category or '')):
+        if STYLE_TAG_MATCHER.find([segment]):
+            return segment.strip()
+    return None
+
+
+def structured_abv(product: dict, properties: Dict[str, str]) -> Optional[str]:
+    for label in STRUCTURED_ABV_LABELS:
+        abv = structured_abv_percent(properties.get(label) or structured_data.first_text(product.get(label)) or '')
+        if abv:
+            return abv
+    return None
+
+
+def structured_abv_percent(value: str) -> Optional[str]:
+    """
+    Reads an ABV property, i.e. "6.5% ABV", "6.5" or 0.065 -> "6.5%" and "0.5" -> "0.5%"
+
+    :param value: Text of the property
+    :return: ABV in percent followed by `%`, None when the property holds no plausible ABV (i.e. a year)
+    """
+    match = STRUCTURED_ABV_PERCENT_PATTERN.search(value)
+    if match is not None:
+        number = match.group(1)
+    else:
+        match = STRUCTURED_ABV_NUMBER_PATTERN.fullmatch(value)
+        if match is None:
+            return None
+        number = match.group(1)
+        if float(number) <= STRUCTURED_ABV_MAX_FRACTION:
+            # A fraction of the volume rather than a percent
+            number = f"{round(float(number) * 100, 3):g}"
+    return f"{number}%" if 0 < float(number) <= 100 else None
+
+
+@timed('extract_structured')
+def extract_structured(index: DocumentIndex) -> Dict[str, str]:
+    """
+    Reads a beer's fields from the schema.org product markup (JSON-LD, then microdata) of a page, and
+    its name from OpenGraph on pages whose `og:type` is a product
+
+    :param index: DocumentIndex of the page
+    :return: The `name`, `style` and `ABV` found, ABV formatted as the heuristics do, i.e. "6.9%"
+    """
+    fields = {}
+    for product in structured_data.products(index.json_ld, index.root):
+        properties = {}
+        additional_properties = product.get('additionalProperty') or []
+        if isinstance(additional_properties, dict):
+            additional_properties = [additional_properties]
+        for prop in additional_properties:
+            if isinstance(prop, dict) and structured_data.first_text(prop.get('name')):
+                properties.setdefault(
+                    normalize_label(structured_data.first_text(prop.get('name'))),
+                    structured_data.first_text(prop.get('value'))
+                )
+        for field, value in [
+            ('name', structured_data.first_text(product.get('name'))),
+            ('style', structured_style(product, properties)),
+            ('ABV', structured_abv(product, properties)),
+        ]:
+            if value and field not in fields:
+                fields[field] = value
+
+    if 'name' not in fields:
+        open_graph = structured_data.open_graph(index.root)
+        if open_graph.get('og:type', '').startswith('product') and open_graph.get('og:title'):
+            fields['name'] = open_graph['og:title']
+    return fields
+
+
+# Checks of the text at a learned path, telling pages built on their domain's template from the ones which are not
+TEMPLATE_ABV_PATTERN = re.compile(r'\d{1,2}(?:\.\d+)?\s?%')
+
+
+def is_template_name(text: str, url: str) -> bool:
+    return any(name_part.upper() in text.upper() for name_part in parse_name_keywords_from_url(url) if name_part)
+
+
+def is_template_style(text: str, url: str) -> bool:
+    return len(text) <= MAX_LABEL_LENGTH and not TEMPLATE_ABV_PATTERN.search(text) \
+        and normalize_label(text) not in STRUCTURED_STYLE_LABELS + STRUCTURED_ABV_LABELS
+
+
+def is_template_abv(text: str, url: str) -> bool:
+    return TEMPLATE_ABV_PATTERN.fullmatch(text) is not None
+
+
+TEMPLATE_VALIDATORS = {'name': is_template_name, 'style': is_template_style, 'ABV': is_template_abv}
+
+
+@timed('extract_templated')
+def extract_templated(
+        response: scrapy.http.TextResponse,
+        index: DocumentIndex,
+        template: PageTemplate
+) -> Dict[str, str]:
+    """
+    Reads a beer's fields at the paths learned on the other pages of its domain
+
+    :param response: Followed page
+    :param index: DocumentIndex of the page
+    :param template: Template of the page's domain
+    :return: Fields whose path holds a valid value, none when the name's path does not hold one as
+        the page is then not built on the template
+    """
+    fields = {}
+    for field in sorted(template.paths, key=lambda field: field != 'name'):
+        value = template.read(index.root, field, partial(TEMPLATE_VALIDATORS[field], url=response.url))
+        if field == 'name' and value is None:
+            return {}
+        if value is not None:
+            fields[field] = value
+    template.hits.extend(fields)
+    return fields
+
+
+# Outcome of extracting a page: its item (None when it is not a beer's page), the seconds taken, the bytes
+# of script/style text stripped before indexing, the fields read through the domain's template and the
+# paths learned for the template
+Extraction = namedtuple("Extraction", ["item", "seconds", "bytes_stripped", "template_hits", "learned_paths"])
+
+
+def extract_beer(
+        response: scrapy.http.TextResponse,
+        min_score: int = 2,
+        index: DocumentIndex = None,
+        template: PageTemplate = None
+) -> Optional[dict]:
+    """
+    Extracts the beer a page describes
+
+    :param response: Followed page
+    :param min_score: Minimum `score_beer_page` score of a beer's page
+    :param index: DocumentIndex of the page, built when not given
+    :param template: Template of the page's domain, its paths are tried first and it learns the paths of
+        the values the heuristics find
+    :return: Item, or None when the page does not look like a beer's page
+    """
+    if index is None:
+        index = DocumentIndex(response)
+    fields = extract_templated(response, index, template) if template is not None and template.paths else {}
+    # A page holding every field at its domain's learned paths is a beer's page like the ones they were
+    # learned on, it is extracted from them alone without scoring or walking its document
+    if len(fields) == len(TEMPLATE_VALIDATORS):
+        return {'name': fields['name'], 'style': fields['style'], 'ABV': fields['ABV'], 'url': response.url}
+    if score_beer_page(index) < min_score:
+        return None
+    # Fields found in structured data are trusted over the template's, the heuristics only run for the
+    # missing ones
+    fields.update(extract_structured(index))
+    for field, extractor in (('name', extract_name), ('style', extract_style), ('ABV', extract_abv)):
+        if field in fields:
+            continue
+        fields[field] = extractor(response, index)
+        if fields[field] and template is not None:
+            template.learn(index.root, field, fields[field], partial(TEMPLATE_VALIDATORS[field], url=response.url))
+    return {
+        # LocatedTexts only matter to the template, items hold plain strings
+        'name': str(fields['name']) if fields['name'] is not None else None,
+        'style': str(fields['style']) if fields['style'] is not None else None,
+        'ABV': str(fields['ABV']) if fields['ABV'] is not None else None,
+        'url': response.url
+    }
+
+
+def extract_page(
+        body: bytes,
+        url: str,
+        encoding: str,
+        min_score: int = 2,
+        template_paths: Dict[str, str] = None
+) -> Extraction:
+    """
+    Extracts the beer a downloaded page describes, from the page's raw content so it can run in an
+    ExtractionPool worker process
+
+    :param body: Response body
+    :param url: Response url
+    :param encoding: Response encoding
+    :param min_score: Minimum `score_beer_page` score of a beer's page
+    :param template_paths: Paths learned for the page's domain, None when templates are disabled
+    :return: Extraction of the page
+    """
+    start = time.perf_counter()
+    response = scrapy.http.TextResponse(url, body=body, encoding=encoding)
+    index = DocumentIndex(response)
+    template = PageTemplate(template_paths) if template_paths is not None else None
+    item = extract_beer(response, min_score, index, template)
+    return Extraction(
+        item,
+        time.perf_counter() - start,
+        index.bytes_stripped,
+        template.hits if template is not None else [],
+        template.learned if template is not None else {}
+    )
+
+
+def seed_domain(url: str) -> str:
+    """
+    Gets the domain crawled for a start url, links to it and its subdomains are followed
+
+    :param url: Standard formatted url string
+    :return: Lowercase hostname without its `www.` prefix
+    """
+    return re.sub(r'^www\.', '', parse.urlparse(url).hostname.lower())
+
+
 class BeerSpider(scrapy.Spider):
+    """
+    Crawls breweries' sites for beers, starting from `url` or from each of `urls` (a list, or a comma
+    separated string on the command line) in a single crawl.
+
+    Links are followed up to `max_depth` hops from the start page (`DEEP_CRAWL_MAX_DEPTH`, 1 only
+    follows the start page's links) and at most `domain_budget` pages are requested per domain
+    (`DEEP_CRAWL_DOMAIN_BUDGET`, 0 for no limit). Both can be overridden per crawl as spider arguments.
+
+    With `EXTRACTION_TEMPLATES_ENABLED`, the paths of the fields extracted on a domain's pages are learned
+    and tried first on its other pages.
+    """
     name = "beer"
 
-    def __init__(self, url, *args, **kwargs):
+    def __init__(self, url=None, *args, urls=None, **kwargs):
         super(BeerSpider, self).__init__(*args, **kwargs)
-        self.url = url
+        self.urls = [url] if url else []
+        if urls:
+            self.urls += urls.split(',') if isinstance(urls, str) else list(urls)
+        if not self.urls:
+            raise ValueError("BeerSpider needs a `url` or `urls` to start from")
+        self.url = self.urls[0]
+        self.domains = list(dict.fromkeys(seed_domain(url) for url in self.urls))
+        self.domain = self.domains[0]
+        self.allowed_domains = self.domains
+        # Canonical urls of the start pages and, when pages are budgeted, of every page requested so repeated
+        # links do not use up the budget. Scrapy's dupe filter drops repeated requests otherwise.
+        self.seeds = {canonicalize_url(url) for url in self.urls}
+        self.followed = set()
+        self.pages_scheduled = defaultdict(int)
+        # Profiles the slowest pages when PROFILE_SLOWEST_PAGES is set
+        self.profiler = None
+        # Extracts pages off the reactor when EXTRACTION_PROCESSES is set
+        self.extraction_pool = None
+        # Field paths learned per domain when EXTRACTION_TEMPLATES_ENABLED is set
+        self.templates = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(BeerSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.max_depth = int(kwargs.get('max_depth', crawler.settings.getint('DEEP_CRAWL_MAX_DEPTH', 1)))
+        spider.domain_budget = int(kwargs.get('domain_budget', crawler.settings.getint('DEEP_CRAWL_DOMAIN_BUDGET', 0)))
+        slowest_pages = crawler.settings.getint('PROFILE_SLOWEST_PAGES', 0)
+        if slowest_pages > 0:
+            spider.profiler = SlowPageProfiler(slowest_pages, crawler.settings.getfloat('PROFILE_SAMPLE_RATE', 1.0))
+        processes = crawler.settings.getint('EXTRACTION_PROCESSES', 0)
+        if processes > 0:
+            spider.extraction_pool = ExtractionPool(processes, crawler.settings.getint('EXTRACTION_MAX_PENDING', 0))
+        spider.templates = open_extraction_templates(crawler.settings)
+        crawler.signals.connect(spider.load_templates, signal=signals.spider_opened)
+        return spider
+
+    def load_templates(self, spider):
+        # Read from MongoDB on a thread, the crawl starts once they are loaded
+        if self.templates is not None and self.templates.collection is not None:
+            return threads.deferToThread(self.templates.load)
 
     def start_requests(self):
-        yield scrapy.Request(self.url, self.parse)
+        for url in self.urls:
+            yield scrapy.Request(url, self.parse, dont_filter=True)
+
+    def domain_of(self, url: str) -> Optional[str]:
+        """
+        Gets the crawled domain a url belongs to
+
+        :param url: Standard formatted url string
+        :return: The longest matching domain of `domains`, or None for urls outside all of them
+        """
+        host = (parse.urlparse(url).hostname or '').lower()
+        matches = [domain for domain in self.domains if host == domain or host.endswith('.' + domain)]
+        return max(matches, key=len) if matches else None
 
     def parse(self, response):
-        links = response.css("a").xpath("@href")
-        yield from response.follow_all(links, self.parse_abv)
+        yield from self.follow_links(response, self.parse_abv)
+
+    def follow_links(self, response, callback):
+        """
+        Follows the links of a page which may lead to a beer, the most promising first, while the
+        domain's page budget lasts
+
+        :param response: Page to follow links from
+        :param callback: Callback of the followed requests
+        :return: Requests prioritized by `score_link`
+        """
+        domain = self.domain_of(response.url)
+        if domain is None:
+            return
+        min_score = self.settings.getint('LINK_MIN_SCORE', 0)
+        # Pages link to the same page many times (menus, footers), it is followed once
+        seen = set()
+        for anchor in response.css("a"):
+            href = anchor.attrib.get("href")
+            if not href:
+                continue
+            url = parse.urldefrag(response.urljoin(href.strip()))[0]
+            canonical_url = canonicalize_url(url)
+            if canonical_url in seen or canonical_url in self.seeds or canonical_url in self.followed:
+                continue
+            score = score_link(url, " ".join(anchor.css("::text").getall()), domain)
+            if score is None or score < min_score:
+                self.crawler.stats.inc_value('links/dropped')
+                continue
+            if self.domain_budget and self.pages_scheduled[domain] >= self.domain_budget:
+                self.crawler.stats.inc_value('links/over_budget')
+                continue
+            seen.add(canonical_url)
+            if self.domain_budget:
+                self.followed.add(canonical_url)
+            self.pages_scheduled[domain] += 1
+            self.crawler.stats.inc_value('links/followed')
+            yield response.follow(url, callback, priority=score)
 
     def parse_abv(self, response):
         """
@@ -198,9 +690,80 @@ class BeerSpider(scrapy.Spider):
         10. Change priority of style extraction: Should be 1. Return field, value 2. Get style by tags
         """
 
-        yield {
-            'name': extract_name(response),
-            'style': extract_style(response),
-            'ABV': extract_abv(response),
-            'url': response.url
-        }
+        # Only the extraction reads the truncated page, links are followed from the whole page
+        page = self.truncate(response)
+        min_score = self.settings.getint('BEER_PAGE_MIN_SCORE', 2)
+        domain = self.domain_of(response.url)
+        paths = self.templates.get(domain) if self.templates is not None and domain is not None else None
+        if self.extraction_pool is not None:
+            # The callback's result is the Deferred, Scrapy waits on it for the item and links
+            d = self.extraction_pool.submit(
+                extract_page, page.body, page.url, page.encoding, min_score, paths
+            )
+            d.addCallback(lambda extraction: list(self.handle_extraction(response, extraction)))
+            return d
+
+        profile = self.profiler.profile(response.url) if self.profiler is not None else nullcontext()
+        template = PageTemplate(paths) if paths is not None else None
+        start = time.perf_counter()
+        with recording_stats(self.crawler.stats), profile:
+            index = DocumentIndex(page)
+            item = extract_beer(page, min_score, index, template)
+        return self.handle_extraction(response, Extraction(
+            item,
+            time.perf_counter() - start,
+            index.bytes_stripped,
+            template.hits if template is not None else [],
+            template.learned if template is not None else {}
+        ))
+
+    def truncate(self, response):
+        """
+        Caps a page's body at `EXTRACTION_MAX_BODY_SIZE` bytes (0 for no limit) before it is parsed,
+        bounding the memory and time spent on huge pages. lxml recovers the truncated markup.
+
+        :param response: Downloaded page
+        :return: The page, or a copy with its body truncated
+        """
+        max_size = self.settings.getint('EXTRACTION_MAX_BODY_SIZE', 0)
+        if not max_size or len(response.body) <= max_size:
+            return response
+        self.crawler.stats.inc_value('preparse/pages_truncated')
+        self.crawler.stats.inc_value('preparse/bytes_truncated', len(response.body) - max_size)
+        return response.replace(body=response.body[:max_size])
+
+    def handle_extraction(self, response, extraction: Extraction):
+        """
+        Records a page's extraction and yields its item, and its links while within `max_depth`
+
+        :param response: Extracted page
+        :param extraction: Extraction of the page
+        """
+        self.crawler.stats.inc_value('extraction/time', extraction.seconds)
+        self.crawler.stats.inc_value('extraction/pages')
+        self.crawler.stats.inc_value('preparse/bytes_stripped', extraction.bytes_stripped)
+        if extraction.template_hits:
+            self.crawler.stats.inc_value('templates/hits', len(extraction.template_hits))
+            self.templates.hit(self.domain_of(response.url), extraction.template_hits)
+        if extraction.learned_paths:
+            self.crawler.stats.inc_value('templates/learned', len(extraction.learned_paths))
+            self.templates.learn(self.domain_of(response.url), extraction.learned_paths)
+        if extraction.item is None:
+            self.crawler.stats.inc_value('pages/not_beer')
+        else:
+            yield extraction.item
+
+        # Catalog pages are not beer pages themselves but lead to them
+        if response.meta.get('depth', 0) < self.max_depth:
+            yield from self.follow_links(response, self.parse_abv)
+
+    def closed(self, reason):
+        if self.extraction_pool is not None:
+            self.extraction_pool.shutdown()
+        if self.profiler is not None:
+            run = self.settings.get('CRAWL_JOB_ID') or time.strftime('%Y%m%d-%H%M%S')
+            self.profiler.dump(os.path.join(self.settings.get('PROFILE_DIR', 'profiles'), run))
+        changes = self.templates.unsaved() if self.templates is not None else {}
+        if changes:
+            # Written to MongoDB on a thread, Scrapy waits for it before finishing the crawl
+            return threads.deferToThread(self.templates.save, changes)
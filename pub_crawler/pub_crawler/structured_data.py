@@ -0,0 +1,122 @@
+import json
+import re
+from typing import Any, Dict, Iterator, List, Optional
+
+from lxml import etree
+
+
+# schema.org types describing something sold, beers are usually marked up as one of these
+PRODUCT_TYPES = {"Product", "IndividualProduct", "ProductModel", "Drink", "Beer"}
+
+_MICRODATA_ITEMS = etree.XPath("//*[@itemscope and not(@itemprop)]")
+_OPEN_GRAPH_META = etree.XPath("//meta[starts-with(@property, 'og:') or starts-with(@property, 'product:')]")
+
+
+def type_names(value: Any) -> List[str]:
+    """
+    Gets the bare names of a JSON-LD `@type` or microdata `itemtype`, i.e. "https://schema.org/Product" -> "Product"
+
+    :param value: Type, or list of types, as found in the markup
+    :return: Type names
+    """
+    values = value if isinstance(value, list) else str(value or "").split()
+    return [re.split(r"[/:#]", str(name))[-1] for name in values if name]
+
+
+def first_text(value: Any) -> Optional[str]:
+    """
+    Gets the text of a property whose value may be a list or a JSON-LD value object
+
+    :param value: Property value as found in the markup
+    :return: Stripped text of the first value, None when there is none
+    """
+    if isinstance(value, list):
+        value = next((item for item in value if item not in (None, "")), None)
+    if isinstance(value, dict):
+        value = value.get("@value", value.get("name"))
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    return str(value).strip() or None
+
+
+def walk(value: Any) -> Iterator[dict]:
+    """Yields every object of a JSON-LD (or converted microdata) document, nested ones included"""
+    if isinstance(value, dict):
+        yield value
+        for child in value.values():
+            yield from walk(child)
+    elif isinstance(value, list):
+        for child in value:
+            yield from walk(child)
+
+
+def json_ld_objects(documents: List[str]) -> Iterator[dict]:
+    for document in documents:
+        try:
+            yield from walk(json.loads(document, strict=False))
+        except ValueError:
+            # Pages ship broken JSON-LD as often as not
+            continue
+
+
+def microdata_item(element: etree.ElementBase) -> Dict[str, Any]:
+    """
+    Converts a microdata item to its JSON-LD equivalent
+
+    :param element: Element with an `itemscope`
+    :return: Object with the item's `@type` and properties, properties with several values are lists
+    """
+    item: Dict[str, Any] = {"@type": type_names(element.get("itemtype"))}
+
+    def add_properties(parent):
+        for child in parent:
+            if not isinstance(child.tag, str):
+                continue
+            names = child.get("itemprop")
+            if names:
+                if child.get("itemscope") is not None:
+                    value = microdata_item(child)
+                elif child.tag == "meta":
+                    value = child.get("content")
+                elif child.tag in ("a", "link"):
+                    value = child.get("href")
+                else:
+                    value = child.get("content") or " ".join("".join(child.itertext()).split())
+                for name in names.split():
+                    if name in item:
+                        item[name] = (item[name] if isinstance(item[name], list) else [item[name]]) + [value]
+                    else:
+                        item[name] = value
+            # Properties of nested items belong to them
+            if child.get("itemscope") is None:
+                add_properties(child)
+
+    add_properties(element)
+    return item
+
+
+def products(json_ld: List[str], root: etree.ElementBase) -> List[dict]:
+    """
+    Finds the schema.org products a page describes in its JSON-LD and microdata
+
+    :param json_ld: Bodies of the page's JSON-LD scripts
+    :param root: Root of the page's document
+    :return: Product objects, JSON-LD ones first, in the JSON-LD shape
+    """
+    objects = list(json_ld_objects(json_ld))
+    objects.extend(obj for element in _MICRODATA_ITEMS(root) for obj in walk(microdata_item(element)))
+    return [obj for obj in objects if PRODUCT_TYPES.intersection(type_names(obj.get("@type")))]
+
+
+def open_graph(root: etree.ElementBase) -> Dict[str, str]:
+    """
+    Reads a page's OpenGraph (`og:*` and `product:*`) properties
+
+    :param root: Root of the page's document
+    :return: Content of each property's first tag
+    """
+    properties = {}
+    for meta in _OPEN_GRAPH_META(root):
+        if meta.get("content"):
+            properties.setdefault(meta.get("property"), meta.get("content").strip())
+    return properties
@@ -0,0 +1,248 @@
+import functools
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from lxml import etree
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from scrapy.settings import Settings
+
+from .mongo import get_mongo_client
+
+
+logger = logging.getLogger(__name__)
+
+
+class LocatedText(str):
+    """
+    Text extracted from a page which remembers the XPath of the text node it was read from
+    """
+
+    def __new__(cls, value: str, path: Optional[str]):
+        text = super().__new__(cls, value)
+        text.path = path
+        return text
+
+
+def text_path(text) -> Optional[str]:
+    """
+    Gets the XPath of a text node, i.e. "/html/body/div[2]/text()[1]"
+
+    :param text: Text node returned by an XPath with smart strings
+    :return: XPath selecting the text node, None for plain strings
+    """
+    getparent = getattr(text, "getparent", None)
+    parent = getparent() if getparent is not None else None
+    if parent is None:
+        return None
+    if not text.is_tail:
+        return f"{parent.getroottree().getpath(parent)}/text()[1]"
+    # A tail belongs to the element containing the tail's element, after the text nodes before it
+    owner = parent.getparent()
+    if owner is None:
+        return None
+    position = 1 if owner.text is not None else 0
+    for child in owner:
+        if child.tail is not None:
+            position += 1
+        if child is parent:
+            break
+    return f"{owner.getroottree().getpath(owner)}/text()[{position}]"
+
+
+@functools.lru_cache(maxsize=1024)
+def _compiled_path(path: str) -> etree.XPath:
+    return etree.XPath(path, smart_strings=False)
+
+
+def read_text(root: etree.ElementBase, path: str) -> Optional[str]:
+    """
+    Reads the text node a learned path selects
+
+    :param root: Root of the page's document
+    :param path: XPath of a text node, as returned by `text_path`
+    :return: Stripped text, None when the page has no such node
+    """
+    try:
+        texts = _compiled_path(path)(root)
+    except etree.XPathError:
+        return None
+    return texts[0].strip() if texts and isinstance(texts[0], str) else None
+
+
+class PageTemplate:
+    """
+    Paths of the fields a domain's pages were extracted from, as used to extract one page.
+
+    `hits` lists the fields read through the template and `learned` collects the paths of the fields
+    the heuristics had to find.
+    """
+
+    def __init__(self, paths: Dict[str, str]):
+        self.paths = paths
+        self.hits: List[str] = []
+        self.learned: Dict[str, str] = {}
+
+    def read(self, root: etree.ElementBase, field: str, validate: Callable[[str], bool]) -> Optional[str]:
+        """
+        :param root: Root of the page's document
+        :param field: Field name
+        :param validate: Checks the text read looks like a value of the field
+        :return: Text at the field's path, None when the path is unknown, missing or invalid
+        """
+        path = self.paths.get(field)
+        text = read_text(root, path) if path else None
+        return text if text and validate(text) else None
+
+    def learn(self, root: etree.ElementBase, field: str, value: str, validate: Callable[[str], bool]):
+        """
+        Learns the path of a field's value found by a heuristic, when reading it back gives the same value
+
+        :param root: Root of the page's document
+        :param field: Field name
+        :param value: Extracted value, paths are only known for LocatedTexts
+        :param validate: Checks the value looks like a value of the field
+        """
+        path = getattr(value, "path", None)
+        if path and path != self.paths.get(field) and validate(value) and read_text(root, path) == value:
+            self.learned[field] = path
+
+
+class ExtractionTemplates:
+    """
+    Per domain field paths learned while extracting pages, for the `max_domains` most recently used
+    domains. With a collection, the most recently updated templates are loaded from it by `load` and
+    the paths learned are saved to it by `save`, so they outlive the crawl. Both block and are meant to
+    run on a thread, `get` and `learn` only use the templates in memory.
+
+    A domain's path of a field is only replaced once the same other path was learned on `replace_after`
+    of its pages in a row, so sites with several layouts keep the first one learned rather than
+    replacing it on every page of another layout.
+    """
+
+    def __init__(self, collection=None, max_domains: int = 1000, replace_after: int = 3):
+        self.collection = collection
+        self.max_domains = max_domains
+        self.replace_after = replace_after
+        self.templates: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        # Paths learned in place of known ones with the pages in a row they were learned on, by domain and field
+        self.replacements: Dict[str, Dict[str, Tuple[str, int]]] = {}
+        # Paths by domain and field changed since they were last saved
+        self.changes: Dict[str, Dict[str, str]] = {}
+
+    def get(self, domain: str) -> Dict[str, str]:
+        """
+        :param domain: Crawled domain
+        :return: Paths by field, empty until some are learned
+        """
+        paths = self.templates.get(domain)
+        if paths is None:
+            paths = self.templates[domain] = {}
+            while len(self.templates) > self.max_domains:
+                evicted, _ = self.templates.popitem(last=False)
+                self.replacements.pop(evicted, None)
+        else:
+            self.templates.move_to_end(domain)
+        return paths
+
+    def hit(self, domain: str, fields: Iterable[str]):
+        """
+        Records fields of a page of the domain were read through its template, ending the pages in a row
+        their replacements were learned on
+
+        :param domain: Crawled domain
+        :param fields: Fields read at their known paths
+        """
+        replacements = self.replacements.get(domain)
+        if replacements:
+            for field in fields:
+                replacements.pop(field, None)
+
+    def learn(self, domain: str, paths: Dict[str, str]):
+        """
+        :param domain: Crawled domain
+        :param paths: Paths by field learned on a page, added to the ones known for the domain or counted
+            towards replacing them
+        """
+        known = self.get(domain)
+        replacements = self.replacements.setdefault(domain, {})
+        changes = {}
+        for field, path in paths.items():
+            if field in known:
+                replacement, pages = replacements.get(field, (path, 0))
+                pages = pages + 1 if replacement == path else 1
+                if pages < self.replace_after:
+                    replacements[field] = (path, pages)
+                    continue
+                del replacements[field]
+            changes[field] = path
+        known.update(changes)
+        if changes and self.collection is not None:
+            self.changes.setdefault(domain, {}).update(changes)
+
+    def load(self):
+        """
+        Loads the `max_domains` most recently updated templates of the collection
+        """
+        if self.collection is None:
+            return
+        try:
+            documents = list(self.collection.find({}, sort=[("updated_at", -1)], limit=self.max_domains))
+        except PyMongoError as e:
+            logger.warning("Could not load the extraction templates: %s", e)
+            return
+        for document in reversed(documents):
+            self.templates[document["_id"]] = dict(document.get("paths", {}))
+
+    def unsaved(self) -> Dict[str, Dict[str, str]]:
+        """
+        Takes the paths changed since the last call, to be saved with `save`
+
+        :return: Paths by domain and field
+        """
+        changes, self.changes = self.changes, {}
+        return changes
+
+    def save(self, changes: Dict[str, Dict[str, str]]):
+        """
+        Writes paths to the collection in one bulk write
+
+        :param changes: Paths by domain and field, as returned by `unsaved`
+        """
+        if self.collection is None or not changes:
+            return
+        updated_at = time.time()
+        try:
+            self.collection.bulk_write([
+                UpdateOne(
+                    {"_id": domain},
+                    {"$set": {**{f"paths.{field}": path for field, path in paths.items()}, "updated_at": updated_at}},
+                    upsert=True
+                )
+                for domain, paths in changes.items()
+            ], ordered=False)
+        except PyMongoError as e:
+            logger.warning("Could not save the extraction templates of %d domains: %s", len(changes), e)
+
+
+def open_extraction_templates(settings: Settings) -> Optional[ExtractionTemplates]:
+    """
+    Opens the extraction templates selected by the `EXTRACTION_TEMPLATES_*` settings
+
+    :param settings: Crawler settings
+    :return: ExtractionTemplates kept in memory (`memory`) or in MongoDB (`mongo`), None when disabled
+    """
+    if not settings.getbool("EXTRACTION_TEMPLATES_ENABLED"):
+        return None
+    max_domains = settings.getint("EXTRACTION_TEMPLATES_MAX_DOMAINS", 1000)
+    replace_after = settings.getint("EXTRACTION_TEMPLATES_REPLACE_AFTER", 3)
+    backend = settings.get("EXTRACTION_TEMPLATES_BACKEND", "memory")
+    if backend == "memory":
+        return ExtractionTemplates(max_domains=max_domains, replace_after=replace_after)
+    if backend == "mongo":
+        client = get_mongo_client(settings.get("MONGO_URI"))
+        collection = client[settings.get("MONGODB_DATABASE", "items")]["extraction_templates"]
+        return ExtractionTemplates(collection, max_domains, replace_after)
+    raise ValueError(f"Unknown EXTRACTION_TEMPLATES_BACKEND: {backend}")
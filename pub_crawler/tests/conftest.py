@@ -0,0 +1,201 @@
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from scrapy.http import Request, TextResponse
+from types import SimpleNamespace
+from twisted.python.failure import Failure
+from typing import Dict
+from urllib.parse import parse_qs, urlparse
+import json
+import os
+import sys
+import threading
+import time
+import pytest
+
+
+# Helper functions for unpacking website test data
+Website = namedtuple("Website", ["url", "html_filename"])
+SPIDERS_TEST_DIR = Path(__file__).parent / "spiders"
+with open(SPIDERS_TEST_DIR / "data/websites.json") as websites_file:
+    website_json = json.load(websites_file)
+
+
+website_data: Dict[str, Website] = {}
+for key, val in website_json.items():
+    website_data[key] = Website(url=val["url"], html_filename=SPIDERS_TEST_DIR / val["html_filename"])
+
+
+def get_response(website: Website, depth: int = 1):
+    """Returns a TextResponse object as if the page was followed from a start page `depth` links away"""
+    with open(website.html_filename, "rb") as f:
+        response = TextResponse(
+            url=website.url,
+            body=f.read(),
+            request=Request(website.url, meta={"depth": depth})
+        )
+    return response
+
+
+STONE_ENJOY_010122_DATA = website_data["stonebrewing_stone_enjoy_010122_ufiltered_ipa"]
+STONE_IPA_DATA = website_data["stonebrewing_stone_ipa"]
+NORTH_COAST_PRANQSTER_DATA = website_data["north_coast_brewing_pranqster_belgian_style_golden_ale"]
+
+
+class FakeCollection:
+    """
+    Keeps documents by their `key` field in place of a MongoDB collection. Queries match equal fields and `$in`,
+    updates `$set` (keys may be dotted) and `$inc` or replace. The keys of every bulk write are recorded in `batches`.
+    """
+
+    def __init__(self, key: str = "_id"):
+        self.key = key
+        self.documents = {}
+        self.batches = []
+        self.indexes = {}
+
+    def create_index(self, keys, name=None, **kwargs):
+        self.indexes[name] = keys
+
+    def find(self, query=None, projection=None, sort=None, limit=0):
+        documents = [document for document in self.documents.values() if self.matches(document, query or {})]
+        for field, direction in reversed(sort or []):
+            documents.sort(key=lambda document: document[field], reverse=direction < 0)
+        return documents[:limit] if limit else documents
+
+    def find_one(self, query):
+        return next(iter(self.find(query)), None)
+
+    def insert_one(self, document):
+        self.documents[document[self.key]] = document
+
+    def update_one(self, query, update, upsert=False):
+        document = self.documents.setdefault(query[self.key], {self.key: query[self.key]})
+        for key, value in update.get("$set", {}).items():
+            *parents, name = key.split(".")
+            target = document
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[name] = value
+        for key, value in update.get("$inc", {}).items():
+            document[key] = document.get(key, 0) + value
+
+    def replace_one(self, query, replacement, upsert=False):
+        self.documents[query[self.key]] = {self.key: query[self.key], **replacement}
+
+    def bulk_write(self, requests, ordered=True):
+        keys = [request._filter[self.key] for request in requests]
+        upserted = [key for key in keys if key not in self.documents]
+        for request in requests:
+            if any(key.startswith("$") for key in request._doc):
+                self.update_one(request._filter, request._doc, upsert=request._upsert)
+            else:
+                self.replace_one(request._filter, request._doc, upsert=request._upsert)
+        self.batches.append(keys)
+        return SimpleNamespace(upserted_count=len(upserted), modified_count=len(requests) - len(upserted))
+
+    @staticmethod
+    def matches(document: dict, query: dict) -> bool:
+        for field, condition in query.items():
+            if isinstance(condition, dict) and "$in" in condition:
+                if document.get(field) not in condition["$in"]:
+                    return False
+            elif document.get(field) != condition:
+                return False
+        return True
+
+
+class ImmediateThreadPool:
+    """Runs work synchronously in place of a twisted ThreadPool"""
+
+    def callInThreadWithCallback(self, on_result, func, *args, **kwargs):
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            on_result(False, Failure())
+        else:
+            on_result(True, result)
+
+    def stop(self):
+        pass
+
+
+class ImmediateReactor:
+    def callFromThread(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Serves the saved pages at their urls' paths, `/slow?seconds=` after a delay and `/unavailable` as a 503,
+    recording how many requests it handles at once
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.pages = {}
+        for website in website_data.values():
+            with open(website.html_filename, "rb") as f:
+                self.pages[urlparse(website.url).path] = f.read()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+    def handle_error(self, request, client_address):
+        # Clients which timed out have closed the connection by the time the response is written
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server: FixtureServer = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            url = urlparse(self.path)
+            if url.path == "/slow":
+                time.sleep(float(parse_qs(url.query)["seconds"][0]))
+                self.respond(200, b"<html><body><p>Nothing to drink here</p></body></html>")
+            elif url.path == "/unavailable":
+                self.respond(503, b"")
+            elif url.path in server.pages:
+                self.respond(200, server.pages[url.path])
+            else:
+                self.respond(404, b"")
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = FixtureServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """app.py, which configures itself from the environment when imported and connects to MongoDB lazily"""
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/pub_crawler")
+    os.environ.setdefault("CELERY_BROKER_URL", "memory://")
+    import app
+    return app
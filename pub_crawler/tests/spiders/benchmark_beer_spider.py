@@ -0,0 +1,258 @@
+"""
+Benchmarks the extractors and `BeerSpider.parse_abv` on the saved pages, and on copies of them with their
+body content, and so their text nodes, repeated 10 and 100 times. Every page is also benchmarked without its
+Style and ABV labels (`<page>_unlabeled`), so the style tag and ABV regex fallbacks, which scan every text
+node, are timed too.
+
+Run from the repository root:
+
+    python -m pub_crawler.tests.spiders.benchmark_beer_spider           # compare against the baseline
+    python -m pub_crawler.tests.spiders.benchmark_beer_spider --update  # record a new baseline
+
+Timings are the fastest of several repeats. They are stored relative to a fixed pure Python workload, so a
+baseline recorded on another machine stays comparable. Benchmarks slower than their baseline by more than the
+tolerance are timed again, to rule out noise, and the script exits with 1 if any of them is still too slow.
+Slowdowns within the noise floor (30µs) are always allowed, the fastest benchmarks jitter by more than the
+tolerance.
+"""
+import argparse
+import copy
+import json
+import sys
+import timeit
+from pathlib import Path
+from typing import Callable, Collection, Dict
+
+import lxml.html
+from pub_crawler.pub_crawler.document import DocumentIndex, normalize_label
+from pub_crawler.pub_crawler.spiders.beer_spider import (
+    ABV_LABELS, BeerSpider, extract_abv, extract_beer, extract_name, extract_style, score_beer_page
+)
+from pub_crawler.pub_crawler.templates import PageTemplate
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+
+from ..conftest import get_response, website_data
+
+
+BASELINE_PATH = Path(__file__).parent / "data" / "benchmark_baseline.json"
+SIZES = (1, 10, 100)
+# Labels removed from the `_unlabeled` pages
+FIELD_LABELS = {"style", "beer style", *ABV_LABELS}
+# Times a regression is re-measured before it is reported
+RETRIES = 2
+# Slowdowns of at most this many seconds are noise, whatever the tolerance
+NOISE_FLOOR = 30e-6
+
+
+def enlarge(response: TextResponse, factor: int) -> TextResponse:
+    """
+    Returns a copy of a page whose body content is repeated `factor` times
+
+    :param response: Page to enlarge
+    :param factor: Number of copies of the body's content
+    :return: Enlarged page with the same url
+    """
+    if factor == 1:
+        return response
+    root = lxml.html.fromstring(response.body)
+    body = root.find("body")
+    children = list(body)
+    for _ in range(factor - 1):
+        body.extend(copy.deepcopy(child) for child in children)
+    return TextResponse(
+        url=response.url,
+        body=lxml.html.tostring(root, encoding="utf-8"),
+        encoding="utf-8",
+        request=Request(response.url, meta=response.meta)
+    )
+
+
+def unlabel(response: TextResponse) -> TextResponse:
+    """
+    Returns a copy of a page without its Style and ABV labels, whose values are then only found by the
+    extractors' fallbacks
+
+    :param response: Page to remove the labels from
+    :return: Page with every text node which is one of `FIELD_LABELS` emptied
+    """
+    root = lxml.html.fromstring(response.body)
+    for element in root.iter():
+        if element.text and normalize_label(element.text) in FIELD_LABELS:
+            element.text = ""
+        if element.tail and normalize_label(element.tail) in FIELD_LABELS:
+            element.tail = ""
+    return TextResponse(
+        url=response.url,
+        body=lxml.html.tostring(root, encoding="utf-8"),
+        encoding="utf-8",
+        request=Request(response.url, meta=response.meta)
+    )
+
+
+def calibrate() -> float:
+    """Times a fixed pure Python workload, the unit benchmarks are recorded in"""
+    def workload():
+        counts = {}
+        for i in range(20000):
+            key = str(i % 97)
+            counts[key] = counts.get(key, 0) + i
+        return sorted(counts.items())
+    return time_call(workload)
+
+
+def time_call(func: Callable, repeat: int = 5) -> float:
+    """
+    Times a function call
+
+    :param func: Function called without arguments
+    :param repeat: Number of timing runs, the fastest is kept
+    :return: Seconds per call
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def build_index(response: TextResponse) -> DocumentIndex:
+    """Builds a DocumentIndex along with the text nodes and element walk it computes on first use"""
+    index = DocumentIndex(response)
+    index.texts, index.elements_by_label
+    return index
+
+
+def learn_template(response: TextResponse) -> Dict[str, str]:
+    """Returns the paths a page's fields are learned at"""
+    template = PageTemplate({})
+    extract_beer(response, template=template)
+    return template.learned
+
+
+def fresh(response: TextResponse) -> TextResponse:
+    """Returns a copy of a page which was not decoded or parsed yet, as a downloaded page is"""
+    return response.replace(body=response.body)
+
+
+def extract_templated(response: TextResponse, paths: Dict[str, str]) -> dict:
+    return extract_beer(response, index=DocumentIndex(response), template=PageTemplate(paths))
+
+
+def get_benchmarks(response: TextResponse) -> Dict[str, Callable]:
+    index = build_index(response)
+    spider = BeerSpider.from_crawler(get_crawler(BeerSpider), url=response.url)
+    paths = learn_template(fresh(response))
+    return {
+        # Parsing included, as for every downloaded page
+        "document_index": lambda: build_index(fresh(response)),
+        "score_beer_page": lambda: score_beer_page(index),
+        "extract_name": lambda: extract_name(response, index),
+        "extract_style": lambda: extract_style(response, index),
+        "extract_abv": lambda: extract_abv(response, index),
+        "parse_abv": lambda: list(spider.parse_abv(fresh(response))),
+        # Extraction of a page of a domain whose template was learned, index included
+        "extract_beer_templated": lambda: extract_templated(fresh(response), paths),
+    }
+
+
+def run(sizes=SIZES, only: Collection[str] = None) -> Dict[str, float]:
+    """
+    Runs every benchmark on every saved page at every size
+
+    :param sizes: Enlargement factors
+    :param only: Runs only these benchmarks when given
+    :return: Seconds per call by `<page>/x<size>/<benchmark>`
+    """
+    results = {}
+    pages = {}
+    for key, website in website_data.items():
+        pages[key] = get_response(website)
+        pages[f"{key}_unlabeled"] = unlabel(pages[key])
+    for key, response in pages.items():
+        for size in sizes:
+            prefix = f"{key}/x{size}/"
+            if only is not None and not any(benchmark.startswith(prefix) for benchmark in only):
+                continue
+            for name, func in get_benchmarks(enlarge(response, size)).items():
+                if only is not None and prefix + name not in only:
+                    continue
+                results[prefix + name] = seconds = time_call(func, repeat=5 if size < 100 else 3)
+                print(f"{key}/x{size}/{name}: {seconds * 1000:.3f}ms", file=sys.stderr)
+    return results
+
+
+def compare(
+        results: Dict[str, float],
+        calibration: float,
+        baseline: dict,
+        tolerance: float,
+        noise_floor: float = NOISE_FLOOR
+) -> Dict[str, str]:
+    """
+    Compares benchmark results against a baseline
+
+    :param results: Seconds per call by benchmark
+    :param calibration: Seconds of the calibration workload on this machine
+    :param baseline: Baseline recorded by `--update`
+    :param tolerance: Allowed slowdown, i.e. 0.5 for 50%
+    :param noise_floor: Seconds a benchmark may always be slower by
+    :return: Description of every regression by benchmark
+    """
+    regressions = {}
+    for key, seconds in results.items():
+        relative = baseline["results"].get(key)
+        if relative is None:
+            continue
+        expected = relative * calibration
+        if seconds - expected > max(expected * tolerance, noise_floor):
+            regressions[key] = (
+                f"{key}: {seconds * 1000:.3f}ms, baseline {expected * 1000:.3f}ms "
+                f"(+{tolerance:.0%} or {noise_floor * 1e6:.0f}µs allowed)"
+            )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the beer extractors on the saved pages")
+    parser.add_argument("--update", action="store_true", help="Record the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown, default 0.5 for 50%%")
+    parser.add_argument(
+        "--noise-floor", type=float, default=NOISE_FLOOR * 1e6,
+        help=f"Slowdown in microseconds always allowed, default {NOISE_FLOOR * 1e6:.0f}"
+    )
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="Comma separated enlargement factors")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    calibration = calibrate()
+    results = run(sizes)
+    if args.update:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(
+                {"results": {key: seconds / calibration for key, seconds in sorted(results.items())}},
+                baseline_file,
+                indent=2
+            )
+            baseline_file.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    noise_floor = args.noise_floor / 1e6
+    regressions = compare(results, calibration, baseline, args.tolerance, noise_floor)
+    for _ in range(RETRIES):
+        if not regressions:
+            break
+        retried = run(sizes, only=regressions)
+        regressions = compare(retried, calibrate(), baseline, args.tolerance, noise_floor)
+    for regression in regressions.values():
+        print(f"REGRESSION {regression}")
+    if regressions:
+        return 1
+    print(f"{len(results)} benchmarks within {args.tolerance:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
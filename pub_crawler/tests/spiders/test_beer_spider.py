@@ -1,38 +1,10 @@
 from pub_crawler.pub_crawler.spiders.beer_spider import *
-from scrapy.http import TextResponse
-import json
-from collections import namedtuple
-from pathlib import Path
-from typing import Dict
-
-
-# Helper functions for unpacking website test data
-Website = namedtuple("Website", ["url", "html_filename"])
-with open(Path.joinpath(Path.cwd(), Path(__file__).parent, "data/websites.json")) as websites_file:
-    website_json = json.load(websites_file)
-
-
-website_data: Dict[str, Website] = {}
-for key, val in website_json.items():
-    website_data[key] = Website(
-        url=val["url"],
-        html_filename=Path.joinpath(Path.cwd(), Path(__file__).parent, val["html_filename"])
-    )
-
-
-def get_response(website: Website):
-    """Returns a TextResponse object which is expected """
-    with open(website.html_filename, "rb") as f:
-        response = TextResponse(
-            url=website.url,
-            body=f.read()
-        )
-    return response
-
-
-STONE_ENJOY_010122_DATA = website_data["stonebrewing_stone_enjoy_010122_ufiltered_ipa"]
-STONE_IPA_DATA = website_data["stonebrewing_stone_ipa"]
-NORTH_COAST_PRANQSTER_DATA = website_data["north_coast_brewing_pranqster_belgian_style_golden_ale"]
+from pub_crawler.tests.conftest import (
+    NORTH_COAST_PRANQSTER_DATA, STONE_ENJOY_010122_DATA, STONE_IPA_DATA, Website, get_response, website_data
+)
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
 
 
 # Tests
@@ -100,3 +72,326 @@ def test_extract_value():
         field_spelling=["availability", "Availability", "AVAILABILITY"]
     )
     assert value == "CA & RVA"
+
+
+def test_style_tag_matcher():
+    """Tests the `StyleTagMatcher.find` method"""
+    matcher = StyleTagMatcher(["stout", "IPA"])
+    texts = ["Imperial Stout\nnot a style", "Hazy IPA and more IPA here", "Tipa"]
+    matches = matcher.find(texts)
+    assert matches == [
+        ("Imperial Stout", "stout"),
+        ("Hazy IPA and more IPA", "IPA"),
+    ]
+
+
+def test_parse_abv():
+    """Tests the `BeerSpider.parse_abv` method builds a full item from a single shared index"""
+    crawler = get_crawler(BeerSpider)
+    spider = BeerSpider.from_crawler(crawler, url=STONE_IPA_DATA.url)
+    items = list(spider.parse_abv(get_response(STONE_IPA_DATA)))
+    assert items == [{
+        "name": "Stone IPA",
+        "style": "IPA",
+        "ABV": "6.9%",
+        "url": STONE_IPA_DATA.url
+    }]
+    assert crawler.stats.get_value("extraction/pages") == 1
+    assert crawler.stats.get_value("extraction/time") > 0
+    assert crawler.stats.get_value("timing/extract_style/count") == 1
+    assert crawler.stats.get_value("timing/extract_value/count") >= 2
+
+
+def test_extract_value_normalized_label():
+    """Tests the `extract_value` function matches labels regardless of case, spacing and trailing colons"""
+    response = TextResponse(
+        url="https://example.com/beer/example-ipa",
+        body=b"<html><body><div><span>ibu :</span><span>65</span></div></body></html>"
+    )
+    assert extract_value(response, field_spelling=["IBU"]) == "65"
+    assert extract_value(response, field_spelling=["International Bitterness Units", "Ibu"]) == "65"
+    assert extract_value(response, field_spelling=["SRM"]) is None
+
+
+def test_score_link():
+    """Tests the `score_link` function ranks beer pages first and drops junk links"""
+    domain = "stonebrewing.com"
+    beer_score = score_link(STONE_IPA_DATA.url, "", domain)
+    category_score = score_link("https://www.stonebrewing.com/beer/year-round-releases", "Year-Round Releases", domain)
+    other_score = score_link("https://www.stonebrewing.com/mixedpack", "What's in the Stone Mixed Pack", domain)
+    assert beer_score > category_score > other_score
+
+    assert score_link("https://www.facebook.com/StoneBrewing", "Facebook", domain) is None
+    assert score_link("mailto:info@stonebrewing.com", "Email", domain) is None
+    assert score_link("https://www.stonebrewing.com/about/careers", "Careers at Stone Brewing", domain) is None
+    assert score_link("https://www.stonebrewing.com/files/stone-ipa.pdf", "Stone IPA", domain) is None
+    assert score_link("https://www.stonebrewing.com/privacy-policy", "Privacy", domain) is None
+    assert score_link("https://www.stonebrewing.com/events", "Events", domain) is None
+    assert score_link("https://www.stonebrewing.com/blog/stone-ipa-turns-25", "Stone IPA turns 25", domain) is None
+    assert score_link("https://cdn.stonebrewing.com/beer/stone-ipa", "Stone IPA", domain) is None
+
+    # Slugs naming a beer with a deny word, and pages under a beer section, are followed
+    for path in [
+        "/beer/year-round/press-gang-porter", "/beers/gift-of-the-magi", "/beers/event-horizon-imperial-stout",
+        "/beer/visit-sf-ipa", "/beers/events/oktoberfest-lager", "/event-horizon-imperial-stout"
+    ]:
+        assert score_link(f"https://www.stonebrewing.com{path}", "", domain) is not None
+
+
+def test_parse():
+    """Tests the `BeerSpider.parse` method only follows prioritized same-domain links"""
+    spider = BeerSpider.from_crawler(get_crawler(BeerSpider), url="https://www.stonebrewing.com/beer")
+    requests = list(spider.parse(get_response(STONE_IPA_DATA)))
+    urls = [request.url for request in requests]
+    assert STONE_ENJOY_010122_DATA.url in urls
+    assert len(urls) == len(set(urls))
+    assert all(parse.urlparse(url).hostname.endswith("stonebrewing.com") for url in urls)
+    assert not any("careers" in url for url in urls)
+
+    best_request = max(requests, key=lambda request: request.priority)
+    assert "/beer/" in best_request.url
+
+
+def test_parse_abv_skips_other_pages():
+    """Tests the `BeerSpider.parse_abv` method yields nothing for pages which do not describe a beer"""
+    crawler = get_crawler(BeerSpider)
+    spider = BeerSpider.from_crawler(crawler, url="https://www.stonebrewing.com/beer")
+    url = "https://www.stonebrewing.com/about/our-story"
+    response = TextResponse(
+        url=url,
+        body=b"<html><body><h1>Our Story</h1><p>Founded in 1996 in San Marcos, California.</p></body></html>",
+        request=Request(url, meta={"depth": 1})
+    )
+    assert list(spider.parse_abv(response)) == []
+    assert crawler.stats.get_value("pages/not_beer") == 1
+
+
+def test_score_beer_page():
+    """Tests the `score_beer_page` function"""
+    for website in website_data.values():
+        assert score_beer_page(DocumentIndex(get_response(website))) >= 2
+
+    product_response = TextResponse(
+        url="https://example.com/beers/example-ipa",
+        body=b'<html><body><div itemscope itemtype="https://schema.org/Product"><h1>Example</h1></div></body></html>'
+    )
+    assert score_beer_page(DocumentIndex(product_response)) == 2
+
+
+def test_parse_abv_deep_crawl():
+    """Tests the `BeerSpider.parse_abv` method follows links within the depth and domain budgets"""
+    crawler = get_crawler(BeerSpider, settings_dict={"DEEP_CRAWL_MAX_DEPTH": 2, "DEEP_CRAWL_DOMAIN_BUDGET": 5})
+    spider = BeerSpider.from_crawler(crawler, url="https://www.stonebrewing.com/beer")
+
+    results = list(spider.parse_abv(get_response(STONE_IPA_DATA, depth=1)))
+    requests = [result for result in results if isinstance(result, Request)]
+    assert len(results) - len(requests) == 1
+    assert len(requests) == 5
+    assert len(spider.followed) == 5
+    assert crawler.stats.get_value("links/over_budget") > 0
+
+    # Pages at the maximum depth are extracted without following their links
+    results = list(spider.parse_abv(get_response(STONE_IPA_DATA, depth=2)))
+    assert not any(isinstance(result, Request) for result in results)
+
+    # Overriding the settings as spider arguments
+    spider = BeerSpider.from_crawler(crawler, url="https://www.stonebrewing.com/beer", max_depth="1")
+    assert spider.max_depth == 1
+
+    # Without a budget repeated links are left to Scrapy's dupe filter, followed urls are not kept
+    spider = BeerSpider.from_crawler(crawler, url="https://www.stonebrewing.com/beer", domain_budget="0")
+    assert any(isinstance(result, Request) for result in spider.parse_abv(get_response(STONE_IPA_DATA, depth=1)))
+    assert spider.followed == set()
+
+
+def test_multiple_seed_urls():
+    """Tests a `BeerSpider` started from several urls crawls each of their domains with its own budget"""
+    crawler = get_crawler(BeerSpider, settings_dict={"DEEP_CRAWL_DOMAIN_BUDGET": 3})
+    spider = BeerSpider.from_crawler(
+        crawler, urls="https://www.stonebrewing.com/beer,https://example.com/beers,https://shop.example.com/"
+    )
+    assert spider.domains == ["stonebrewing.com", "example.com", "shop.example.com"]
+    assert [request.url for request in spider.start_requests()] == spider.urls
+    assert spider.domain_of("https://www.stonebrewing.com/beer/stone-ipa") == "stonebrewing.com"
+    assert spider.domain_of("https://shop.example.com/beers/example-ipa") == "shop.example.com"
+    assert spider.domain_of("https://other.com/beers") is None
+
+    requests = list(spider.parse(get_response(STONE_IPA_DATA)))
+    assert len(requests) == 3
+    assert spider.pages_scheduled == {"stonebrewing.com": 3}
+
+
+class ImmediateExtractionPool:
+    """Runs extraction synchronously in place of an ExtractionPool"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args):
+        self.submitted.append(args[1])
+        return defer.succeed(func(*args))
+
+
+def test_extract_page():
+    """Tests the `extract_page` function extracts the same item from a page's raw content"""
+    for website in website_data.values():
+        response = get_response(website)
+        extraction = extract_page(response.body, response.url, response.encoding)
+        assert extraction.item == extract_beer(response)
+        assert extraction.seconds > 0
+        assert extraction.bytes_stripped > 0
+
+
+def test_parse_abv_extraction_pool():
+    """Tests the `BeerSpider.parse_abv` method hands pages to the extraction pool when there is one"""
+    crawler = get_crawler(BeerSpider, settings_dict={"DEEP_CRAWL_MAX_DEPTH": 2})
+    spider = BeerSpider.from_crawler(crawler, url=STONE_IPA_DATA.url)
+    expected = list(spider.parse_abv(get_response(STONE_IPA_DATA)))
+
+    spider = BeerSpider.from_crawler(crawler, url=STONE_IPA_DATA.url)
+    spider.extraction_pool = ImmediateExtractionPool()
+    d = spider.parse_abv(get_response(STONE_IPA_DATA))
+    assert isinstance(d, defer.Deferred)
+    assert spider.extraction_pool.submitted == [STONE_IPA_DATA.url]
+    results = d.result
+    assert results[0] == expected[0]
+    assert [request.url for request in results[1:]] == [request.url for request in expected[1:]]
+
+
+def test_document_index_strips_code():
+    """Tests script, style and noscript text is stripped before indexing, after JSON-LD is read, and only there"""
+    response = TextResponse(
+        url="https://example.com/beers/example-ipa",
+        body=b'<html><head><style>.abv { color: red }</style>'
+             b'<script type="application/ld+json">{"@type": "Product", "name": "Example IPA"}</script></head>'
+             b'<body><h1>Example IPA</h1><script>var style = "Stout";</script> ABV: 6.5%'
+             b'<noscript><p>Enable JavaScript</p></noscript></body></html>'
+    )
+    index = DocumentIndex(response)
+    assert index.json_ld == ['{"@type": "Product", "name": "Example IPA"}']
+    assert [text.strip() for text in index.texts] == ["Example IPA", "ABV: 6.5%"]
+    assert index.bytes_stripped > 0
+    assert extract_abv(response, index) == "6.5%"
+
+    # The response's own document is left whole, for link extraction and further indexes
+    assert len(response.xpath("//script")) == 2
+    second_index = DocumentIndex(response)
+    assert second_index.json_ld == index.json_ld
+    assert second_index.bytes_stripped == index.bytes_stripped
+    assert extract_structured(second_index)["name"] == "Example IPA"
+
+
+def test_parse_abv_truncates_huge_pages():
+    """Tests pages over EXTRACTION_MAX_BODY_SIZE are truncated before they are parsed, but not before their links are"""
+    crawler = get_crawler(BeerSpider, settings_dict={"EXTRACTION_MAX_BODY_SIZE": 200000, "DEEP_CRAWL_MAX_DEPTH": 2})
+    spider = BeerSpider.from_crawler(crawler, url=STONE_IPA_DATA.url)
+    response = get_response(STONE_IPA_DATA)
+    cut_link = b'<a href="/beer/core/past-the-cut-ipa">Past The Cut IPA</a>'
+    response = response.replace(body=response.body.replace(
+        b"</body>", b"<p>" + b"x" * 200000 + b"</p>" + cut_link + b"</body>", 1
+    ))
+
+    results = list(spider.parse_abv(response))
+    items = [result for result in results if not isinstance(result, Request)]
+    assert items[0]["ABV"] == "6.9%"
+    assert "https://www.stonebrewing.com/beer/core/past-the-cut-ipa" in [
+        result.url for result in results if isinstance(result, Request)
+    ]
+    assert crawler.stats.get_value("preparse/pages_truncated") == 1
+    assert crawler.stats.get_value("preparse/bytes_truncated") == len(response.body) - 200000
+    assert crawler.stats.get_value("preparse/bytes_stripped") > 0
+
+
+def test_extract_structured():
+    """Tests beer fields are read from JSON-LD, microdata and product OpenGraph markup"""
+    json_ld_response = TextResponse(
+        url="https://example.com/beers/example-ipa",
+        body=b'<html><head><script type="application/ld+json">{"@context": "https://schema.org", "@graph": ['
+             b'{"@type": "Organization", "name": "Example Brewing"},'
+             b'{"@type": ["Product", "Drink"], "name": "Example IPA", "additionalProperty": ['
+             b'{"@type": "PropertyValue", "name": "Beer Style", "value": "West Coast IPA"},'
+             b'{"@type": "PropertyValue", "name": "ABV", "value": 6.5}]}]}</script></head>'
+             b'<body><h1>Example IPA</h1></body></html>'
+    )
+    assert extract_structured(DocumentIndex(json_ld_response)) == {
+        "name": "Example IPA", "style": "West Coast IPA", "ABV": "6.5%"
+    }
+
+    microdata_response = TextResponse(
+        url="https://example.com/beers/example-stout",
+        body=b'<html><body><div itemscope itemtype="https://schema.org/Product">'
+             b'<h1 itemprop="name">Example Stout</h1><span itemprop="category">Beer &gt; Imperial Stout</span>'
+             b'<div itemprop="brand" itemscope itemtype="https://schema.org/Brand"><span itemprop="name">Example</span></div>'
+             b'<div itemprop="additionalProperty" itemscope itemtype="https://schema.org/PropertyValue">'
+             b'<span itemprop="name">Alcohol by volume</span><span itemprop="value">10.2% ABV</span></div>'
+             b'</div></body></html>'
+    )
+    assert extract_structured(DocumentIndex(microdata_response)) == {
+        "name": "Example Stout", "style": "Imperial Stout", "ABV": "10.2%"
+    }
+
+    open_graph_body = b'<html><head><meta property="og:type" content="%s"/>' \
+                      b'<meta property="og:title" content="Example Lager"/></head><body></body></html>'
+    product_response = TextResponse(url="https://example.com/beers/example-lager", body=open_graph_body % b"product")
+    assert extract_structured(DocumentIndex(product_response)) == {"name": "Example Lager"}
+    article_response = TextResponse(url="https://example.com/beers/example-lager", body=open_graph_body % b"article")
+    assert extract_structured(DocumentIndex(article_response)) == {}
+
+    # The saved pages have no product markup, their items come from the heuristics
+    assert extract_structured(DocumentIndex(get_response(NORTH_COAST_PRANQSTER_DATA))) == {}
+
+
+def test_structured_abv_percent():
+    """Tests ABV properties are read as percents, small fractions of 1 included, and other numbers are ignored"""
+    assert structured_abv_percent("6.5") == "6.5%"
+    assert structured_abv_percent(" 10.2% ABV") == "10.2%"
+    assert structured_abv_percent("0.065") == "6.5%"
+    assert structured_abv_percent("0.2") == "20%"
+    assert structured_abv_percent("0.5") == "0.5%"
+    assert structured_abv_percent("0.5%") == "0.5%"
+    assert structured_abv_percent("Brewed since 1996") is None
+    assert structured_abv_percent("1996") is None
+    assert structured_abv_percent("150%") is None
+    assert structured_abv_percent("0") is None
+    assert structured_abv_percent("") is None
+
+
+def test_extract_beer_structured_fields_first():
+    """Tests the heuristic extractors only fill the fields missing from structured data"""
+    response = TextResponse(
+        url="https://example.com/beers/example-ipa",
+        body=b'<html><head><script type="application/ld+json">'
+             b'{"@type": "Product", "name": "Example IPA (Can)", "category": "Beer"}</script></head>'
+             b'<body><h1>Example IPA</h1><div><span>Style</span><span>IPA</span></div>'
+             b'<div><span>ABV</span><span>6.5%</span></div></body></html>'
+    )
+    assert extract_beer(response) == {
+        "name": "Example IPA (Can)", "style": "IPA", "ABV": "6.5%", "url": response.url
+    }
+
+
+def test_parse_abv_learns_templates():
+    """Tests pages of a domain whose template was learned are extracted from its paths alone"""
+    crawler = get_crawler(BeerSpider, settings_dict={
+        "EXTRACTION_TEMPLATES_ENABLED": True, "EXTRACTION_TEMPLATES_BACKEND": "memory"
+    })
+    spider = BeerSpider.from_crawler(crawler, url=STONE_IPA_DATA.url)
+    assert list(spider.parse_abv(get_response(STONE_IPA_DATA))) == [extract_beer(get_response(STONE_IPA_DATA))]
+    assert crawler.stats.get_value("templates/learned") == 3
+    paths = dict(spider.templates.get("stonebrewing.com"))
+    assert set(paths) == {"name", "style", "ABV"}
+
+    items = list(spider.parse_abv(get_response(STONE_ENJOY_010122_DATA)))
+    assert items == [extract_beer(get_response(STONE_ENJOY_010122_DATA))]
+    assert crawler.stats.get_value("templates/hits") == 3
+    assert crawler.stats.get_value("timing/extract_style/count") == 1
+
+    # A page of the domain built on another template falls back to the heuristics
+    other_page = get_response(NORTH_COAST_PRANQSTER_DATA).replace(
+        url="https://www.stonebrewing.com/beers/year-round-beers/pranqster-belgian-style-golden-ale/"
+    )
+    assert list(spider.parse_abv(other_page)) == [extract_beer(other_page)]
+    assert crawler.stats.get_value("timing/extract_style/count") == 2
+    assert crawler.stats.get_value("templates/learned") == 6
+    # One page of another layout does not replace the domain's template
+    assert spider.templates.get("stonebrewing.com") == paths
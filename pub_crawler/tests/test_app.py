@@ -0,0 +1,212 @@
+from bson.objectid import ObjectId
+from pub_crawler.pub_crawler.normalization import canonical_style
+from pub_crawler.tests.conftest import FakeCollection
+from response_cache import ResponseCache
+from types import SimpleNamespace
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest
+import json
+import pytest
+
+
+class FakeCursor:
+    """Projects the documents found and records the sort, skip and limit applied, in place of a pymongo Cursor"""
+
+    def __init__(self, documents, projection):
+        self.documents = documents
+        self.projection = projection
+        self.sorted_by = None
+        self.skipped = 0
+        self.limited = 0
+
+    def sort(self, key, direction=None):
+        self.sorted_by = key if direction is None else [(key, direction)]
+        return self
+
+    def skip(self, count):
+        self.skipped = count
+        return self
+
+    def limit(self, count):
+        self.limited = count
+        return self
+
+    def __iter__(self):
+        documents = self.documents[self.skipped:]
+        for document in documents[:self.limited] if self.limited else documents:
+            if self.projection:
+                included = 1 in self.projection.values()
+                document = {
+                    field: value for field, value in document.items()
+                    if (field in self.projection) == included or field == "_id"
+                }
+            yield document
+
+
+class FakeItems:
+    """`scrapy_items` collection returning every item to any query, recording the queries and their cursors"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.finds = []
+
+    def find(self, query, projection=None):
+        cursor = FakeCursor(self.documents, projection)
+        self.finds.append((query, cursor))
+        return cursor
+
+
+@pytest.fixture
+def items(app_module, monkeypatch):
+    items = FakeItems([
+        {"_id": ObjectId(), "name": f"Beer {i}", "style": "IPA", "ABV": "6.9%", "url": f"https://example.com/{i}"}
+        for i in range(3)
+    ])
+    monkeypatch.setattr(app_module, "mongo", SimpleNamespace(db=SimpleNamespace(scrapy_items=items)))
+    monkeypatch.setattr(app_module, "response_cache", ResponseCache(
+        SimpleNamespace(response_cache_state=FakeCollection(), response_cache=FakeCollection())
+    ))
+    return items
+
+
+@pytest.fixture
+def client(app_module, items):
+    return app_module.app.test_client()
+
+
+# Tests
+def test_build_beers_query(app_module):
+    """Tests beers are looked up over the normalized fields, sorted along the index serving the query"""
+    style = canonical_style("Hazy IPA")
+    assert style is not None
+    assert app_module.build_beers_query(MultiDict({"style": "Hazy IPA", "abv_min": "5", "abv_max": "7.5"})) == (
+        {"style_canonical": style, "abv_pct": {"$gte": 5.0, "$lte": 7.5}}, [("abv_pct", 1), ("_id", 1)]
+    )
+    assert app_module.build_beers_query(MultiDict({"name": "Stone I"})) == (
+        {"name_key": {"$regex": "^" + app_module.re.escape(app_module.name_key("Stone I"))}},
+        [("name_key", 1), ("_id", 1)]
+    )
+    assert app_module.build_beers_query(MultiDict()) == ({}, [("_id", 1)])
+    with pytest.raises(BadRequest):
+        app_module.build_beers_query(MultiDict({"style": "Lemonade"}))
+    with pytest.raises(BadRequest):
+        app_module.build_beers_query(MultiDict({"abv_max": "strong"}))
+
+
+def test_get_beers(client, items):
+    """Tests beers are paged with `limit` and `offset`, 100 at a time by default"""
+    response = client.get("/beers?style=IPA&limit=2&offset=1")
+    assert response.status_code == 200
+    assert [beer["name"] for beer in json.loads(response.data)] == ["Beer 1", "Beer 2"]
+    query, cursor = items.finds[-1]
+    assert query == {"style_canonical": canonical_style("IPA")}
+    assert (cursor.sorted_by, cursor.skipped, cursor.limited) == ([("abv_pct", 1), ("_id", 1)], 1, 2)
+    assert cursor.projection == {"content_hash": 0}
+
+    client.get("/beers")
+    _, cursor = items.finds[-1]
+    assert (cursor.skipped, cursor.limited) == (0, 100)
+
+
+@pytest.mark.parametrize("query", [
+    "limit=abc", "offset=x", "limit=abc&offset=x", "limit=0", "limit=1001", "offset=-1", "abv_min=strong"
+])
+def test_get_beers_bad_request(client, items, query):
+    """Tests invalid paging and filter arguments are rejected rather than replaced by their defaults"""
+    assert client.get(f"/beers?{query}").status_code == 400
+    assert items.finds == []
+
+
+def test_build_items_query(app_module):
+    """Tests items are filtered by `_id` for paging, by style text and by the numeric value of their ABV"""
+    after = ObjectId()
+    assert app_module.build_items_query(MultiDict()) == {}
+    assert app_module.build_items_query(MultiDict({"after": str(after)})) == {"_id": {"$gt": after}}
+    query = app_module.build_items_query(MultiDict({"after": str(after), "style": "Imperial (Double)", "abv_min": "5"}))
+    assert query == {"$and": [
+        {"_id": {"$gt": after}},
+        {"style": {"$regex": r"Imperial\ \(Double\)", "$options": "i"}},
+        app_module.abv_bound("$gte", 5.0)
+    ]}
+    abv = {"$convert": {
+        "input": {"$trim": {"input": "$ABV", "chars": "% "}}, "to": "double", "onError": None, "onNull": None
+    }}
+    assert app_module.abv_bound("$lte", 7.5) == {"$expr": {"$and": [{"$ne": [abv, None]}, {"$lte": [abv, 7.5]}]}}
+    with pytest.raises(BadRequest):
+        app_module.build_items_query(MultiDict({"after": "not-an-id"}))
+    with pytest.raises(BadRequest):
+        app_module.build_items_query(MultiDict({"abv_min": "strong"}))
+
+
+def test_get_data(client, items):
+    """Tests items are streamed in `_id` order as a JSON array or as ndjson, with only the fields asked for"""
+    response = client.get("/data")
+    assert response.mimetype == "application/json"
+    assert [item["name"] for item in json.loads(response.data)] == ["Beer 0", "Beer 1", "Beer 2"]
+    query, cursor = items.finds[-1]
+    assert query == {}
+    assert (cursor.sorted_by, cursor.limited, cursor.projection) == ([("_id", 1)], 0, None)
+
+    after = str(items.documents[0]["_id"])
+    response = client.get(f"/data?after={after}&limit=2&fields=name,%20ABV&format=ndjson")
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.data.decode().splitlines()
+    assert [set(json.loads(line)) for line in lines] == [{"_id", "name", "ABV"}] * 2
+    query, cursor = items.finds[-1]
+    assert query == {"_id": {"$gt": ObjectId(after)}}
+    assert (cursor.limited, cursor.projection) == (2, {"name": 1, "ABV": 1})
+
+
+@pytest.mark.parametrize("query", ["limit=abc", "limit=-1", "after=not-an-id", "format=xml", "abv_max=strong"])
+def test_get_data_bad_request(client, items, query):
+    """Tests invalid arguments of /data are rejected"""
+    assert client.get(f"/data?{query}").status_code == 400
+    assert items.finds == []
+
+
+@pytest.fixture
+def queued(app_module, monkeypatch):
+    """Crawl tasks queued by the API, as (task, args, kwargs), with their jobs recorded in a FakeCollection"""
+    queued = []
+    monkeypatch.setattr(app_module, "mongo", SimpleNamespace(db=SimpleNamespace(crawl_jobs=FakeCollection())))
+    for task in (app_module.crawl, app_module.crawl_batch):
+        monkeypatch.setattr(
+            task, "apply_async", lambda args, kwargs, task_id, task=task: queued.append((task.name, args, kwargs))
+        )
+    return queued
+
+
+def test_crawl_batch_job(app_module, queued):
+    """Tests a batch crawl's job is recorded and its task queued with the options converted to their types"""
+    client = app_module.app.test_client()
+    response = client.post("/crawl/batch", json={
+        "urls": ["https://example.com/a", "https://example.com/b"],
+        "max_depth": "2",
+        "concurrency_per_domain": 4,
+        "download_delay": 0.5
+    })
+    assert response.status_code == 200
+    job_id = response.get_json()["job_id"]
+    assert app_module.mongo.db.crawl_jobs.documents[job_id]["status"] == "queued"
+    assert queued == [(app_module.crawl_batch.name, (job_id, ["https://example.com/a", "https://example.com/b"]), {
+        "max_depth": 2,
+        "domain_budget": None,
+        "concurrency_per_domain": 4,
+        "download_delay": 0.5,
+        "engine": "scrapy"
+    })]
+
+
+@pytest.mark.parametrize("options", [
+    {"max_depth": "deep"}, {"max_depth": -1}, {"max_depth": 1.5}, {"domain_budget": True},
+    {"concurrency_per_domain": 0}, {"concurrency_per_domain": "many"}, {"download_delay": "slow"},
+    {"download_delay": -0.5}, {"download_delay": "nan"}, {"engine": "curl"}
+])
+def test_crawl_bad_request(app_module, queued, options):
+    """Tests invalid crawl options are rejected before a job is recorded, its task would fail and leave it queued"""
+    client = app_module.app.test_client()
+    assert client.post("/crawl/batch", json={"urls": ["https://example.com/a"], **options}).status_code == 400
+    if "concurrency_per_domain" not in options and "download_delay" not in options:
+        assert client.post("/crawl", json={"url": "https://example.com/a", **options}).status_code == 400
+    assert app_module.mongo.db.crawl_jobs.documents == {}
+    assert queued == []
@@ -0,0 +1,73 @@
+from pub_crawler.pub_crawler.asyncio_engine import AsyncioEngine
+from pub_crawler.pub_crawler.pipelines import MongoDBPipeline
+from pub_crawler.pub_crawler.spiders.beer_spider import extract_beer
+from pub_crawler.tests.conftest import FakeCollection, get_response, website_data
+from scrapy.settings import Settings
+from urllib.parse import urlparse
+import time
+
+
+def get_engine(pipeline=None, **settings) -> AsyncioEngine:
+    return AsyncioEngine(Settings({"EXTRACTION_TEMPLATES_ENABLED": False, **settings}), pipeline)
+
+
+# Tests
+def test_crawl(server):
+    """Tests pages are extracted into the spider's items and written with the pipeline"""
+    urls = {website.url: server.url(urlparse(website.url).path) for website in website_data.values()}
+    pipeline = MongoDBPipeline(mongo_uri=None, mongo_db="items", batch_size=2, flush_interval=0)
+    pipeline.db = {MongoDBPipeline.collection_name: FakeCollection(key="url")}
+    engine = get_engine(pipeline, RETRY_TIMES=1, RETRY_HTTP_CODES=[503])
+    stats = engine.run([*urls.values(), server.url("/missing"), server.url("/unavailable"), server.url("/slow?seconds=0")])
+
+    expected = [
+        pipeline.to_document(extract_beer(get_response(website).replace(url=urls[website.url])))
+        for website in website_data.values()
+    ]
+    assert all(document["name"] for document in expected)
+    documents = pipeline.db[MongoDBPipeline.collection_name].documents
+    assert sorted(documents.values(), key=lambda document: document["url"]) == sorted(
+        expected, key=lambda document: document["url"]
+    )
+    assert stats["item_scraped_count"] == len(urls)
+    assert stats["mongodb/documents_written"] == len(urls)
+    assert stats["downloader/request_count"] == len(urls) + 4
+    assert stats["downloader/response_status_count/404"] == 1
+    assert stats["downloader/response_status_count/503"] == 2
+    assert stats["retry/count"] == 1
+    assert stats["pages/not_beer"] == 1
+    assert stats["extraction/pages"] == len(urls) + 1
+    assert stats["finish_reason"] == "finished"
+
+
+def test_concurrency_per_host(server):
+    """Tests requests to a host are limited to `CONCURRENT_REQUESTS_PER_DOMAIN` at once"""
+    engine = get_engine(CONCURRENT_REQUESTS_PER_DOMAIN=2)
+    start = time.monotonic()
+    stats = engine.run([server.url(f"/slow?seconds=0.2&page={page}") for page in range(6)])
+    assert server.max_active == 2
+    assert stats["response_received_count"] == 6
+    assert time.monotonic() - start >= 0.6
+
+
+def test_download_timeout(server):
+    """Tests pages slower than `DOWNLOAD_TIMEOUT` are download errors"""
+    engine = get_engine(DOWNLOAD_TIMEOUT=0.2, RETRY_ENABLED=False)
+    stats = engine.run([server.url("/slow?seconds=1")])
+    assert stats["downloader/exception_count"] == 1
+    assert stats.get("response_received_count", 0) == 0
+    assert stats.get("item_scraped_count", 0) == 0
+
+
+def test_robotstxt(server):
+    """Tests urls their host's robots.txt disallows are dropped with `ROBOTSTXT_OBEY`, robots.txt is fetched once"""
+    server.pages["/robots.txt"] = b"User-agent: *\nDisallow: /private\n"
+    urls = [server.url("/slow?seconds=0"), server.url("/private/beer"), server.url("/private/other")]
+    stats = get_engine(ROBOTSTXT_OBEY=True).run(urls)
+    assert stats["robotstxt/request_count"] == 1
+    assert stats["robotstxt/forbidden"] == 2
+    assert stats["downloader/request_count"] == 1
+
+    stats = get_engine(ROBOTSTXT_OBEY=False).run(urls)
+    assert "robotstxt/request_count" not in stats
+    assert stats["downloader/request_count"] == 3
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+from crawl_runner import ReactorCrawlRunner, SharedPoolHTTPDownloadHandler
+from scrapy.settings import Settings
+import pytest
+import scrapy
+import threading
+
+
+class PageSpider(scrapy.Spider):
+    """Downloads `url` and records the thread its callback ran on"""
+    name = "page"
+
+    def __init__(self, url, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.start_urls = [url]
+
+    def parse(self, response):
+        self.crawler.stats.set_value("parse_thread", threading.current_thread().name)
+        yield {"url": response.url, "status": response.status}
+
+
+class BrokenSpider(scrapy.Spider):
+    name = "broken"
+
+    def __init__(self, *args, **kwargs):
+        raise ValueError("no url")
+
+
+@pytest.fixture(scope="module")
+def crawl_runner():
+    # The reactor can't be restarted, one runner serves every test of the module
+    return ReactorCrawlRunner({
+        "LOG_ENABLED": False,
+        "ROBOTSTXT_OBEY": False,
+        "TELNETCONSOLE_ENABLED": False,
+        "DOWNLOAD_HANDLERS": {
+            "http": "crawl_runner.SharedPoolHTTPDownloadHandler",
+            "https": "crawl_runner.SharedPoolHTTPDownloadHandler",
+        },
+    })
+
+
+# Tests
+def test_crawl_from_thread(crawl_runner, server):
+    """Tests a crawl requested from another thread runs on the reactor thread and resolves with its stats"""
+    stats = crawl_runner.crawl(PageSpider, url=server.url("/slow?seconds=0")).result(timeout=30)
+    assert stats["item_scraped_count"] == 1
+    assert stats["parse_thread"] == "crawl-reactor"
+    assert stats["finish_reason"] == "finished"
+
+
+def test_concurrent_crawls(crawl_runner, server):
+    """Tests crawls requested at once from several threads run concurrently, with their own settings"""
+    with ThreadPoolExecutor(4) as executor:
+        futures = [
+            executor.submit(
+                lambda page: crawl_runner.crawl(
+                    PageSpider, settings={"USER_AGENT": f"crawl-{page}"}, url=server.url(f"/slow?seconds=0.5&page={page}")
+                ).result(timeout=30),
+                page
+            )
+            for page in range(4)
+        ]
+        results = [future.result() for future in futures]
+    assert [stats["item_scraped_count"] for stats in results] == [1, 1, 1, 1]
+    assert server.max_active > 1
+
+
+def test_crawl_errors_reach_future(crawl_runner):
+    """Tests a crawl which fails to start raises from its future"""
+    with pytest.raises(ValueError, match="no url"):
+        crawl_runner.crawl(BrokenSpider).result(timeout=30)
+
+
+def test_shared_pool_download_handler():
+    """Tests download handlers share one connection pool which outlives them"""
+    settings = Settings({"CONCURRENT_REQUESTS_PER_DOMAIN": 2})
+    first = SharedPoolHTTPDownloadHandler(settings)
+    second = SharedPoolHTTPDownloadHandler(settings)
+    assert first._pool is second._pool is SharedPoolHTTPDownloadHandler.shared_pool
+    assert first.close().called
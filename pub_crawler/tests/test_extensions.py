@@ -0,0 +1,46 @@
+from pub_crawler.pub_crawler.extensions import CrawlJobProgress
+from pub_crawler.tests.conftest import FakeCollection
+from scrapy.utils.test import get_crawler
+
+
+def get_extension():
+    crawler = get_crawler()
+    return CrawlJobProgress("job-1", FakeCollection(), crawler.stats, interval=0), crawler.stats
+
+
+# Tests
+def test_crawl_job_progress():
+    """Tests a crawl job's document follows the crawl from its start to its end"""
+    extension, stats = get_extension()
+    extension.spider_opened(spider=None)
+    job = extension.collection.documents["job-1"]
+    assert job["status"] == "running"
+    assert job["progress"]["pages_fetched"] == 0
+    assert job["progress"]["errors"] == 0
+
+    stats.set_value("response_received_count", 12)
+    stats.set_value("downloader/response_bytes", 4096)
+    stats.set_value("item_scraped_count", 4)
+    stats.set_value("mongodb/documents_written", 3)
+    stats.set_value("mongodb/documents_unchanged", 1)
+    stats.set_value("extraction/time", 0.25)
+    stats.set_value("log_count/ERROR", 2)
+    stats.set_value("spider_exceptions/ValueError", 1)
+    stats.set_value("spider_exceptions/KeyError", 1)
+    extension.started -= 4
+    extension.update()
+    progress = job["progress"]
+    assert progress["pages_fetched"] == 12
+    assert 2.5 < progress["pages_per_second"] <= 3
+    assert progress["bytes_downloaded"] == 4096
+    assert progress["items_scraped"] == 4
+    assert progress["items_stored"] == 4
+    assert progress["extraction_time"] == 0.25
+    assert progress["errors"] == 2
+    assert progress["spider_exceptions"] == 2
+
+    extension.spider_closed(spider=None, reason="finished")
+    assert job["status"] == "finished"
+    assert job["finish_reason"] == "finished"
+    assert job["finished_at"] >= job["started_at"]
+    assert job["elapsed_seconds"] >= 4
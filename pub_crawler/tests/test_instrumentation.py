@@ -0,0 +1,56 @@
+import pstats
+import time
+
+from pub_crawler.pub_crawler.instrumentation import EXTRACTOR_SECONDS, SlowPageProfiler, recording_stats, timed
+from scrapy.utils.test import get_crawler
+
+
+@timed('test_extractor')
+def extractor(seconds=0.0):
+    time.sleep(seconds)
+    return "value"
+
+
+def get_histogram_count(name):
+    for metric in EXTRACTOR_SECONDS.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count") and sample.labels["extractor"] == name:
+                return sample.value
+    return 0
+
+
+# Tests
+def test_timed():
+    """Tests timed calls are recorded to the histogram and, while recording, to the crawler's stats"""
+    stats = get_crawler().stats
+    count = get_histogram_count('test_extractor')
+    assert extractor() == "value"
+    assert stats.get_value('timing/test_extractor/count') is None
+
+    with recording_stats(stats):
+        extractor()
+        extractor(0.01)
+    assert get_histogram_count('test_extractor') == count + 3
+    assert stats.get_value('timing/test_extractor/count') == 2
+    assert stats.get_value('timing/test_extractor/time_max') >= 0.01
+    assert stats.get_value('timing/test_extractor/time') >= stats.get_value('timing/test_extractor/time_max')
+
+
+def test_slow_page_profiler(tmp_path):
+    """Tests only the slowest pages' profiles are kept and dumped, the slowest first"""
+    profiler = SlowPageProfiler(keep=2)
+    for url, seconds in [("https://example.com/a", 0.03), ("https://example.com/b", 0.0), ("https://example.com/c", 0.01)]:
+        with profiler.profile(url):
+            extractor(seconds)
+
+    paths = profiler.dump(str(tmp_path))
+    assert [path.rsplit("/", 1)[-1] for path in paths] == [
+        "01-https-example-com-a.pstats",
+        "02-https-example-com-c.pstats"
+    ]
+    assert pstats.Stats(paths[0]).total_calls > 0
+
+    profiler = SlowPageProfiler(keep=2, sample_rate=0.0)
+    with profiler.profile("https://example.com/a"):
+        extractor()
+    assert profiler.slowest == []
@@ -0,0 +1,126 @@
+import time
+
+import pytest
+from pub_crawler.pub_crawler.frontier import FrontierEntry, MongoFrontierStore, SQLiteFrontierStore, url_fingerprint
+from pub_crawler.pub_crawler.middlewares import FrontierMiddleware, PageStoreMiddleware
+from pub_crawler.pub_crawler.page_store import PageStore
+from pub_crawler.tests.conftest import FakeCollection, ImmediateReactor, ImmediateThreadPool
+from scrapy import Request
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse, Response
+from scrapy.utils.test import get_crawler
+from types import SimpleNamespace
+
+
+URL = "https://www.stonebrewing.com/beer/year-round-releases/stone-ipa"
+
+
+def get_middleware(ttl=60):
+    """Returns a FrontierMiddleware backed by an in-memory SQLite store"""
+    crawler = get_crawler()
+    return FrontierMiddleware(SQLiteFrontierStore(":memory:"), ttl, crawler.stats)
+
+
+# Tests
+def test_url_fingerprint():
+    """Tests equivalent urls share a fingerprint"""
+    assert url_fingerprint("https://example.com/beer?b=2&a=1#abv") == url_fingerprint("https://example.com/beer?a=1&b=2")
+    assert url_fingerprint("https://example.com/beer/ipa") != url_fingerprint("https://example.com/beer/stout")
+
+
+def test_frontier_skips_fresh_pages():
+    """Tests pages downloaded within the TTL are not requested again"""
+    middleware = get_middleware()
+    request = Request(URL)
+    assert middleware.process_request(request, spider=None) is None
+
+    response = HtmlResponse(URL, status=200, headers={"ETag": '"v1"'}, request=request)
+    assert middleware.process_response(request, response, spider=None) is response
+
+    with pytest.raises(IgnoreRequest):
+        middleware.process_request(Request(URL), spider=None)
+    assert middleware.process_request(Request(URL, dont_filter=True), spider=None) is None
+
+
+def test_frontier_revalidates_stale_pages():
+    """Tests stale pages are requested conditionally and dropped when not modified"""
+    middleware = get_middleware()
+    middleware.store.put(url_fingerprint(URL), URL, FrontierEntry(
+        fetched_at=time.time() - 120,
+        etag='"v1"',
+        last_modified="Tue, 28 Dec 2021 17:39:50 GMT"
+    ))
+
+    request = Request(URL)
+    assert middleware.process_request(request, spider=None) is None
+    assert request.headers["If-None-Match"] == b'"v1"'
+    assert request.headers["If-Modified-Since"] == b"Tue, 28 Dec 2021 17:39:50 GMT"
+
+    with pytest.raises(IgnoreRequest):
+        middleware.process_response(request, HtmlResponse(URL, status=304, request=request), spider=None)
+    assert middleware.store.get(url_fingerprint(URL)).fetched_at > time.time() - 60
+    assert middleware.stats.get_value("frontier/not_modified") == 1
+
+
+def test_frontier_always_downloads_robots_and_link_pages():
+    """Tests robots.txt and pages followed for their links are downloaded however fresh they are"""
+    middleware = get_middleware()
+    robots_url = "https://www.stonebrewing.com/robots.txt"
+    catalog_url = "https://www.stonebrewing.com/beer"
+    spider = SimpleNamespace(max_depth=2)
+    for url in [robots_url, catalog_url, URL]:
+        middleware.store.put(url_fingerprint(url), url, FrontierEntry(fetched_at=time.time(), etag=None, last_modified=None))
+
+    robots_request = Request(robots_url, meta={"dont_obey_robotstxt": True})
+    assert middleware.process_request(robots_request, spider) is None
+    response = HtmlResponse(robots_url, status=304, request=robots_request)
+    assert middleware.process_response(robots_request, response, spider) is response
+    assert middleware.process_request(Request(catalog_url, meta={"depth": 1}), spider) is None
+    with pytest.raises(IgnoreRequest):
+        middleware.process_request(Request(URL, meta={"depth": 2}), spider)
+
+
+def test_mongo_frontier_store():
+    """Tests the mongo store loads the crawled domains' entries when opened and writes new ones in batches"""
+    collection = FakeCollection()
+    for fingerprint, domain in [("stone", "stonebrewing.com"), ("other", "example.com")]:
+        collection.documents[fingerprint] = {
+            "_id": fingerprint, "url": URL, "domain": domain, "fetched_at": 1.0, "etag": '"v1"', "last_modified": None
+        }
+    store = MongoFrontierStore(collection, batch_size=2)
+    store.reactor, store.threadpool = ImmediateReactor(), ImmediateThreadPool()
+    store.open(["stonebrewing.com"])
+    assert store.get("stone") == FrontierEntry(1.0, '"v1"', None)
+    assert store.get("other") is None
+
+    urls = [URL, "https://shop.stonebrewing.com/gift-cards", "https://www.stonebrewing.com/beer"]
+    entry = FrontierEntry(fetched_at=2.0, etag=None, last_modified=None)
+    for url in urls[:2]:
+        store.put(url_fingerprint(url), url, entry)
+    assert collection.batches == [[url_fingerprint(url) for url in urls[:2]]]
+    assert collection.documents[url_fingerprint(urls[1])] == {
+        "_id": url_fingerprint(urls[1]), "url": urls[1], "domain": "stonebrewing.com", **entry._asdict()
+    }
+    store.put(url_fingerprint(urls[2]), urls[2], entry)
+    assert store.get(url_fingerprint(urls[2])) == entry
+    assert len(collection.batches) == 1
+    store.close()
+    assert collection.batches[1] == [url_fingerprint(urls[2])]
+
+
+def test_page_store_middleware(tmp_path):
+    """Tests only successful text responses are stored"""
+    crawler = get_crawler()
+    middleware = PageStoreMiddleware(PageStore(str(tmp_path)), crawler.stats)
+    request = Request(URL)
+    for response in [
+        HtmlResponse(URL, status=200, body=b"<html>IPA</html>", request=request),
+        HtmlResponse(URL + "-missing", status=404, body=b"<html>Not Found</html>", request=request),
+        Response(URL + ".png", status=200, body=b"\x89PNG", request=request),
+    ]:
+        assert middleware.process_response(request, response, spider=None) is response
+    middleware.spider_closed(spider=None)
+
+    store = PageStore(str(tmp_path))
+    assert [page.url for page in store.pages()] == [URL]
+    assert crawler.stats.get_value("pagestore/pages") == 1
@@ -0,0 +1,31 @@
+from pub_crawler.pub_crawler.normalization import abv_percent, canonical_style, name_key, normalized_fields
+
+
+# Tests
+def test_abv_percent():
+    """Tests ABVs are parsed from the ways pages write them"""
+    assert abv_percent("9.4%") == 9.4
+    assert abv_percent("ABV 9,4 %") == 9.4
+    assert abv_percent("6.9% ABV") == 6.9
+    assert abv_percent("7") == 7.0
+    assert abv_percent("150%") is None
+    assert abv_percent("Style") is None
+    assert abv_percent(None) is None
+
+
+def test_canonical_style():
+    """Tests styles map to the style tag they end with"""
+    assert canonical_style("Double IPA") == "ipa"
+    assert canonical_style("Hazy IPA") == "ipa"
+    assert canonical_style("Barrel-Aged Russian Imperial Stout") == "russian imperial stout"
+    assert canonical_style("Czech Style Pilsner") == "czech style pilsner"
+    assert canonical_style("Belgian Style Golden Ale") is None
+    assert canonical_style(None) is None
+
+
+def test_normalized_fields():
+    """Tests the query fields derived from an item"""
+    assert normalized_fields({"name": " Stone  IPA ", "style": "IPA", "ABV": "6.9%"}) == {
+        "abv_pct": 6.9, "style_canonical": "ipa", "name_key": "stone ipa"
+    }
+    assert name_key("") is None
@@ -0,0 +1,36 @@
+from pub_crawler.pub_crawler.commands.reextract import reextract_page
+from pub_crawler.pub_crawler.page_store import PageStore
+
+from .conftest import STONE_IPA_DATA, get_response
+
+
+URL = "https://www.stonebrewing.com/beer/year-round-releases/stone-ipa"
+
+
+# Tests
+def test_page_store(tmp_path):
+    """Tests pages are stored by canonical url and identical bodies are only written once"""
+    store = PageStore(str(tmp_path))
+    assert store.put(URL + "?b=2&a=1", b"<html>v1</html>", "utf-8") > 0
+    assert store.put(URL + "/other", b"<html>v1</html>", "utf-8") == 0
+    store.put(URL + "?a=1&b=2", b"<html>v2</html>", "utf-8")
+    store.close()
+
+    store = PageStore(str(tmp_path))
+    pages = list(store.pages())
+    assert [page.url for page in pages] == [URL + "/other", URL + "?a=1&b=2"]
+    assert [store.read(page) for page in pages] == [b"<html>v1</html>", b"<html>v2</html>"]
+    store.close()
+
+
+def test_reextract_page(tmp_path):
+    """Tests stored pages are re-extracted to the items a crawl would scrape"""
+    response = get_response(STONE_IPA_DATA)
+    store = PageStore(str(tmp_path))
+    store.put(response.url, response.body, response.encoding)
+    store.close()
+
+    store = PageStore(str(tmp_path))
+    [page] = store.pages()
+    item = reextract_page(str(tmp_path), page, 2)
+    assert item == {"name": "Stone IPA", "style": "IPA", "ABV": "6.9%", "url": page.url}
@@ -0,0 +1,135 @@
+from pub_crawler.pub_crawler.pipelines import AsyncMongoDBPipeline, MongoDBPipeline
+from pub_crawler.tests.conftest import FakeCollection, ImmediateReactor, ImmediateThreadPool
+from pymongo.errors import AutoReconnect
+from scrapy.utils.test import get_crawler
+from twisted.internet.defer import Deferred
+
+
+class FailingCollection(FakeCollection):
+    """FakeCollection whose first `failures` bulk writes fail as if MongoDB were unreachable"""
+
+    def __init__(self, failures):
+        super().__init__(key="url")
+        self.failures = failures
+
+    def bulk_write(self, requests, ordered=True):
+        if self.failures > 0:
+            self.failures -= 1
+            raise AutoReconnect("connection refused")
+        return super().bulk_write(requests, ordered)
+
+
+def get_pipeline(pipeline_class=MongoDBPipeline, **settings):
+    """Returns a pipeline built from crawler settings which writes to a FakeCollection"""
+    crawler = get_crawler(settings_dict={"MONGODB_FLUSH_INTERVAL": 0, **settings})
+    pipeline = pipeline_class.from_crawler(crawler)
+    pipeline.collection = FakeCollection(key="url")
+    pipeline.db = {MongoDBPipeline.collection_name: pipeline.collection}
+    return pipeline, crawler.stats
+
+
+def get_items(count):
+    return [{"name": f"Beer {i}", "style": "IPA", "ABV": "6.9%", "url": f"https://example.com/{i}"} for i in range(count)]
+
+
+def get_urls(items):
+    return [item["url"] for item in items]
+
+
+# Tests
+def test_process_item_batches():
+    """Tests items are buffered and written once the batch size is reached"""
+    pipeline, stats = get_pipeline(MONGODB_BATCH_SIZE=2)
+    items = get_items(3)
+    for item in items:
+        assert pipeline.process_item(item, spider=None) is item
+
+    assert pipeline.collection.batches == [get_urls(items[:2])]
+    assert [document["url"] for document in pipeline.buffer] == get_urls(items[2:])
+    assert stats.get_value("mongodb/documents_written") == 2
+
+
+def test_close_spider_flushes():
+    """Tests the remaining buffered items are written when the spider closes"""
+    pipeline, stats = get_pipeline(MONGODB_BATCH_SIZE=10)
+    items = get_items(3)
+    for item in items:
+        pipeline.process_item(item, spider=None)
+    assert pipeline.collection.batches == []
+
+    pipeline.close_spider(spider=None)
+    assert pipeline.collection.batches == [get_urls(items)]
+    assert stats.get_value("mongodb/documents_written") == 3
+    assert stats.get_value("mongodb/flushes") == 1
+
+
+def test_unchanged_items_are_not_rewritten():
+    """Tests re-crawled items upsert by url and are only written when their content changed"""
+    pipeline, stats = get_pipeline(MONGODB_BATCH_SIZE=10)
+    items = get_items(3)
+    for item in items:
+        pipeline.process_item(item, spider=None)
+    pipeline.flush()
+
+    changed_item = dict(items[1], ABV="7.1%")
+    for item in [items[0], changed_item, items[2]]:
+        pipeline.process_item(item, spider=None)
+    pipeline.flush()
+
+    assert pipeline.collection.batches == [get_urls(items), [changed_item["url"]]]
+    assert len(pipeline.collection.documents) == 3
+    assert pipeline.collection.documents[changed_item["url"]]["ABV"] == "7.1%"
+    assert stats.get_value("mongodb/documents_written") == 4
+    assert stats.get_value("mongodb/documents_unchanged") == 2
+
+
+def test_documents_hold_normalized_fields():
+    """Tests documents are written with the normalized query fields, which have their indexes"""
+    pipeline, stats = get_pipeline(MONGODB_BATCH_SIZE=1)
+    pipeline.create_indexes()
+    assert set(pipeline.collection.indexes) == {"url_unique", "style_abv", "abv", "style_name", "name"}
+
+    item = {"name": "Stone IPA", "style": "West Coast IPA", "ABV": "6.9%", "url": "https://example.com/stone-ipa"}
+    pipeline.process_item(item, spider=None)
+    document = pipeline.collection.documents[item["url"]]
+    assert document["ABV"] == "6.9%"
+    assert document["abv_pct"] == 6.9
+    assert document["style_canonical"] == "ipa"
+    assert document["name_key"] == "stone ipa"
+
+
+def test_async_process_item_waits_for_write():
+    """Tests items filling a batch are held until the batch has been written off the reactor"""
+    pipeline, stats = get_pipeline(AsyncMongoDBPipeline, MONGODB_BATCH_SIZE=2)
+    pipeline.reactor = ImmediateReactor()
+    pipeline.threadpool = ImmediateThreadPool()
+    items = get_items(3)
+
+    assert pipeline.process_item(items[0], spider=None) is items[0]
+    result = pipeline.process_item(items[1], spider=None)
+    assert isinstance(result, Deferred)
+    assert result.result is items[1]
+    assert pipeline.collection.batches == [get_urls(items[:2])]
+
+    pipeline.process_item(items[2], spider=None)
+    pipeline.close_spider(spider=None)
+    assert pipeline.collection.batches == [get_urls(items[:2]), get_urls(items[2:])]
+    assert stats.get_value("mongodb/documents_written") == 3
+    assert not pipeline.pending_writes
+
+
+def test_async_close_spider_retries_failed_batch():
+    """Tests a batch failing in the final flush is retried once, and counted as lost if that fails too"""
+    for failures, written, lost in [(1, 3, None), (2, None, 3)]:
+        pipeline, stats = get_pipeline(AsyncMongoDBPipeline, MONGODB_BATCH_SIZE=10)
+        pipeline.reactor = ImmediateReactor()
+        pipeline.threadpool = ImmediateThreadPool()
+        pipeline.collection = FailingCollection(failures)
+        pipeline.db = {MongoDBPipeline.collection_name: pipeline.collection}
+        for item in get_items(3):
+            pipeline.process_item(item, spider=None)
+
+        pipeline.close_spider(spider=None)
+        assert stats.get_value("mongodb/documents_written") == written
+        assert stats.get_value("mongodb/documents_lost") == lost
+        assert pipeline.buffer == []
@@ -0,0 +1,151 @@
+from pub_crawler.tests.conftest import FakeCollection
+from response_cache import ResponseCache
+from types import SimpleNamespace
+import pytest
+import response_cache
+
+
+class FakeClock:
+    """Stands in for the `time` module, time only moves on when told to"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+
+def get_db():
+    return SimpleNamespace(response_cache_state=FakeCollection(), response_cache=FakeCollection())
+
+
+# Tests
+def test_lru_eviction(clock):
+    """Tests the least recently used response is evicted once `max_entries` are cached"""
+    cache = ResponseCache(get_db(), max_entries=2)
+    cache.put("/a", 0, b"a", "application/json")
+    cache.put("/b", 0, b"b", "application/json")
+    assert cache.get("/a", 0).body == b"a"
+    cache.put("/c", 0, b"c", "application/json")
+    assert list(cache.entries) == ["/a", "/c"]
+    assert cache.get("/b", 0) is None
+
+
+def test_ttl_expiry(clock):
+    """Tests responses are only served for `ttl` seconds, from the process and from the shared collection"""
+    db = get_db()
+    cache = ResponseCache(db, ttl=10, shared=True)
+    entry = cache.put("/a", 0, b"a", "application/json")
+    clock.now += 9
+    assert cache.get("/a", 0) == entry
+    clock.now += 1
+    assert cache.get("/a", 0) is None
+    assert "/a" not in cache.entries
+    assert ResponseCache(db, ttl=10, shared=True).get("/a", 0) is None
+
+
+def test_shared_between_processes(clock):
+    """Tests a response cached by one process is served by another one sharing the collection"""
+    db = get_db()
+    entry = ResponseCache(db, shared=True).put("/a", 0, b"a", "application/json")
+    other = ResponseCache(db, shared=True)
+    assert other.get("/a", 0) == entry
+    assert "/a" in other.entries
+    assert other.get("/a", 1) is None
+    assert ResponseCache(db).get("/a", 0) is None
+
+
+def test_invalidate_bumps_generation(clock):
+    """Tests invalidating starts a new generation at once in its process and within `generation_interval` in others"""
+    db = get_db()
+    cache = ResponseCache(db, generation_interval=1)
+    other = ResponseCache(db, generation_interval=1)
+    assert cache.generation() == other.generation() == 0
+    cache.put("/a", 0, b"a", "application/json")
+    cache.invalidate()
+    assert db.response_cache_state.documents["generation"]["value"] == 1
+    assert cache.entries == {}
+    assert cache.generation() == 1
+    assert other.generation() == 0
+    clock.now += 1
+    assert other.generation() == 1
+
+
+def test_put_before_generation_bump(clock):
+    """Tests a response built while a crawl finished is cached in the generation it was built in and not served after"""
+    db = get_db()
+    cache = ResponseCache(db, generation_interval=0, shared=True)
+    generation = cache.generation()
+    # Another process invalidates while the response is built
+    ResponseCache(db).invalidate()
+    cache.put("/a", generation, b"stale", "application/json")
+    assert cache.get("/a", cache.generation()) is None
+    assert ResponseCache(db, shared=True).get("/a", 1) is None
+
+
+@pytest.fixture
+def app(app_module, monkeypatch, clock):
+    monkeypatch.setattr(app_module, "response_cache", ResponseCache(get_db(), max_body_size=8))
+    return app_module
+
+
+def call(app, view, path="/beers?style=IPA", headers=None):
+    with app.app.test_request_context(path, headers=headers):
+        return app.cached_response(view)()
+
+
+def test_cached_response(app):
+    """Tests a view's response is built once and revalidated with its ETag"""
+    calls = []
+
+    def view():
+        calls.append(1)
+        return app.Response(b'["IPA"]', mimetype="application/json")
+
+    response = call(app, view)
+    assert response.status_code == 200
+    assert response.get_data() == b'["IPA"]'
+    assert response.headers["Cache-Control"] == "no-cache"
+    etag = response.headers["ETag"]
+    assert call(app, view).get_data() == b'["IPA"]'
+    assert len(calls) == 1
+
+    response = call(app, view, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert call(app, view, headers={"If-None-Match": '"other"'}).status_code == 200
+    assert len(calls) == 1
+
+    call(app, view, path="/beers?style=Stout")
+    assert len(calls) == 2
+
+
+def test_cached_response_not_cached(app):
+    """Tests responses other than 200s and bodies larger than `max_body_size` are served but not cached"""
+    calls = []
+
+    def missing():
+        calls.append(1)
+        return app.Response(b"missing", status=404)
+
+    def large():
+        calls.append(1)
+        return app.Response(iter([b"12345", b"67890", b"12"]), mimetype="application/json")
+
+    assert call(app, missing).status_code == 404
+    assert call(app, missing).status_code == 404
+    assert len(calls) == 2
+
+    assert call(app, large, path="/large").get_data() == b"123456789012"
+    assert call(app, large, path="/large").get_data() == b"123456789012"
+    assert len(calls) == 4
+    assert app.response_cache.entries == {}
@@ -0,0 +1,34 @@
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+from datetime import date, datetime
+from serialization import dumps
+import json
+import pytest
+
+
+# Tests
+def test_dumps():
+    """Tests BSON types are converted wherever they sit in a document"""
+    object_id = ObjectId("5f50c31e8a7d4b1c9c8e4a21")
+    document = {
+        "_id": object_id,
+        "crawled_at": datetime(2022, 1, 1, 12, 30, 5),
+        "brewed_on": date(2021, 12, 24),
+        "abv_exact": Decimal128("6.90"),
+        "related": [{"_id": object_id}],
+        "name": "Stone IPA",
+    }
+    assert json.loads(dumps([document])) == [{
+        "_id": "5f50c31e8a7d4b1c9c8e4a21",
+        "crawled_at": "2022-01-01T12:30:05",
+        "brewed_on": "2021-12-24",
+        "abv_exact": "6.90",
+        "related": [{"_id": "5f50c31e8a7d4b1c9c8e4a21"}],
+        "name": "Stone IPA",
+    }]
+
+
+def test_dumps_unknown_type():
+    """Tests types the encoder does not know still fail"""
+    with pytest.raises(TypeError):
+        dumps({"tags": {"IPA"}})
@@ -0,0 +1,102 @@
+import lxml.html
+from pub_crawler.pub_crawler.templates import ExtractionTemplates, LocatedText, PageTemplate, read_text, text_path
+from pub_crawler.tests.conftest import FakeCollection
+
+
+# Tests
+def test_text_path():
+    """Tests text nodes, tails included, are found again at their path"""
+    root = lxml.html.fromstring("<html><body><div>Style<!-- c --> IPA<b>ABV</b> 6.9% <i>x</i></div></body></html>")
+    texts = root.xpath("//div//text()")
+    assert [text_path(text) for text in texts] == [
+        "/html/body/div/text()[1]",
+        "/html/body/div/text()[2]",
+        "/html/body/div/b/text()[1]",
+        "/html/body/div/text()[3]",
+        "/html/body/div/i/text()[1]",
+    ]
+    assert [read_text(root, text_path(text)) for text in texts] == ["Style", "IPA", "ABV", "6.9%", "x"]
+    assert text_path("plain") is None
+    assert read_text(root, "/html/body/p/text()[1]") is None
+    assert read_text(root, "/html/body/[") is None
+
+
+def test_page_template():
+    """Tests a template only learns paths which give the value back and only reads valid values"""
+    root = lxml.html.fromstring("<html><body><div>Stone IPA</div><span>6.9%</span></body></html>")
+    name, abv = (LocatedText(text, text_path(text)) for text in root.xpath("//div/text() | //span/text()"))
+    template = PageTemplate({})
+    template.learn(root, "name", name, lambda text: True)
+    template.learn(root, "ABV", abv, lambda text: False)
+    template.learn(root, "style", "IPA", lambda text: True)
+    assert template.learned == {"name": "/html/body/div/text()[1]"}
+
+    template = PageTemplate(template.learned)
+    assert template.read(root, "name", lambda text: text.startswith("Stone")) == "Stone IPA"
+    assert template.read(root, "name", lambda text: False) is None
+    assert template.read(root, "ABV", lambda text: True) is None
+
+
+def test_extraction_templates():
+    """Tests templates are saved in one write, the most recent loaded back and evicted least recently used first"""
+    collection = FakeCollection()
+    templates = ExtractionTemplates(collection, max_domains=2)
+    templates.learn("a.com", {"name": "/html/body/h1/text()[1]"})
+    templates.learn("a.com", {"ABV": "/html/body/p/text()[1]"})
+    templates.learn("b.com", {"name": "/html/body/h2/text()[1]"})
+    assert collection.documents == {}
+    templates.save(templates.unsaved())
+    assert len(collection.batches) == 1
+    assert collection.documents["a.com"]["paths"] == {
+        "name": "/html/body/h1/text()[1]", "ABV": "/html/body/p/text()[1]"
+    }
+    assert templates.unsaved() == {}
+    collection.documents["b.com"]["updated_at"] -= 1
+    collection.documents["c.com"] = {"_id": "c.com", "paths": {}, "updated_at": 0}
+
+    templates = ExtractionTemplates(collection, max_domains=2)
+    templates.load()
+    assert list(templates.templates) == ["b.com", "a.com"]
+    assert templates.get("a.com") == {"name": "/html/body/h1/text()[1]", "ABV": "/html/body/p/text()[1]"}
+    templates.get("b.com")
+    templates.get("a.com")
+    templates.get("c.com")
+    assert list(templates.templates) == ["a.com", "c.com"]
+
+    templates = ExtractionTemplates(max_domains=2)
+    templates.learn("a.com", {"name": "/html/body/h1/text()[1]"})
+    assert templates.get("a.com") == {"name": "/html/body/h1/text()[1]"}
+    assert templates.unsaved() == {}
+
+
+def test_extraction_templates_replace_after():
+    """Tests a domain's path is only replaced by one learned on `replace_after` pages in a row without hits"""
+    templates = ExtractionTemplates(FakeCollection(), replace_after=3)
+    templates.learn("a.com", {"name": "/html/body/h1/text()[1]"})
+    templates.unsaved()
+
+    # Pages of two layouts in turn keep the first layout's path
+    for _ in range(5):
+        templates.learn("a.com", {"name": "/html/body/h2/text()[1]", "ABV": "/html/body/p/text()[1]"})
+        templates.hit("a.com", ["name"])
+    assert templates.get("a.com") == {"name": "/html/body/h1/text()[1]", "ABV": "/html/body/p/text()[1]"}
+
+    # Another path on pages in a row restarts the count
+    templates.learn("a.com", {"name": "/html/body/h2/text()[1]"})
+    templates.learn("a.com", {"name": "/html/body/h3/text()[1]"})
+    templates.learn("a.com", {"name": "/html/body/h2/text()[1]"})
+    templates.learn("a.com", {"name": "/html/body/h2/text()[1]"})
+    assert templates.get("a.com")["name"] == "/html/body/h1/text()[1]"
+    templates.learn("a.com", {"name": "/html/body/h2/text()[1]"})
+    assert templates.get("a.com")["name"] == "/html/body/h2/text()[1]"
+    assert templates.unsaved() == {"a.com": {"ABV": "/html/body/p/text()[1]", "name": "/html/body/h2/text()[1]"}}
+
+
+def test_extraction_templates_replace_stale_field():
+    """Tests a field's stale path is replaced while the other fields are still read through the template"""
+    templates = ExtractionTemplates(replace_after=3)
+    templates.learn("a.com", {"name": "/html/body/h1/text()[1]", "style": "/html/body/p/text()[1]"})
+    for _ in range(3):
+        templates.hit("a.com", ["name"])
+        templates.learn("a.com", {"style": "/html/body/div/text()[1]"})
+    assert templates.get("a.com") == {"name": "/html/body/h1/text()[1]", "style": "/html/body/div/text()[1]"}
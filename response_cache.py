@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+from typing import Optional
+
+from bson.binary import Binary
+from pymongo.errors import PyMongoError
+
+
+logger = logging.getLogger(__name__)
+
+# A cached response: its body, mimetype and ETag, the generation it was built in and when it expires (epoch seconds)
+CachedResponse = namedtuple("CachedResponse", ["body", "mimetype", "etag", "generation", "expires_at"])
+
+
+class ResponseCache:
+    """
+    Cache of read API responses. Every process keeps the `max_entries` most recently used responses, which
+    expire after `ttl` seconds. With `shared`, responses are also kept in the `response_cache` collection so
+    a response built by one gunicorn worker is served by all of them.
+
+    Items only change when a crawl writes them, so responses belong to a generation which `invalidate` bumps
+    once a crawl is done, and are only served in that generation. Processes read the current generation from
+    MongoDB at most every `generation_interval` seconds, finished crawls show within that delay.
+    """
+
+    def __init__(
+            self,
+            db,
+            max_entries: int = 1024,
+            ttl: float = 300.0,
+            shared: bool = False,
+            max_body_size: int = 1024 * 1024,
+            generation_interval: float = 1.0
+    ):
+        self.state = db.response_cache_state
+        self.shared = db.response_cache if shared else None
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_body_size = max_body_size
+        self.generation_interval = generation_interval
+        self.entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.lock = threading.Lock()
+        self._generation = None
+        self._generation_read_at = 0.0
+        self._shared_indexed = False
+
+    def generation(self) -> int:
+        """
+        :return: Current cache generation, as last read from MongoDB
+        """
+        now = time.monotonic()
+        if self._generation is None or now - self._generation_read_at >= self.generation_interval:
+            try:
+                state = self.state.find_one({"_id": "generation"})
+                self._generation = state["value"] if state else 0
+            except PyMongoError as e:
+                # Until MongoDB answers again, responses of the last known generation are served
+                logger.warning("Could not read the response cache generation: %s", e)
+                if self._generation is None:
+                    self._generation = 0
+            self._generation_read_at = now
+        return self._generation
+
+    def get(self, key: str, generation: int) -> Optional[CachedResponse]:
+        """
+        :param key: Request path and query string
+        :param generation: Current generation, see `generation`
+        :return: Response cached in the generation, None when there is none
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry.generation == generation and entry.expires_at > now:
+                    self.entries.move_to_end(key)
+                    return entry
+                del self.entries[key]
+        if self.shared is None:
+            return None
+
+        try:
+            document = self.shared.find_one({"_id": self._shared_id(key), "generation": generation})
+        except PyMongoError as e:
+            logger.warning("Could not read the shared response cache: %s", e)
+            return None
+        if document is None:
+            return None
+        # pymongo returns naive UTC datetimes
+        expires_at = document["expires_at"].replace(tzinfo=timezone.utc).timestamp()
+        if expires_at <= now:
+            return None
+        entry = CachedResponse(bytes(document["body"]), document["mimetype"], document["etag"], generation, expires_at)
+        self._put_local(key, entry)
+        return entry
+
+    def put(self, key: str, generation: int, body: bytes, mimetype: str) -> CachedResponse:
+        """
+        Caches a response
+
+        :param key: Request path and query string
+        :param generation: Generation read before the response was built, so a response built while a crawl
+            finished is never served in the next generation
+        :param body: Response body, at most `max_body_size` bytes
+        :param mimetype: Response mimetype
+        :return: The cached response, its ETag is a hash of its body
+        """
+        entry = CachedResponse(body, mimetype, hashlib.sha1(body).hexdigest(), generation, time.time() + self.ttl)
+        self._put_local(key, entry)
+        if self.shared is not None:
+            try:
+                if not self._shared_indexed:
+                    # Expired responses are removed by MongoDB
+                    self.shared.create_index("expires_at", expireAfterSeconds=0, name="expires_at_ttl")
+                    self._shared_indexed = True
+                self.shared.replace_one({"_id": self._shared_id(key)}, {
+                    "body": Binary(body),
+                    "mimetype": mimetype,
+                    "etag": entry.etag,
+                    "generation": entry.generation,
+                    "expires_at": datetime.fromtimestamp(entry.expires_at, timezone.utc)
+                }, upsert=True)
+            except PyMongoError as e:
+                logger.warning("Could not write the shared response cache: %s", e)
+        return entry
+
+    def invalidate(self):
+        """
+        Starts a new generation, dropping every cached response in all processes
+        """
+        self.state.update_one({"_id": "generation"}, {"$inc": {"value": 1}}, upsert=True)
+        with self.lock:
+            self.entries.clear()
+        self._generation = None
+
+    def _put_local(self, key: str, entry: CachedResponse):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    @staticmethod
+    def _shared_id(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
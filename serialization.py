@@ -0,0 +1,36 @@
+import json
+from datetime import date, datetime
+from typing import Any
+
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+
+
+class MongoJSONEncoder(json.JSONEncoder):
+    """
+    Encodes MongoDB documents directly. BSON types are converted by the `default` hook as the encoder
+    reaches them, so documents are neither copied nor walked twice.
+    """
+
+    def default(self, obj: Any):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        if isinstance(obj, (datetime, date)):
+            return obj.isoformat()
+        if isinstance(obj, Decimal128):
+            # Kept as a string, floats would lose the decimal precision
+            return str(obj.to_decimal())
+        return super().default(obj)
+
+
+_encoder = MongoJSONEncoder()
+
+
+def dumps(obj: Any) -> str:
+    """
+    Serializes MongoDB documents, or lists of them, to JSON
+
+    :param obj: Document or list of documents as returned by pymongo
+    :return: JSON string
+    """
+    return _encoder.encode(obj)